@@ -0,0 +1,272 @@
+#!/usr/bin/env python3
+import time
+import queue
+import asyncio
+import functools
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from sharded_db import open_email_database
+
+# Writes of these kinds that are queued back to back are merged into one
+# bulk call, so a burst of deliveries commits in a single transaction
+BATCHED_WRITES = {
+    "store_email": "store_many",
+    "mark_as_read": "mark_read_many",
+    "delete_email": "delete_many",
+}
+
+class AsyncEmailDatabase:
+    """Asyncio facade over EmailDatabase that never blocks the event loop"""
+    
+    def __init__(self, email_db=None, readers=4, batch_size=100, batch_delay=0.002):
+        """Start the writer thread; readers is the number of concurrent read connections"""
+        self.email_db = email_db or open_email_database()
+        self.batch_size = batch_size
+        self.batch_delay = batch_delay
+        
+        # Every executor thread gets its own pooled connection, so reads run
+        # side by side on separate WAL snapshots while the writer commits
+        self._readers = ThreadPoolExecutor(max_workers=readers, thread_name_prefix="email-db-reader")
+        
+        # A single writer means no two writes in this process wait on the SQLite lock
+        self._writes = queue.Queue()
+        self._writer = threading.Thread(target=self._write_loop, name="email-db-writer", daemon=True)
+        self._writer.start()
+        self.batches = 0
+    
+    async def __aenter__(self):
+        """Use the facade in an async with block"""
+        return self
+    
+    async def __aexit__(self, exc_type, exc, tb):
+        """Close the facade when the block ends"""
+        await self.close()
+    
+    async def _read(self, method, *args, **kwargs):
+        """Run a read-only EmailDatabase method on a reader thread"""
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self._readers, functools.partial(getattr(self.email_db, method), *args, **kwargs))
+    
+    async def _write(self, method, *args):
+        """Queue a write for the writer thread and wait for its result"""
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        self._writes.put((method, args, loop, future))
+        return await future
+    
+    def _write_loop(self):
+        """Collect queued writes into batches and run them in order"""
+        while True:
+            op = self._writes.get()
+            if op is None:
+                return
+            
+            # Wait briefly for more writes so a burst shares one transaction
+            batch = [op]
+            deadline = time.monotonic() + self.batch_delay
+            while len(batch) < self.batch_size:
+                try:
+                    op = self._writes.get(timeout=max(0, deadline - time.monotonic()))
+                except queue.Empty:
+                    break
+                if op is None:
+                    self._run_batch(batch)
+                    return
+                batch.append(op)
+            
+            self._run_batch(batch)
+    
+    def _run_batch(self, batch):
+        """Run a batch, merging consecutive writes of the same batchable kind"""
+        self.batches += 1
+        start = 0
+        
+        while start < len(batch):
+            method = batch[start][0]
+            end = start + 1
+            if method in BATCHED_WRITES:
+                while end < len(batch) and batch[end][0] == method:
+                    end += 1
+            group = batch[start:end]
+            start = end
+            
+            try:
+                if method == "store_email":
+                    results = self.email_db.store_many([args for _, args, _, _ in group])
+                elif method in BATCHED_WRITES:
+                    results = getattr(self.email_db, BATCHED_WRITES[method])([args[0] for _, args, _, _ in group])
+                else:
+                    results = [getattr(self.email_db, method)(*group[0][1])]
+            except Exception as e:
+                for _, _, loop, future in group:
+                    loop.call_soon_threadsafe(self._resolve, future, None, e)
+                continue
+            
+            for (_, _, loop, future), result in zip(group, results):
+                loop.call_soon_threadsafe(self._resolve, future, result, None)
+    
+    @staticmethod
+    def _resolve(future, result, error):
+        """Complete a write future on its own event loop"""
+        if future.cancelled():
+            return
+        if error is not None:
+            future.set_exception(error)
+        else:
+            future.set_result(result)
+    
+    # Writes go through the single batching writer
+    
+    async def store_email(self, recipient, message_data):
+        """Store an email; concurrent calls are committed together"""
+        return await self._write("store_email", recipient, message_data)
+    
+    async def deliver_email(self, recipient, message_data):
+        """Store an email and return (id, created)"""
+        return await self._write("deliver_email", recipient, message_data)
+    
+    async def store_many(self, items):
+        """Store (recipient, message_data) pairs in one transaction"""
+        return await self._write("store_many", list(items))
+    
+    async def store_email_stream(self, recipient, stream, received_date=None, is_read=False):
+        """Store a message read from a binary file object"""
+        return await self._write("store_email_stream", recipient, stream, received_date, is_read)
+    
+    async def mark_as_read(self, email_id):
+        """Mark an email as read"""
+        return await self._write("mark_as_read", email_id)
+    
+    async def mark_read_many(self, email_ids):
+        """Mark several emails as read"""
+        return await self._write("mark_read_many", list(email_ids))
+    
+    async def mark_all_read(self, recipient):
+        """Mark every email in a mailbox as read"""
+        return await self._write("mark_all_read", recipient)
+    
+    async def delete_email(self, email_id):
+        """Delete an email"""
+        return await self._write("delete_email", email_id)
+    
+    async def delete_many(self, email_ids):
+        """Delete several emails"""
+        return await self._write("delete_many", list(email_ids))
+    
+    async def set_quota(self, recipient, max_messages=None, max_bytes=None):
+        """Set a mailbox's quota"""
+        return await self._write("set_quota", recipient, max_messages, max_bytes)
+    
+    # Reads run concurrently on the reader threads
+    
+    async def get_mailbox(self, email_address, limit=50, offset=0):
+        """Get emails for a specific mailbox (recipient)"""
+        return await self._read("get_mailbox", email_address, limit, offset)
+    
+    async def get_mailbox_page(self, email_address, limit=50, page_token=None):
+        """Get one page of a mailbox and the token for the next one"""
+        return await self._read("get_mailbox_page", email_address, limit, page_token)
+    
+    async def get_emails_between(self, recipient, start=None, end=None, limit=50):
+        """Get a mailbox's emails received in [start, end), newest first"""
+        return await self._read("get_emails_between", recipient, start, end, limit)
+    
+    async def get_emails_since(self, recipient, since, limit=50):
+        """Get a mailbox's emails received at or after since"""
+        return await self._read("get_emails_since", recipient, since, limit)
+    
+    async def get_emails_before(self, recipient, before, limit=50):
+        """Get a mailbox's emails received before a moment"""
+        return await self._read("get_emails_before", recipient, before, limit)
+    
+    async def find_emails(self, recipient=None, limit=50, **filters):
+        """Get emails matching header filters, newest first"""
+        return await self._read("find_emails", recipient, limit=limit, **filters)
+    
+    async def get_emails_from_domain(self, domain, since=None, before=None, recipient=None, limit=50):
+        """Get emails whose From address is at a domain, newest first"""
+        return await self._read("get_emails_from_domain", domain, since, before, recipient, limit)
+    
+    async def get_large_emails(self, min_size, recipient=None, limit=50):
+        """Get emails of at least min_size bytes, newest first"""
+        return await self._read("get_large_emails", min_size, recipient, limit)
+    
+    async def get_threads(self, recipient, limit=50, page_token=None):
+        """Get one page of a mailbox's conversations and the next page token"""
+        return await self._read("get_threads", recipient, limit, page_token)
+    
+    async def get_thread_messages(self, recipient, thread_id):
+        """Get the emails of one conversation in a mailbox"""
+        return await self._read("get_thread_messages", recipient, thread_id)
+    
+    async def get_email(self, email_id, include_raw=False):
+        """Get a specific email by ID"""
+        return await self._read("get_email", email_id, include_raw)
+    
+    async def get_headers(self, email_id):
+        """Get the indexed header fields of an email"""
+        return await self._read("get_headers", email_id)
+    
+    async def get_raw_email(self, email_id):
+        """Get the original message bytes of an email"""
+        return await self._read("get_raw_email", email_id)
+    
+    async def get_attachments(self, email_id):
+        """List an email's attachments from the catalog"""
+        return await self._read("get_attachments", email_id)
+    
+    async def get_attachment(self, email_id, part_index):
+        """Get one attachment's decoded bytes, or None"""
+        return await self._read("get_attachment", email_id, part_index)
+    
+    async def search_emails(self, recipient, query, limit=50, offset=0):
+        """Full-text search within one mailbox"""
+        return await self._read("search_emails", recipient, query, limit, offset)
+    
+    async def query_emails(self, recipient, query, limit=50, offset=0):
+        """Structured search within one mailbox, newest first"""
+        return await self._read("query_emails", recipient, query, limit, offset)
+    
+    async def get_modseq(self, recipient):
+        """Highest modseq of a mailbox"""
+        return await self._read("get_modseq", recipient)
+    
+    async def changes_since(self, recipient, modseq):
+        """Rows changed and ids deleted in a mailbox after modseq"""
+        return await self._read("changes_since", recipient, modseq)
+    
+    async def get_mailbox_summary(self, recipient=None):
+        """Get one mailbox's summary, or every mailbox's"""
+        return await self._read("get_mailbox_summary", recipient)
+    
+    async def get_usage(self, recipient):
+        """Get message count, bytes and unread count for a mailbox"""
+        return await self._read("get_usage", recipient)
+    
+    async def get_all_usage(self, limit=50):
+        """Get usage for the largest mailboxes"""
+        return await self._read("get_all_usage", limit)
+    
+    async def get_quota(self, recipient):
+        """Get the effective quota for a mailbox"""
+        return await self._read("get_quota", recipient)
+    
+    async def is_over_quota(self, recipient, incoming_bytes=0):
+        """Check whether accepting another message would exceed the mailbox quota"""
+        return await self._read("is_over_quota", recipient, incoming_bytes)
+    
+    async def get_cache_stats(self):
+        """Message cache counters"""
+        return await self._read("get_cache_stats")
+    
+    async def get_recipients(self):
+        """Get every recipient that has at least one stored email"""
+        return await self._read("get_recipients")
+    
+    async def close(self):
+        """Finish queued writes, stop the threads and close the database"""
+        self._writes.put(None)
+        loop = asyncio.get_running_loop()
+        await loop.run_in_executor(None, self._writer.join)
+        self._readers.shutdown(wait=True)
+        self.email_db.close() 
\ No newline at end of file
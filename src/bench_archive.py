@@ -0,0 +1,83 @@
+#!/usr/bin/env python3
+import os
+import time
+import shutil
+import argparse
+import tempfile
+import resource
+from email.mime.text import MIMEText
+from email_db import EmailDatabase
+from mail_archive import export_maildir, export_mbox, import_maildir, import_mbox
+
+RECIPIENT = "bench@example.com"
+
+def build_message(i, body_size):
+    """Build a test message with a body of about body_size bytes"""
+    msg = MIMEText(f"Message {i}.\n" + ("x" * 75 + "\n") * (body_size // 76), "plain")
+    msg["From"] = "sender@example.com"
+    msg["To"] = RECIPIENT
+    msg["Subject"] = f"Archive benchmark message {i}"
+    msg["Message-ID"] = f"<archive-{i}@example.com>"
+    return msg.as_bytes()
+
+def write_mbox(path, total_bytes, body_size):
+    """Write an mbox file of about total_bytes without holding it in memory; returns the message count"""
+    count = 0
+    written = 0
+    with open(path, 'wb') as f:
+        while written < total_bytes:
+            data = b"From sender@example.com Mon Jan  1 00:00:00 2024\n" + build_message(count, body_size) + b"\n"
+            f.write(data)
+            written += len(data)
+            count += 1
+    return count
+
+def peak_rss_mb():
+    """Peak resident memory of this process in MB"""
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+def report(label, count, size, elapsed):
+    """Print throughput and peak memory for one run"""
+    print(f"  {label:>15}: {count:>8} emails, {size / 1024 / 1024:>8.1f} MB in {elapsed:>7.1f} s, "
+          f"{count / elapsed:>8.0f} emails/s, {size / elapsed / 1024 / 1024:>6.1f} MB/s, "
+          f"peak RSS {peak_rss_mb():.0f} MB")
+
+def parse_arguments():
+    """Parse command line arguments"""
+    parser = argparse.ArgumentParser(description="mbox and Maildir import/export throughput on a large archive")
+    parser.add_argument("--size-mb", type=int, default=2048, help="Approximate size of the generated mbox file in MB")
+    parser.add_argument("--body-size", type=int, default=16384, help="Approximate body size in bytes")
+    parser.add_argument("--dir", help="Directory for the archive and database (default: a temporary directory)")
+    return parser.parse_args()
+
+def main():
+    args = parse_arguments()
+    work_dir = tempfile.mkdtemp(prefix="email_archive_bench_", dir=args.dir)
+    mbox_path = os.path.join(work_dir, "source.mbox")
+
+    try:
+        count = write_mbox(mbox_path, args.size_mb * 1024 * 1024, args.body_size)
+        print(f"{count} emails with ~{args.body_size} byte bodies in a {os.path.getsize(mbox_path) / 1024 / 1024:.0f} MB mbox file")
+        db = EmailDatabase(os.path.join(work_dir, "bench.db"), profile="throughput")
+
+        started = time.monotonic()
+        archive = import_mbox(db, RECIPIENT, mbox_path)
+        report("mbox import", archive.imported, archive.bytes, time.monotonic() - started)
+
+        started = time.monotonic()
+        exported = export_mbox(db, RECIPIENT, os.path.join(work_dir, "export.mbox"))
+        report("mbox export", *exported, time.monotonic() - started)
+
+        started = time.monotonic()
+        exported = export_maildir(db, RECIPIENT, os.path.join(work_dir, "Maildir"))
+        report("Maildir export", *exported, time.monotonic() - started)
+
+        started = time.monotonic()
+        archive = import_maildir(db, "copy@example.com", os.path.join(work_dir, "Maildir"))
+        report("Maildir import", archive.imported, archive.bytes, time.monotonic() - started)
+        db.close()
+    finally:
+        shutil.rmtree(work_dir)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,86 @@
+#!/usr/bin/env python3
+import os
+import time
+import shutil
+import asyncio
+import argparse
+import tempfile
+from email.mime.text import MIMEText
+from email_db import EmailDatabase
+from async_email_db import AsyncEmailDatabase
+
+RECIPIENT = "bench@example.com"
+
+def build_message(i):
+    """Build a small test message"""
+    msg = MIMEText(f"Body of async benchmark message {i}.", "plain")
+    msg["From"] = "sender@example.com"
+    msg["To"] = RECIPIENT
+    msg["Subject"] = f"Async message {i}"
+    msg["Message-ID"] = f"<async-{i}@example.com>"
+    return msg.as_bytes()
+
+def run_sync(db_path, messages, profile):
+    """Store every message with one blocking call and commit each"""
+    db = EmailDatabase(db_path, profile=profile)
+    started = time.perf_counter()
+    for message in messages:
+        db.store_email(RECIPIENT, message)
+    elapsed = time.perf_counter() - started
+    db.close()
+    return elapsed, len(messages)
+
+async def run_async(db_path, messages, profile, concurrency):
+    """Store messages from many concurrent tasks, letting the writer batch them"""
+    async with AsyncEmailDatabase(EmailDatabase(db_path, profile=profile)) as db:
+        pending = iter(messages)
+        
+        async def deliver():
+            for message in pending:
+                await db.store_email(RECIPIENT, message)
+        
+        # Meanwhile the loop stays free; measure how late a 1 ms timer fires
+        lag = []
+        
+        async def ticker():
+            while True:
+                expected = time.perf_counter() + 0.001
+                await asyncio.sleep(0.001)
+                lag.append(time.perf_counter() - expected)
+        
+        tick = asyncio.create_task(ticker())
+        started = time.perf_counter()
+        await asyncio.gather(*[deliver() for _ in range(concurrency)])
+        elapsed = time.perf_counter() - started
+        tick.cancel()
+        
+        return elapsed, db.batches, max(lag) if lag else 0
+
+def parse_arguments():
+    """Parse command line arguments"""
+    parser = argparse.ArgumentParser(description="Blocking EmailDatabase calls versus the asyncio facade")
+    parser.add_argument("--messages", type=int, default=2000, help="Messages stored per run")
+    parser.add_argument("--concurrency", type=int, default=50, help="Concurrent delivery tasks in the async run")
+    parser.add_argument("--profile", default="durable", help="PRAGMA profile for both runs")
+    return parser.parse_args()
+
+def main():
+    args = parse_arguments()
+    db_dir = tempfile.mkdtemp(prefix="email_db_async_")
+    messages = [build_message(i) for i in range(args.messages)]
+    
+    try:
+        sync_elapsed, commits = run_sync(os.path.join(db_dir, "sync.db"), messages, args.profile)
+        async_elapsed, batches, lag = asyncio.run(
+            run_async(os.path.join(db_dir, "async.db"), messages, args.profile, args.concurrency)
+        )
+    finally:
+        shutil.rmtree(db_dir)
+    
+    print(f"{args.messages} messages, {args.profile} profile")
+    print(f"  blocking calls: {args.messages / sync_elapsed:>8.0f} msg/s in {commits} commits")
+    print(f"  asyncio facade: {args.messages / async_elapsed:>8.0f} msg/s in {batches} commits, "
+          f"worst event loop lag {lag * 1000:.1f} ms")
+
+if __name__ == "__main__":
+    main() 
\ No newline at end of file
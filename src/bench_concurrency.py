@@ -0,0 +1,105 @@
+#!/usr/bin/env python3
+import os
+import time
+import shutil
+import argparse
+import tempfile
+import threading
+from email.mime.text import MIMEText
+from email_db import EmailDatabase, PROFILES
+
+RECIPIENT = "bench@example.com"
+
+# The rollback journal configuration used before WAL was enabled
+MODES = {
+    "rollback": dict(PROFILES["durable"], journal_mode="delete"),
+    "durable": PROFILES["durable"],
+    "balanced": PROFILES["balanced"],
+    "throughput": PROFILES["throughput"],
+}
+
+def build_message(i):
+    """Build a small test message"""
+    msg = MIMEText(f"Body of concurrency benchmark message {i}.", "plain")
+    msg["From"] = "sender@example.com"
+    msg["To"] = RECIPIENT
+    msg["Subject"] = f"Concurrency message {i}"
+    msg["Message-ID"] = f"<concurrency-{i}@example.com>"
+    return msg.as_bytes()
+
+def seed_database(db_path, count):
+    """Fill a fresh database with messages to read back"""
+    db = EmailDatabase(db_path, profile="throughput")
+    for i in range(count):
+        db.store_email(RECIPIENT, build_message(i))
+    db.close()
+
+def run_mode(name, profile, db_dir, readers, duration, seed):
+    """Run one writer and several readers against the same database"""
+    db_path = os.path.join(db_dir, f"{name}.db")
+    seed_database(db_path, seed)
+    db = EmailDatabase(db_path, profile=profile)
+    
+    stop = threading.Event()
+    latencies = []
+    writes = [0]
+    lock = threading.Lock()
+    
+    def reader():
+        local = []
+        while not stop.is_set():
+            started = time.perf_counter()
+            db.get_mailbox(RECIPIENT)
+            local.append(time.perf_counter() - started)
+        with lock:
+            latencies.extend(local)
+    
+    def writer():
+        i = seed
+        while not stop.is_set():
+            if db.store_email(RECIPIENT, build_message(i)):
+                writes[0] += 1
+            i += 1
+    
+    threads = [threading.Thread(target=reader) for _ in range(readers)]
+    threads.append(threading.Thread(target=writer))
+    for thread in threads:
+        thread.start()
+    time.sleep(duration)
+    stop.set()
+    for thread in threads:
+        thread.join()
+    db.close()
+    
+    latencies.sort()
+    p99 = latencies[int(len(latencies) * 0.99)] if latencies else 0
+    return {
+        "reads_per_sec": len(latencies) / duration,
+        "writes_per_sec": writes[0] / duration,
+        "p99_read_ms": p99 * 1000,
+    }
+
+def parse_arguments():
+    """Parse command line arguments"""
+    parser = argparse.ArgumentParser(description="Concurrent reader/writer benchmark for journal modes and profiles")
+    parser.add_argument("--readers", type=int, default=4, help="Number of reader threads")
+    parser.add_argument("--duration", type=float, default=5.0, help="Seconds to run each mode")
+    parser.add_argument("--seed", type=int, default=500, help="Messages stored before measuring")
+    return parser.parse_args()
+
+def main():
+    args = parse_arguments()
+    db_dir = tempfile.mkdtemp(prefix="email_db_concurrency_")
+    
+    print(f"1 writer, {args.readers} readers, {args.duration}s per mode")
+    print(f"  {'mode':<12} {'reads/s':>10} {'writes/s':>10} {'p99 read':>12}")
+    try:
+        for name, profile in MODES.items():
+            result = run_mode(name, profile, db_dir, args.readers, args.duration, args.seed)
+            print(f"  {name:<12} {result['reads_per_sec']:>10.0f} {result['writes_per_sec']:>10.0f} "
+                  f"{result['p99_read_ms']:>9.2f} ms")
+    finally:
+        shutil.rmtree(db_dir)
+
+if __name__ == "__main__":
+    main() 
\ No newline at end of file
@@ -0,0 +1,71 @@
+#!/usr/bin/env python3
+import os
+import time
+import shutil
+import argparse
+import tempfile
+from email.mime.text import MIMEText
+from email.mime.multipart import MIMEMultipart
+from email_db import EmailDatabase
+
+RECIPIENT = "bench@example.com"
+
+def build_message(i):
+    """Build a small test message"""
+    msg = MIMEMultipart()
+    msg["From"] = "sender@example.com"
+    msg["To"] = RECIPIENT
+    msg["Subject"] = f"Benchmark message {i}"
+    msg["Message-ID"] = f"<bench-{i}@example.com>"
+    msg.attach(MIMEText(f"Body of benchmark message number {i}.", "plain"))
+    return msg.as_bytes()
+
+def time_calls(func, args_list):
+    """Call func once per argument tuple and return microseconds per call"""
+    started = time.perf_counter()
+    for args in args_list:
+        func(*args)
+    return (time.perf_counter() - started) / len(args_list) * 1e6
+
+def run_benchmark(pooled, iterations, db_dir):
+    """Time every EmailDatabase method with or without the connection pool"""
+    db = EmailDatabase(os.path.join(db_dir, "pooled.db" if pooled else "unpooled.db"), pooled=pooled)
+    messages = [(RECIPIENT, build_message(i)) for i in range(iterations)]
+    
+    results = {}
+    results["store_email"] = time_calls(db.store_email, messages)
+    
+    ids = [mail["id"] for mail in db.get_mailbox(RECIPIENT, limit=iterations)]
+    results["get_mailbox"] = time_calls(db.get_mailbox, [(RECIPIENT,)] * iterations)
+    results["get_email"] = time_calls(db.get_email, [(email_id,) for email_id in ids])
+    results["mark_as_read"] = time_calls(db.mark_as_read, [(email_id,) for email_id in ids])
+    results["search_emails"] = time_calls(db.search_emails, [(RECIPIENT, "number 1")] * iterations)
+    results["delete_email"] = time_calls(db.delete_email, [(email_id,) for email_id in ids])
+    
+    db.close()
+    return results
+
+def parse_arguments():
+    """Parse command line arguments"""
+    parser = argparse.ArgumentParser(description="Microbenchmark for EmailDatabase methods")
+    parser.add_argument("--iterations", type=int, default=500, help="Calls per method")
+    return parser.parse_args()
+
+def main():
+    args = parse_arguments()
+    db_dir = tempfile.mkdtemp(prefix="email_db_bench_")
+    
+    try:
+        unpooled = run_benchmark(False, args.iterations, db_dir)
+        pooled = run_benchmark(True, args.iterations, db_dir)
+    finally:
+        shutil.rmtree(db_dir)
+    
+    print(f"EmailDatabase microbenchmark ({args.iterations} calls per method)")
+    print(f"  {'method':<15} {'connect per call':>18} {'pooled':>12} {'speedup':>9}")
+    for method, before in unpooled.items():
+        after = pooled[method]
+        print(f"  {method:<15} {before:>15.1f} us {after:>9.1f} us {before / after:>8.2f}x")
+
+if __name__ == "__main__":
+    main() 
\ No newline at end of file
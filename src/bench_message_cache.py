@@ -0,0 +1,70 @@
+#!/usr/bin/env python3
+import os
+import time
+import random
+import shutil
+import argparse
+import tempfile
+from email.mime.text import MIMEText
+from email_db import EmailDatabase
+
+RECIPIENT = "bench@example.com"
+
+def build_message(i, body_size):
+    """Build a test message with a body of about body_size bytes"""
+    msg = MIMEText(f"Message {i}. " + "x" * body_size, "plain")
+    msg["From"] = "sender@example.com"
+    msg["To"] = RECIPIENT
+    msg["Subject"] = f"Cache benchmark message {i}"
+    msg["Message-ID"] = f"<cache-{i}@example.com>"
+    return msg.as_bytes()
+
+def run_opens(db, opens):
+    """Open emails in the given order the way the mail client does and return microseconds per open"""
+    started = time.perf_counter()
+    for email_id in opens:
+        mail_data = db.get_email(email_id)
+        if not mail_data["is_read"]:
+            db.mark_as_read(email_id)
+    return (time.perf_counter() - started) / len(opens) * 1e6
+
+def parse_arguments():
+    """Parse command line arguments"""
+    parser = argparse.ArgumentParser(description="Repeated email opens with and without the message cache")
+    parser.add_argument("--messages", type=int, default=2000, help="Emails in the mailbox")
+    parser.add_argument("--opens", type=int, default=20000, help="Emails opened, most of them recent ones")
+    parser.add_argument("--body-size", type=int, default=8192, help="Approximate body size in bytes")
+    parser.add_argument("--cache-mb", type=int, default=16, help="Message cache size in MB")
+    return parser.parse_args()
+
+def main():
+    args = parse_arguments()
+    db_dir = tempfile.mkdtemp(prefix="email_db_cache_")
+    db_path = os.path.join(db_dir, "cache.db")
+    
+    try:
+        db = EmailDatabase(db_path, profile="throughput")
+        db.store_many([(RECIPIENT, build_message(i, args.body_size)) for i in range(args.messages)])
+        ids = [mail["id"] for mail in db.get_mailbox(RECIPIENT, limit=args.messages)]
+        db.close()
+        
+        # Readers mostly reopen the newest mail: rank r is chosen with weight 1/r
+        random.seed(42)
+        weights = [1 / rank for rank in range(1, len(ids) + 1)]
+        opens = random.choices(ids, weights=weights, k=args.opens)
+        
+        print(f"{args.opens} opens of {args.messages} emails with ~{args.body_size} byte bodies")
+        for label, cache_bytes in (("no cache", 0), (f"{args.cache_mb} MB cache", args.cache_mb * 1024 * 1024)):
+            db = EmailDatabase(db_path, message_cache_bytes=cache_bytes)
+            per_open = run_opens(db, opens)
+            stats = db.get_cache_stats()
+            lookups = stats["hits"] + stats["misses"]
+            hit_ratio = stats["hits"] / lookups if lookups else 0
+            print(f"  {label:>12}: {per_open:>8.1f} us/open, {hit_ratio:>6.1%} hits, "
+                  f"{stats['evictions']} evictions, {stats['bytes'] // 1024} KB cached")
+            db.close()
+    finally:
+        shutil.rmtree(db_dir)
+
+if __name__ == "__main__":
+    main() 
\ No newline at end of file
@@ -0,0 +1,81 @@
+#!/usr/bin/env python3
+import os
+import time
+import shutil
+import argparse
+import tempfile
+import multiprocessing
+from email.mime.text import MIMEText
+from sharded_db import ShardedEmailDatabase
+
+def build_message(recipient, i):
+    """Build a small test message"""
+    msg = MIMEText(f"Body of sharding benchmark message {i}.", "plain")
+    msg["From"] = "sender@example.com"
+    msg["To"] = recipient
+    msg["Subject"] = f"Sharding message {i}"
+    msg["Message-ID"] = f"<sharding-{recipient}-{i}@example.com>"
+    return msg.as_bytes()
+
+def writer(shard_dir, recipient, duration, profile, results):
+    """Deliver to one mailbox for `duration` seconds from its own process"""
+    db = ShardedEmailDatabase(shard_dir, profile=profile)
+    deadline = time.perf_counter() + duration
+    i = 0
+    writes = 0
+    while time.perf_counter() < deadline:
+        if db.store_email(recipient, build_message(recipient, i)):
+            writes += 1
+        i += 1
+    db.close()
+    results.put(writes)
+
+def run_shards(shard_count, db_dir, writers, duration, profile):
+    """Run one writer process per mailbox against a given number of shards"""
+    # Separate processes, like separate SMTP server workers, so the GIL is not the bottleneck
+    shard_dir = os.path.join(db_dir, f"shards_{shard_count}")
+    ShardedEmailDatabase(shard_dir, shard_count=shard_count, profile=profile).close()
+    recipients = [f"user{i}@example.com" for i in range(writers)]
+    
+    results = multiprocessing.Queue()
+    processes = [
+        multiprocessing.Process(target=writer, args=(shard_dir, recipient, duration, profile, results))
+        for recipient in recipients
+    ]
+    for process in processes:
+        process.start()
+    writes = sum(results.get() for _ in processes)
+    for process in processes:
+        process.join()
+    
+    db = ShardedEmailDatabase(shard_dir)
+    used = sum(1 for stats in db.get_shard_stats() if stats["messages"])
+    db.close()
+    return writes / duration, used
+
+def parse_arguments():
+    """Parse command line arguments"""
+    parser = argparse.ArgumentParser(description="Write throughput of the sharded database by shard count")
+    parser.add_argument("--writers", type=int, default=8, help="Writer processes, each delivering to its own mailbox")
+    parser.add_argument("--duration", type=float, default=5.0, help="Seconds to run each shard count")
+    parser.add_argument("--shards", type=int, nargs="+", default=[1, 2, 4, 8], help="Shard counts to compare")
+    parser.add_argument("--profile", default="durable", help="PRAGMA profile for every shard")
+    return parser.parse_args()
+
+def main():
+    args = parse_arguments()
+    db_dir = tempfile.mkdtemp(prefix="email_db_sharding_")
+    
+    print(f"{args.writers} writers, {args.duration}s per shard count, {args.profile} profile")
+    print(f"  {'shards':>6} {'in use':>7} {'writes/s':>10} {'speedup':>9}")
+    try:
+        baseline = None
+        for shard_count in args.shards:
+            writes_per_sec, used = run_shards(shard_count, db_dir, args.writers, args.duration, args.profile)
+            baseline = baseline or writes_per_sec
+            print(f"  {shard_count:>6} {used:>7} {writes_per_sec:>10.0f} {writes_per_sec / baseline:>8.2f}x")
+    finally:
+        shutil.rmtree(db_dir)
+
+if __name__ == "__main__":
+    main() 
\ No newline at end of file
@@ -0,0 +1,657 @@
+#!/usr/bin/env python3
+import os
+import re
+import json
+import time
+import shutil
+import struct
+import sqlite3
+import argparse
+import tempfile
+import threading
+from email_db import SCHEMA_VERSION
+from db_maintenance import DB_BACKED_FILE
+from sharded_db import SHARD_DIR, LAYOUT_FILE, load_layout, shard_path
+
+BACKUP_DIR = "backups"
+MANIFEST_FILE = "manifest.json"
+STATE_FILE = "state.json"
+
+# Archived logs are folded into a new snapshot named after the last log it
+# contains, so a restore always knows which logs still apply on top of it
+BASE_FILE = re.compile(r'^base_(\d{8})\.db$')
+
+# A WAL file is a 32-byte header followed by frames of a 24-byte header and
+# one page. Frames belong to the current log only if they carry its salts.
+WAL_HEADER_SIZE = 32
+WAL_FRAME_HEADER_SIZE = 24
+
+def database_files(db_path="database/emails.db", shard_dir=SHARD_DIR):
+    """Every database file that holds mail, as (name relative to the database directory, path)"""
+    layout = load_layout(shard_dir)
+    paths = [shard_path(shard_dir, index) for index in range(layout["count"])] if layout else [db_path]
+    base_dir = os.path.dirname(os.path.abspath(db_path))
+    files = []
+    for path in paths:
+        name = os.path.relpath(os.path.abspath(path), base_dir)
+        # A shard directory outside the database directory is kept under shards/
+        if name.startswith(".."):
+            name = os.path.join("shards", os.path.basename(path))
+        files.append((name, path))
+    return files
+
+def read_wal_header(db_path):
+    """(header bytes, page size, salt) of a database's WAL, or None while it has no log"""
+    try:
+        with open(db_path + "-wal", 'rb') as f:
+            header = f.read(WAL_HEADER_SIZE)
+    except OSError:
+        return None
+    
+    if len(header) < WAL_HEADER_SIZE:
+        return None
+    return header, struct.unpack(">I", header[8:12])[0], header[16:24]
+
+def copy_wal_frames(db_path, page_size, salt, start, out):
+    """Append the committed frames after frame `start` of the current log to out and return the new frame count"""
+    frame_size = WAL_FRAME_HEADER_SIZE + page_size
+    frames = start
+    pending = []
+    
+    with open(db_path + "-wal", 'rb') as f:
+        f.seek(WAL_HEADER_SIZE + start * frame_size)
+        while True:
+            frame = f.read(frame_size)
+            # Frames left over from an earlier log carry old salts and end this one
+            if len(frame) < frame_size or frame[8:16] != salt:
+                break
+            
+            # Only whole transactions are archived; a commit frame records the database size
+            pending.append(frame)
+            if struct.unpack(">I", frame[4:8])[0]:
+                out.write(b"".join(pending))
+                frames += len(pending)
+                pending = []
+    
+    return frames
+
+def find_base(archive_dir):
+    """(path, last log folded in) of the newest snapshot in an archive, or (None, 0) when there is none"""
+    newest = (None, 0)
+    if not os.path.isdir(archive_dir):
+        return newest
+    
+    for name in os.listdir(archive_dir):
+        match = BASE_FILE.match(name)
+        if match and (newest[0] is None or int(match.group(1)) > newest[1]):
+            newest = (os.path.join(archive_dir, name), int(match.group(1)))
+    return newest
+
+def archived_logs(archive_dir, after=0):
+    """Paths of the archived logs numbered above `after`, in replay order"""
+    wal_dir = os.path.join(archive_dir, "wal")
+    if not os.path.isdir(wal_dir):
+        return []
+    names = sorted(name for name in os.listdir(wal_dir) if name.endswith(".wal") and int(name[:8]) > after)
+    return [os.path.join(wal_dir, name) for name in names]
+
+def apply_logs(db_path, log_paths):
+    """Replay archived logs onto a copy of a snapshot, one after another"""
+    # Each log is put back as the WAL and recovered by SQLite, which checks
+    # every frame's checksum before the checkpoint writes it into the file
+    for log_path in log_paths:
+        shutil.copyfile(log_path, db_path + "-wal")
+        conn = sqlite3.connect(db_path)
+        try:
+            busy, _, _ = conn.execute("PRAGMA wal_checkpoint(TRUNCATE)").fetchone()
+            if busy:
+                raise RuntimeError(f"Could not apply {log_path} to {db_path}")
+        finally:
+            conn.close()
+
+class WalArchiver:
+    """Keeps an online snapshot of one database file and archives its WAL as it grows"""
+    
+    def __init__(self, db_path, archive_dir, pages=256, pause=0.01):
+        """Create an archiver; pages and pause throttle the snapshot so ingest keeps its I/O"""
+        self.db_path = db_path
+        self.archive_dir = archive_dir
+        self.wal_dir = os.path.join(archive_dir, "wal")
+        self.pages = pages
+        self.pause = pause
+        os.makedirs(self.wal_dir, exist_ok=True)
+        self.state = self._load_state()
+        
+        # While this connection holds a read transaction no checkpoint can
+        # finish, so SQLite never starts a new log over frames not yet archived
+        self.reader = None
+        self.pinned = False
+    
+    def _connect(self):
+        """Open a connection that manages its own transactions"""
+        return sqlite3.connect(self.db_path, timeout=30, isolation_level=None, check_same_thread=False)
+    
+    def _load_state(self):
+        """Read the position reached by the previous run, or None before the first snapshot"""
+        state_path = os.path.join(self.archive_dir, STATE_FILE)
+        if not os.path.exists(state_path) or find_base(self.archive_dir)[0] is None:
+            return None
+        
+        try:
+            with open(state_path, 'r') as f:
+                return json.load(f)
+        except (json.JSONDecodeError, OSError) as e:
+            print(f"Error loading backup state {state_path}: {e}")
+            return None
+    
+    def _save_state(self):
+        """Record how far the log has been archived"""
+        state_path = os.path.join(self.archive_dir, STATE_FILE)
+        with open(state_path + ".tmp", 'w') as f:
+            json.dump(self.state, f)
+        os.replace(state_path + ".tmp", state_path)
+    
+    def _pin(self):
+        """Start the read transaction that holds the current log in place"""
+        if self.reader is None:
+            self.reader = self._connect()
+        self.reader.execute("BEGIN")
+        self.reader.execute("SELECT COUNT(*) FROM sqlite_master").fetchone()
+    
+    def _unpin(self):
+        """End the read transaction so checkpoints can fold the log back in"""
+        if self.reader is not None and self.reader.in_transaction:
+            self.reader.execute("ROLLBACK")
+        self.pinned = False
+    
+    def _throttle(self, status, remaining, total):
+        """Sleep between backup steps so the copy never hogs the disk"""
+        time.sleep(self.pause)
+    
+    def _start_segment(self, header):
+        """Begin a new archive file for a log, starting with its header"""
+        self.state["segment"] += 1
+        self.state["salt"] = header[2].hex()
+        self.state["frames"] = 0
+        with open(self._segment_path(self.state["segment"]), 'wb') as f:
+            f.write(header[0])
+    
+    def _segment_path(self, segment):
+        """Archive file of the nth log since the snapshot"""
+        return os.path.join(self.wal_dir, f"{segment:08d}.wal")
+    
+    def _database_stamp(self):
+        """Modification time and size of the database file, which only checkpoints change in WAL mode"""
+        stat = os.stat(self.db_path)
+        return [stat.st_mtime_ns, stat.st_size]
+    
+    def snapshot(self):
+        """Copy the whole database with the backup API, a few pages per step, then archive its log"""
+        self._unpin()
+        self._pin()
+        
+        # Logs archived for the old snapshot must never be replayed onto the new one
+        state_path = os.path.join(self.archive_dir, STATE_FILE)
+        if os.path.exists(state_path):
+            os.remove(state_path)
+        for path in archived_logs(self.archive_dir):
+            os.remove(path)
+        
+        # The pinned transaction gives every backup step the same snapshot, so
+        # commits made meanwhile never restart the copy
+        base_path = os.path.join(self.archive_dir, "base_00000000.db")
+        if os.path.exists(base_path + ".tmp"):
+            os.remove(base_path + ".tmp")
+        target = sqlite3.connect(base_path + ".tmp")
+        try:
+            self.reader.backup(target, pages=self.pages, progress=self._throttle)
+        finally:
+            target.close()
+        
+        old_base = find_base(self.archive_dir)[0]
+        if old_base:
+            os.remove(old_base)
+        os.replace(base_path + ".tmp", base_path)
+        self.pinned = True
+        
+        # Replay starts at the first frame of the log the snapshot was taken in
+        self.state = {"snapshot": time.time(), "archived": None, "segment": 0,
+                      "salt": None, "frames": 0, "stamp": None}
+        header = read_wal_header(self.db_path)
+        if header:
+            self._start_segment(header)
+        self._save_state()
+        
+        return self.archive()
+    
+    def archive(self):
+        """Copy frames committed since the last run and let SQLite checkpoint them"""
+        # Holding the write lock means no transaction is half in the log while
+        # it is copied and checkpointed
+        lock = self._connect()
+        try:
+            lock.execute("BEGIN IMMEDIATE")
+            header = read_wal_header(self.db_path)
+            
+            # A new log, or none at all, means the old one was checkpointed. No
+            # frames were lost if our pin allowed that only after our own
+            # checkpoint, or if nobody has written to the database file since it
+            salt = header[2].hex() if header else None
+            if (salt != self.state["salt"] or salt is None) and not self.pinned:
+                if self._database_stamp() != self.state["stamp"]:
+                    lock.execute("ROLLBACK")
+                    return self.snapshot()
+            if salt != self.state["salt"]:
+                if header:
+                    self._start_segment(header)
+                else:
+                    self.state["salt"] = None
+            
+            frames = 0
+            if header:
+                with open(self._segment_path(self.state["segment"]), 'ab') as out:
+                    new_count = copy_wal_frames(self.db_path, header[1], header[2], self.state["frames"], out)
+                frames = new_count - self.state["frames"]
+                self.state["frames"] = new_count
+            
+            # Everything in the log is archived, so it may be folded back in and
+            # restarted; the pin taken afterwards holds the next log in place
+            self._unpin()
+            self.reader = self.reader or self._connect()
+            self.reader.execute("PRAGMA wal_checkpoint(PASSIVE)").fetchone()
+            self.state["stamp"] = self._database_stamp()
+            self._pin()
+            self.pinned = True
+            
+            lock.execute("ROLLBACK")
+        finally:
+            lock.close()
+        
+        self.state["archived"] = time.time()
+        self._save_state()
+        return frames
+    
+    def fold(self):
+        """Replay finished logs into a new snapshot once they outgrow the current one"""
+        base_path, folded = find_base(self.archive_dir)
+        finished = archived_logs(self.archive_dir, folded)[:-1]
+        if not finished or sum(os.path.getsize(path) for path in finished) < os.path.getsize(base_path):
+            return 0
+        
+        # Works on archive files only; the live database is not touched
+        last = int(os.path.basename(finished[-1])[:8])
+        new_base = os.path.join(self.archive_dir, f"base_{last:08d}.db")
+        shutil.copyfile(base_path, new_base + ".tmp")
+        apply_logs(new_base + ".tmp", finished)
+        os.replace(new_base + ".tmp", new_base)
+        
+        os.remove(base_path)
+        for path in finished:
+            os.remove(path)
+        return len(finished)
+    
+    def run_once(self):
+        """Archive new log frames, taking a fresh snapshot when there is no usable one"""
+        if self.state is None:
+            self.snapshot()
+            return {"snapshot": True, "frames": self.state["frames"], "folded": 0}
+        
+        snapshot_time = self.state["snapshot"]
+        frames = self.archive()
+        return {"snapshot": self.state["snapshot"] != snapshot_time, "frames": frames, "folded": self.fold()}
+    
+    def close(self):
+        """Release the pin and close the archiver's connection"""
+        self._unpin()
+        if self.reader is not None:
+            self.reader.close()
+            self.reader = None
+
+def snapshot_mailboxes(mailbox_dir, target_dir):
+    """Mirror the .eml tree into target_dir with hard links and return {relative path: size}"""
+    files = {}
+    if os.path.isdir(mailbox_dir):
+        for root, _, names in os.walk(mailbox_dir):
+            for name in names:
+                if not name.endswith(".eml"):
+                    continue
+                
+                source = os.path.join(root, name)
+                rel_path = os.path.relpath(source, mailbox_dir)
+                target = os.path.join(target_dir, rel_path)
+                try:
+                    size = os.path.getsize(source)
+                    # Delivered files never change, so a file already in the mirror is kept
+                    if not os.path.exists(target) or os.path.getsize(target) != size:
+                        os.makedirs(os.path.dirname(target), exist_ok=True)
+                        if os.path.exists(target):
+                            os.remove(target)
+                        try:
+                            os.link(source, target)
+                        except OSError:
+                            shutil.copy2(source, target)
+                    files[rel_path] = size
+                except OSError as e:
+                    # Maintenance may remove an orphaned file while we walk
+                    print(f"Error copying {source}: {e}")
+    
+    # Files deleted since the last run leave the mirror too
+    if os.path.isdir(target_dir):
+        for root, _, names in os.walk(target_dir):
+            for name in names:
+                target = os.path.join(root, name)
+                if os.path.relpath(target, target_dir) not in files:
+                    os.remove(target)
+    
+    return files
+
+class BackupJob:
+    """Online backup of every database file plus a matching snapshot of the .eml tree"""
+    
+    def __init__(self, db_path="database/emails.db", shard_dir=SHARD_DIR, mailbox_dir="mailboxes",
+                 backup_dir=BACKUP_DIR, pages=256, pause=0.01):
+        """Create a job; pages and pause throttle the database snapshot steps"""
+        self.db_path = db_path
+        self.shard_dir = shard_dir
+        self.mailbox_dir = mailbox_dir
+        self.backup_dir = backup_dir
+        self.layout = load_layout(shard_dir)
+        self.archivers = {}
+        
+        for name, path in database_files(db_path, shard_dir):
+            archive_dir = os.path.join(backup_dir, "databases", name)
+            os.makedirs(archive_dir, exist_ok=True)
+            self.archivers[name] = WalArchiver(path, archive_dir, pages=pages, pause=pause)
+    
+    def run_once(self):
+        """Archive every database, then mirror the .eml tree and write the manifest"""
+        started = time.time()
+        stats = {"snapshots": 0, "frames": 0, "folded": 0, "files": 0}
+        manifest = {"created": started, "schema_version": SCHEMA_VERSION, "layout": self.layout, "databases": {}}
+        
+        # Files are written after their row is committed, so mirroring them
+        # second gives every archived row its .eml file
+        for name, archiver in self.archivers.items():
+            result = archiver.run_once()
+            stats["snapshots"] += result["snapshot"]
+            stats["frames"] += result["frames"]
+            stats["folded"] += result["folded"]
+            manifest["databases"][name] = {
+                "snapshot": archiver.state["snapshot"],
+                "segments": archiver.state["segment"],
+                "archived": archiver.state["archived"]
+            }
+        
+        manifest["mailboxes"] = snapshot_mailboxes(self.mailbox_dir, os.path.join(self.backup_dir, "mailboxes"))
+        stats["files"] = len(manifest["mailboxes"])
+        
+        manifest_path = os.path.join(self.backup_dir, MANIFEST_FILE)
+        with open(manifest_path + ".tmp", 'w') as f:
+            json.dump(manifest, f)
+        os.replace(manifest_path + ".tmp", manifest_path)
+        
+        stats["duration"] = round(time.time() - started, 3)
+        return stats
+    
+    def run_forever(self, interval, stop_event=None, on_complete=None):
+        """Archive every `interval` seconds until stop_event is set"""
+        stop_event = stop_event or threading.Event()
+        
+        while not stop_event.is_set():
+            try:
+                stats = self.run_once()
+                if on_complete:
+                    on_complete(stats)
+            except Exception as e:
+                print(f"Error during backup run: {e}")
+            stop_event.wait(interval)
+    
+    def close(self):
+        """Release every archiver's pin"""
+        for archiver in self.archivers.values():
+            archiver.close()
+
+def load_manifest(backup_dir):
+    """Read a backup's manifest, or None when the directory holds no backup"""
+    manifest_path = os.path.join(backup_dir, MANIFEST_FILE)
+    if not os.path.exists(manifest_path):
+        return None
+    
+    try:
+        with open(manifest_path, 'r') as f:
+            return json.load(f)
+    except (json.JSONDecodeError, OSError) as e:
+        print(f"Error loading backup manifest: {e}")
+        return None
+
+def restore_database(archive_dir, target_path):
+    """Rebuild a database file from its newest snapshot and the logs archived after it"""
+    base_path, folded = find_base(archive_dir)
+    if base_path is None:
+        raise RuntimeError(f"No snapshot in {archive_dir}")
+    
+    os.makedirs(os.path.dirname(os.path.abspath(target_path)), exist_ok=True)
+    for suffix in ("", "-wal", "-shm"):
+        if os.path.exists(target_path + suffix):
+            os.remove(target_path + suffix)
+    shutil.copyfile(base_path, target_path)
+    
+    logs = archived_logs(archive_dir, folded)
+    apply_logs(target_path, logs)
+    return len(logs)
+
+def restore_backup(backup_dir, target_dir, mailbox_dir=None):
+    """Restore every database of a backup under target_dir and, optionally, the .eml tree"""
+    manifest = load_manifest(backup_dir)
+    if manifest is None:
+        raise RuntimeError(f"No backup found in {backup_dir}")
+    
+    # Restoring over live files would mix two databases
+    for name in manifest["databases"]:
+        if os.path.exists(os.path.join(target_dir, name)):
+            raise RuntimeError(f"{os.path.join(target_dir, name)} already exists")
+    
+    restored = []
+    for name in manifest["databases"]:
+        target_path = os.path.join(target_dir, name)
+        restore_database(os.path.join(backup_dir, "databases", name), target_path)
+        restored.append(target_path)
+    
+    # A sharded backup needs its layout so the restored files route the same way
+    if manifest.get("layout"):
+        layout_dir = os.path.dirname(os.path.join(target_dir, next(iter(manifest["databases"]))))
+        with open(os.path.join(layout_dir, LAYOUT_FILE), 'w') as f:
+            json.dump(manifest["layout"], f)
+    
+    if mailbox_dir:
+        for rel_path in manifest["mailboxes"]:
+            target = os.path.join(mailbox_dir, rel_path)
+            os.makedirs(os.path.dirname(target), exist_ok=True)
+            shutil.copy2(os.path.join(backup_dir, "mailboxes", rel_path), target)
+    
+    return restored
+
+def verify_database(path):
+    """Check a restored database file and return a list of problems (empty when it is sound)"""
+    problems = []
+    conn = sqlite3.connect(path)
+    
+    try:
+        result = conn.execute("PRAGMA integrity_check").fetchall()
+        if result != [("ok",)]:
+            problems.extend(f"integrity: {row[0]}" for row in result)
+        
+        version = conn.execute("PRAGMA user_version").fetchone()[0]
+        if version > SCHEMA_VERSION:
+            problems.append(f"schema version {version} is newer than {SCHEMA_VERSION}")
+        
+        # The search index must match the content it was built from
+        try:
+            conn.execute("INSERT INTO emails_fts (emails_fts) VALUES ('integrity-check')")
+        except sqlite3.Error as e:
+            problems.append(f"search index: {e}")
+        
+        # Trigger-maintained counters must agree with the rows they count
+        mismatched = conn.execute('''
+        SELECT COUNT(*) FROM (
+            SELECT recipient, COUNT(*) AS total, SUM(size) AS bytes FROM emails GROUP BY recipient
+        ) e
+        LEFT JOIN mailbox_summary s ON s.recipient = e.recipient
+        WHERE s.total IS NOT e.total OR s.bytes IS NOT e.bytes
+        ''').fetchone()[0]
+        if mismatched:
+            problems.append(f"{mismatched} mailbox summaries disagree with the emails table")
+        
+        missing = conn.execute('''
+        SELECT COUNT(*) FROM emails e
+        WHERE NOT EXISTS (SELECT 1 FROM email_bodies b WHERE b.email_seq = e.seq)
+        ''').fetchone()[0]
+        if missing:
+            problems.append(f"{missing} emails have no body row")
+    
+    except sqlite3.Error as e:
+        problems.append(f"error reading database: {e}")
+    
+    finally:
+        conn.close()
+    
+    return problems
+
+def verify_mailboxes(manifest, mailbox_dir, db_paths):
+    """Check restored .eml files against the manifest and count files whose email is not in the databases"""
+    problems = []
+    ids = {}
+    
+    for rel_path, size in manifest["mailboxes"].items():
+        path = os.path.join(mailbox_dir, rel_path)
+        if not os.path.exists(path):
+            problems.append(f"missing file {rel_path}")
+        elif os.path.getsize(path) != size:
+            problems.append(f"size mismatch for {rel_path}")
+        
+        match = DB_BACKED_FILE.match(os.path.basename(rel_path))
+        if match:
+            ids[match.group(1)] = rel_path
+    
+    # Files delivered after the last archived commit, and orphans maintenance
+    # has not removed yet, have no row; they are reported, not counted as damage
+    unmatched = set(ids)
+    id_list = list(ids)
+    for path in db_paths:
+        conn = sqlite3.connect(path)
+        try:
+            for start in range(0, len(id_list), 500):
+                chunk = id_list[start:start + 500]
+                placeholders = ",".join("?" * len(chunk))
+                for row in conn.execute(f"SELECT id FROM emails WHERE id IN ({placeholders})", chunk):
+                    unmatched.discard(row[0])
+        finally:
+            conn.close()
+    
+    return problems, len(unmatched)
+
+def verify_backup(backup_dir):
+    """Restore a backup into a scratch directory and check it; returns (problems, summary)"""
+    manifest = load_manifest(backup_dir)
+    if manifest is None:
+        return [f"No backup found in {backup_dir}"], {}
+    
+    scratch = tempfile.mkdtemp(prefix="email_db_restore_")
+    try:
+        mailbox_dir = os.path.join(scratch, "mailboxes")
+        db_paths = restore_backup(backup_dir, os.path.join(scratch, "database"), mailbox_dir)
+        
+        problems = []
+        summary = {"databases": len(db_paths), "emails": 0, "files": len(manifest["mailboxes"])}
+        for path in db_paths:
+            problems.extend(f"{os.path.basename(path)}: {problem}" for problem in verify_database(path))
+            conn = sqlite3.connect(path)
+            try:
+                summary["emails"] += conn.execute("SELECT COUNT(*) FROM emails").fetchone()[0]
+            except sqlite3.Error:
+                pass
+            finally:
+                conn.close()
+        
+        file_problems, summary["files_without_email"] = verify_mailboxes(manifest, mailbox_dir, db_paths)
+        problems.extend(file_problems)
+        return problems, summary
+    
+    except Exception as e:
+        return [f"restore failed: {e}"], {}
+    
+    finally:
+        shutil.rmtree(scratch)
+
+def parse_arguments():
+    """Parse command line arguments"""
+    parser = argparse.ArgumentParser(description="Online backup, restore and restore verification for the email database")
+    
+    parser.add_argument("--backup-dir", default=BACKUP_DIR, help="Directory holding the backup")
+    parser.add_argument("--db", default="database/emails.db", help="Single database file")
+    parser.add_argument("--shard-dir", default=SHARD_DIR, help="Shard directory, used when it holds a layout")
+    parser.add_argument("--mailbox-dir", default="mailboxes", help=".eml tree to snapshot")
+    parser.add_argument("--pages", type=int, default=256, help="Database pages copied per backup step")
+    parser.add_argument("--pause", type=float, default=0.01, help="Seconds to sleep between backup steps")
+    parser.add_argument("--interval", type=int, default=0,
+                        help="Keep running and archive the WAL every N seconds (incremental mode)")
+    parser.add_argument("--restore-to", help="Restore the backup into this database directory instead of backing up")
+    parser.add_argument("--restore-mailboxes", help="With --restore-to, also restore the .eml files into this directory")
+    parser.add_argument("--verify", action="store_true", help="Restore into a scratch directory and check the result")
+    
+    return parser.parse_args()
+
+def main():
+    args = parse_arguments()
+    
+    if args.verify:
+        problems, summary = verify_backup(args.backup_dir)
+        if summary:
+            print(f"Restored {summary['databases']} database file(s) with {summary['emails']} emails "
+                  f"and {summary['files']} .eml files")
+            print(f".eml files without a database row: {summary['files_without_email']}")
+        for problem in problems:
+            print(f"  {problem}")
+        print("Backup verified" if not problems else f"Backup has {len(problems)} problem(s)")
+        return
+    
+    if args.restore_to:
+        try:
+            restored = restore_backup(args.backup_dir, args.restore_to, args.restore_mailboxes)
+        except Exception as e:
+            print(f"Error restoring backup: {e}")
+            return
+        for path in restored:
+            print(f"  Restored {path}")
+        if args.restore_mailboxes:
+            print(f"Restored .eml files into {args.restore_mailboxes}")
+        return
+    
+    job = BackupJob(
+        db_path=args.db,
+        shard_dir=args.shard_dir,
+        mailbox_dir=args.mailbox_dir,
+        backup_dir=args.backup_dir,
+        pages=args.pages,
+        pause=args.pause
+    )
+    
+    try:
+        if args.interval > 0:
+            print(f"Archiving every {args.interval} seconds into {args.backup_dir}. Press Ctrl+C to stop")
+            try:
+                job.run_forever(args.interval, on_complete=print)
+            except KeyboardInterrupt:
+                print("Backup stopped")
+        else:
+            stats = job.run_once()
+            print(f"Snapshots taken: {stats['snapshots']}")
+            print(f"WAL frames archived: {stats['frames']}")
+            print(f"Archived logs folded into snapshots: {stats['folded']}")
+            print(f".eml files in snapshot: {stats['files']}")
+            print(f"Completed in {stats['duration']}s")
+    finally:
+        job.close()
+
+if __name__ == "__main__":
+    main() 
\ No newline at end of file
@@ -0,0 +1,273 @@
+#!/usr/bin/env python3
+import os
+import re
+import json
+import time
+import glob
+import argparse
+import datetime
+import threading
+from sharded_db import open_email_database
+
+# Files written by MailboxManager after a successful database insert are named
+# "<timestamp>_<database id>.eml". Database ids are ULIDs, or start with their own
+# timestamp when stored by older versions. Files that only carry a uuid were never
+# stored in the database.
+DB_BACKED_FILE = re.compile(r'^\d{14}_([0-9A-HJKMNP-TV-Z]{26}|\d{14}_.*)\.eml$')
+
+class RetentionPolicy:
+    """Per-mailbox retention settings loaded from config/retention.json"""
+    
+    def __init__(self, default_days=None, mailboxes=None):
+        """Create a policy; None means mail is kept forever"""
+        self.default_days = default_days
+        self.mailboxes = mailboxes or {}
+    
+    @classmethod
+    def load(cls, config_path="config/retention.json"):
+        """Load the policy file, falling back to keeping everything"""
+        if not os.path.exists(config_path):
+            return cls()
+        
+        try:
+            with open(config_path, 'r') as f:
+                config = json.load(f)
+            return cls(config.get("default_days"), config.get("mailboxes", {}))
+        except (json.JSONDecodeError, OSError) as e:
+            print(f"Error loading retention policy: {e}")
+            return cls()
+    
+    def days_for(self, recipient):
+        """Number of days mail is kept for a recipient, or None to keep forever"""
+        return self.mailboxes.get(recipient, self.default_days)
+
+class MaintenanceJob:
+    """Applies retention, compacts the database and removes orphaned .eml files"""
+    
+    def __init__(self, email_db=None, policy=None, mailbox_dir="mailboxes",
+                 batch_size=500, pause=0.05, vacuum_pages=256, max_vacuum_steps=1000,
+                 wal_size_limit=64 * 1024 * 1024, tombstone_days=30):
+        """Create a job; batch_size and pause throttle the work so ingest is not starved, and
+        max_vacuum_steps bounds the vacuum_pages steps one compaction may take"""
+        self.email_db = email_db or open_email_database()
+        self.policy = policy or RetentionPolicy.load()
+        self.mailbox_dir = mailbox_dir
+        self.batch_size = batch_size
+        self.pause = pause
+        self.vacuum_pages = vacuum_pages
+        self.max_vacuum_steps = max_vacuum_steps
+        self.wal_size_limit = wal_size_limit
+        self.tombstone_days = tombstone_days
+    
+    def apply_retention(self, now=None):
+        """Delete expired emails in small batches, returning the number deleted"""
+        now = now or datetime.datetime.now()
+        deleted = 0
+        
+        for recipient in self.email_db.get_recipients():
+            days = self.policy.days_for(recipient)
+            if days is None:
+                continue
+            
+            cutoff = now - datetime.timedelta(days=days)
+            
+            # Short transactions with a pause in between keep the write lock
+            # available for the SMTP server
+            while True:
+                count = self.email_db.delete_older_than(recipient, cutoff, self.batch_size)
+                deleted += count
+                if count < self.batch_size:
+                    break
+                time.sleep(self.pause)
+        
+        return deleted
+    
+    def prune_tombstones(self, now=None):
+        """Forget deletions older than tombstone_days; clients that last synced before then relist"""
+        now = now or datetime.datetime.now()
+        cutoff = now - datetime.timedelta(days=self.tombstone_days)
+        pruned = 0
+        
+        while True:
+            count = self.email_db.prune_tombstones(cutoff, self.batch_size)
+            pruned += count
+            if count < self.batch_size:
+                break
+            time.sleep(self.pause)
+        
+        return pruned
+    
+    def compact(self):
+        """Return free pages to the filesystem a few at a time, for at most max_vacuum_steps steps"""
+        if self.email_db.get_auto_vacuum_mode() != 2:
+            return 0
+        
+        # Whatever is left after the last step waits for the next run. A step
+        # that frees nothing (an error, or pages that cannot be released yet)
+        # ends the loop instead of spinning on it
+        steps = 0
+        remaining = None
+        while steps < self.max_vacuum_steps:
+            free = self.email_db.incremental_vacuum(self.vacuum_pages)
+            steps += 1
+            if free == 0 or (remaining is not None and free >= remaining):
+                break
+            remaining = free
+            time.sleep(self.pause)
+        
+        return steps
+    
+    def checkpoint_wal(self):
+        """Fold the WAL back into the database, truncating it once it grows too large"""
+        # wal_autocheckpoint already runs PASSIVE checkpoints on commit; a
+        # TRUNCATE checkpoint also gives the disk space of a large WAL back
+        mode = "TRUNCATE" if self.email_db.get_wal_size() > self.wal_size_limit else "PASSIVE"
+        result = self.email_db.checkpoint(mode)
+        
+        if mode == "TRUNCATE" and result and result[0]:
+            # Readers kept the WAL busy; try again on the next run
+            result = self.email_db.checkpoint("PASSIVE")
+        return mode if result else None
+    
+    def reconcile_files(self, dry_run=False):
+        """Remove .eml copies of emails the database records as deleted"""
+        if not os.path.exists(self.mailbox_dir):
+            return []
+        
+        removed = []
+        
+        for mailbox in os.listdir(self.mailbox_dir):
+            mailbox_path = os.path.join(self.mailbox_dir, mailbox)
+            if not os.path.isdir(mailbox_path):
+                continue
+            
+            # Map database ids to their files for this mailbox
+            candidates = {}
+            for email_file in glob.glob(os.path.join(mailbox_path, "*.eml")):
+                match = DB_BACKED_FILE.match(os.path.basename(email_file))
+                if match:
+                    candidates[match.group(1)] = email_file
+            
+            if not candidates:
+                continue
+            
+            # Only a tombstone proves a row was deleted; an id the database
+            # never had (a fresh or wrong database, a shard not migrated yet)
+            # leaves its file alone
+            recipient = mailbox.replace('_at_', '@').replace('_dot_', '.')
+            deleted_ids = self.email_db.deleted_ids(recipient, candidates.keys())
+            for email_id in deleted_ids:
+                email_file = candidates[email_id]
+                if not dry_run:
+                    try:
+                        os.remove(email_file)
+                    except OSError as e:
+                        print(f"Error removing orphaned file {email_file}: {e}")
+                        continue
+                removed.append(email_file)
+            
+            time.sleep(self.pause)
+        
+        return removed
+    
+    def run_once(self, dry_run=False):
+        """Run every maintenance step once and return a summary"""
+        started = time.time()
+        stats = {"deleted": 0, "tombstones_pruned": 0, "vacuum_steps": 0, "checkpoint": None, "orphans_removed": 0}
+        
+        # Files are reconciled before tombstones are pruned, so the deletions
+        # they rely on, including the retention ones, are still recorded
+        if not dry_run:
+            stats["deleted"] = self.apply_retention()
+        stats["orphans_removed"] = len(self.reconcile_files(dry_run=dry_run))
+        if not dry_run:
+            stats["tombstones_pruned"] = self.prune_tombstones()
+            stats["vacuum_steps"] = self.compact()
+            stats["checkpoint"] = self.checkpoint_wal()
+        
+        stats["duration"] = round(time.time() - started, 3)
+        return stats
+    
+    def run_forever(self, interval, stop_event=None, on_complete=None, dry_run=False):
+        """Run the job every `interval` seconds until stop_event is set"""
+        stop_event = stop_event or threading.Event()
+        
+        while not stop_event.is_set():
+            try:
+                stats = self.run_once(dry_run=dry_run)
+                if on_complete:
+                    on_complete(stats)
+            except Exception as e:
+                print(f"Error during maintenance run: {e}")
+            stop_event.wait(interval)
+    
+    def start_background(self, interval, on_complete=None):
+        """Start run_forever on a daemon thread and return its stop event"""
+        stop_event = threading.Event()
+        thread = threading.Thread(
+            target=self.run_forever,
+            args=(interval, stop_event, on_complete),
+            name="db-maintenance",
+            daemon=True
+        )
+        thread.start()
+        return stop_event
+
+def parse_arguments():
+    """Parse command line arguments"""
+    parser = argparse.ArgumentParser(description="Retention and compaction for the email database")
+    
+    parser.add_argument("--config", default="config/retention.json", help="Retention policy file")
+    parser.add_argument("--interval", type=int, default=0, help="Repeat every N seconds instead of running once")
+    parser.add_argument("--batch-size", type=int, default=500, help="Rows deleted per transaction")
+    parser.add_argument("--pause", type=float, default=0.05, help="Seconds to sleep between batches")
+    parser.add_argument("--max-vacuum-steps", type=int, default=1000,
+                        help="Incremental vacuum steps of 256 pages per run; the rest waits for the next run")
+    parser.add_argument("--tombstone-days", type=int, default=30,
+                        help="Days deleted email ids are kept for incremental sync")
+    parser.add_argument("--apply", action="store_true",
+                        help="Delete expired emails and orphaned files and compact; without it nothing is changed")
+    parser.add_argument("--dry-run", action="store_true",
+                        help="Only report orphaned files, change nothing (the default unless --apply is given)")
+    parser.add_argument("--convert-auto-vacuum", action="store_true",
+                        help="Rewrite an existing database so incremental vacuum can be used")
+    
+    return parser.parse_args()
+
+def main():
+    args = parse_arguments()
+    dry_run = args.dry_run or not args.apply
+    
+    db = open_email_database()
+    if args.convert_auto_vacuum and db.get_auto_vacuum_mode() != 2:
+        print("Converting database to incremental auto_vacuum...")
+        db.enable_incremental_vacuum()
+    
+    job = MaintenanceJob(
+        email_db=db,
+        policy=RetentionPolicy.load(args.config),
+        batch_size=args.batch_size,
+        pause=args.pause,
+        max_vacuum_steps=args.max_vacuum_steps,
+        tombstone_days=args.tombstone_days
+    )
+    
+    if args.interval > 0:
+        print(f"Running maintenance every {args.interval} seconds. Press Ctrl+C to stop")
+        try:
+            job.run_forever(args.interval, on_complete=print, dry_run=dry_run)
+        except KeyboardInterrupt:
+            print("Maintenance stopped")
+    else:
+        stats = job.run_once(dry_run=dry_run)
+        print(f"Expired emails deleted: {stats['deleted']}")
+        print(f"Tombstones pruned: {stats['tombstones_pruned']}")
+        print(f"Incremental vacuum steps: {stats['vacuum_steps']}")
+        print(f"WAL checkpoint: {stats['checkpoint'] or 'skipped'}")
+        print(f"Orphaned files {'found' if dry_run else 'removed'}: {stats['orphans_removed']}")
+        print(f"Completed in {stats['duration']}s")
+        if dry_run:
+            print("Nothing was changed; run with --apply to delete and compact")
+
+if __name__ == "__main__":
+    main() 
\ No newline at end of file
@@ -1,230 +1,2995 @@
 #!/usr/bin/env python3
 import os
+import io
 import sqlite3
+import base64
 import datetime
 import json
 import email
-from email.policy import default
+import re
+import time
+import hashlib
+import binascii
+import quopri
+import tempfile
+import threading
+from collections import OrderedDict
+from email.parser import BytesHeaderParser
+from email.policy import compat32, default
+from email.utils import getaddresses, parsedate_to_datetime
+from mail_query import QuerySyntaxError, compile_query, has_filters, tokenize
+
+# Bumped whenever _init_db gains a new migration step
+SCHEMA_VERSION = 12
+
+# Named PRAGMA profiles applied to every pooled connection. journal_mode is
+# stored in the database file itself and is set once by _init_db.
+PROFILES = {
+    # Survives power loss after every commit, small memory footprint
+    "durable": {
+        "journal_mode": "wal",
+        "synchronous": "FULL",
+        "cache_size": -8000,
+        "mmap_size": 0,
+        "temp_store": "DEFAULT",
+        "wal_autocheckpoint": 1000,
+    },
+    # WAL with NORMAL sync only risks the last commits on power loss, never corruption
+    "balanced": {
+        "journal_mode": "wal",
+        "synchronous": "NORMAL",
+        "cache_size": -32000,
+        "mmap_size": 64 * 1024 * 1024,
+        "temp_store": "MEMORY",
+        "wal_autocheckpoint": 1000,
+    },
+    # Bulk ingest: larger WAL between checkpoints and no fsync on commit
+    "throughput": {
+        "journal_mode": "wal",
+        "synchronous": "OFF",
+        "cache_size": -128000,
+        "mmap_size": 256 * 1024 * 1024,
+        "temp_store": "MEMORY",
+        "wal_autocheckpoint": 10000,
+    },
+}
+
+DEFAULT_PROFILE = "balanced"
+
+# Memory allowed for decoded messages kept by MessageCache
+MESSAGE_CACHE_BYTES = 16 * 1024 * 1024
+
+# Raw messages are streamed through incremental blob I/O in chunks of this
+# size. Only the first PARSE_LIMIT bytes of a streamed message are parsed
+# for its body and attachment names, because the email parser needs
+# several times the input size in memory
+RAW_CHUNK_SIZE = 64 * 1024
+PARSE_LIMIT = 1024 * 1024
+
+EPOCH = datetime.datetime(1970, 1, 1, tzinfo=datetime.timezone.utc)
+
+# Message-IDs inside Message-ID, In-Reply-To and References headers
+MESSAGE_ID_PATTERN = re.compile(r'<([^<>\s]+)>')
+
+# Reply and forward prefixes dropped from a thread's subject
+SUBJECT_PREFIX_PATTERN = re.compile(r'^\s*((re|fwd?|aw|sv)\s*(\[\d+\])?\s*:\s*)+', re.IGNORECASE)
+
+# Bytes dropped from base64 bodies before decoding: line breaks and stray junk
+BASE64_NOISE = bytes(byte for byte in range(256)
+                     if not (chr(byte).isascii() and (chr(byte).isalnum() or chr(byte) in "+/=")))
+
+# Address headers kept in email_addresses, by the field name stored there
+ADDRESS_FIELDS = (("from", "From"), ("to", "To"), ("cc", "Cc"))
+
+# Columns added to emails after its first release, created on older databases by ALTER TABLE
+EMAIL_COLUMNS_V7 = {
+    "message_id": "TEXT",
+    "parent_message_id": "TEXT",
+    "thread_id": "INTEGER",
+}
+
+EMAIL_COLUMNS_V9 = {
+    "content_hash": "TEXT",
+}
+
+EMAIL_COLUMNS_V10 = {
+    "modseq": "INTEGER NOT NULL DEFAULT 0",
+}
+
+# Crockford base32, the alphabet of ULIDs
+ULID_ALPHABET = "0123456789ABCDEFGHJKMNPQRSTVWXYZ"
+
+def new_email_id():
+    """A new ULID: 48 bits of milliseconds then 80 random bits, sortable by creation time"""
+    value = (time.time_ns() // 1000000) << 80 | int.from_bytes(os.urandom(10), "big")
+    return "".join(ULID_ALPHABET[(value >> shift) & 31] for shift in range(125, -1, -5))
+
+def _sha256_hex(value):
+    """SQL function computing content_hash for rows stored before it existed"""
+    if value is None:
+        return None
+    if isinstance(value, str):
+        value = value.encode("utf-8", "replace")
+    return hashlib.sha256(value).hexdigest()
+
+def to_epoch_us(value):
+    """Convert a datetime (naive means local time) to integer microseconds since the epoch, UTC"""
+    if isinstance(value, int):
+        return value
+    if value.tzinfo is None:
+        value = value.astimezone()
+    return (value - EPOCH) // datetime.timedelta(microseconds=1)
+
+def from_epoch_us(value):
+    """Convert stored epoch microseconds to an aware datetime in local time"""
+    return (EPOCH + datetime.timedelta(microseconds=value)).astimezone()
+
+def _iso_to_epoch_us(value):
+    """Convert a received_date written by older versions (local ISO string) during migration"""
+    if value is None or isinstance(value, int):
+        return value
+    try:
+        return to_epoch_us(datetime.datetime.fromisoformat(str(value)))
+    except ValueError:
+        return 0
+
+class ConnectionPool:
+    """Thread-local pool of long-lived SQLite connections"""
+    
+    def __init__(self, db_path, persistent=True, pragmas=None, timeout=30, cached_statements=256, health_check_interval=30):
+        """Create a pool; persistent=False opens a fresh connection for every call"""
+        self.db_path = db_path
+        self.persistent = persistent
+        self.pragmas = pragmas or {}
+        self.timeout = timeout
+        self.cached_statements = cached_statements
+        self.health_check_interval = health_check_interval
+        
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self._connections = []
+        self._pid = os.getpid()
+    
+    def _connect(self):
+        """Open and configure a new connection"""
+        # Each connection is only ever used by the thread that owns it, the
+        # flag just lets close_all() run from another thread. SQL strings are
+        # constant so sqlite3's per-connection statement cache reuses them.
+        conn = sqlite3.connect(
+            self.db_path,
+            timeout=self.timeout,
+            cached_statements=self.cached_statements,
+            check_same_thread=False
+        )
+        conn.row_factory = sqlite3.Row  # Return rows as dictionaries
+        
+        # Per-connection tuning from the active profile
+        for name, value in self.pragmas.items():
+            if name != "journal_mode":
+                conn.execute(f"PRAGMA {name} = {value}")
+        return conn
+    
+    def _is_healthy(self, conn):
+        """Run a trivial query to make sure a cached connection still works"""
+        try:
+            conn.execute("SELECT 1").fetchone()
+            return True
+        except sqlite3.Error:
+            return False
+    
+    def acquire(self):
+        """Get this thread's connection, reconnecting if it is missing or broken"""
+        if not self.persistent:
+            return self._connect()
+        
+        # Connections must not be shared with a forked child process
+        if os.getpid() != self._pid:
+            self._reset_after_fork()
+        
+        conn = getattr(self._local, "conn", None)
+        now = time.monotonic()
+        
+        if conn is not None and now - self._local.checked_at > self.health_check_interval:
+            if self._is_healthy(conn):
+                self._local.checked_at = now
+            else:
+                self._discard(conn)
+                conn = None
+        
+        if conn is None:
+            conn = self._connect()
+            self._local.conn = conn
+            self._local.checked_at = now
+            with self._lock:
+                self._connections.append(conn)
+        
+        return conn
+    
+    def release(self, conn):
+        """Hand a connection back, rolling back anything the caller left open"""
+        if not self.persistent:
+            conn.close()
+            return
+        
+        try:
+            if conn.in_transaction:
+                conn.rollback()
+        except sqlite3.Error:
+            self._discard(conn)
+    
+    def _discard(self, conn):
+        """Close a connection and forget it"""
+        if getattr(self._local, "conn", None) is conn:
+            self._local.conn = None
+        with self._lock:
+            if conn in self._connections:
+                self._connections.remove(conn)
+        try:
+            conn.close()
+        except sqlite3.Error:
+            pass
+    
+    def _reset_after_fork(self):
+        """Drop connections inherited from the parent process without closing them"""
+        self._local = threading.local()
+        self._connections = []
+        self._lock = threading.Lock()
+        self._pid = os.getpid()
+    
+    def close_all(self):
+        """Close every connection opened by the pool"""
+        with self._lock:
+            connections, self._connections = self._connections, []
+        for conn in connections:
+            try:
+                conn.close()
+            except sqlite3.Error:
+                pass
+        self._local = threading.local()
+
+class RawEmailReader(io.RawIOBase):
+    """Read-only file object over a stored raw message, backed by an SQLite blob handle"""
+    
+    def __init__(self, pool, conn, blob):
+        """Wrap an open blob; the pooled connection is handed back on close"""
+        super().__init__()
+        self._pool = pool
+        self._conn = conn
+        self._blob = blob
+    
+    def readable(self):
+        """Raw messages can be read"""
+        return True
+    
+    def seekable(self):
+        """Blob handles support random access"""
+        return True
+    
+    def readinto(self, buffer):
+        """Read the next chunk of the message into buffer"""
+        data = self._blob.read(len(buffer))
+        buffer[:len(data)] = data
+        return len(data)
+    
+    def seek(self, offset, whence=io.SEEK_SET):
+        """Move within the message like a regular file"""
+        self._blob.seek(offset, whence)
+        return self._blob.tell()
+    
+    def tell(self):
+        """Current offset within the message"""
+        return self._blob.tell()
+    
+    def __len__(self):
+        """Size of the message in bytes"""
+        return len(self._blob)
+    
+    def iter_chunks(self, chunk_size=RAW_CHUNK_SIZE):
+        """Yield the message in chunks of at most chunk_size bytes"""
+        while True:
+            chunk = self._blob.read(chunk_size)
+            if not chunk:
+                return
+            yield chunk
+    
+    def close(self):
+        """Close the blob handle and hand the connection back to the pool"""
+        if not self.closed:
+            try:
+                self._blob.close()
+            finally:
+                self._pool.release(self._conn)
+        super().close()
+
+def read_range(stream, offset, length, chunk_size=RAW_CHUNK_SIZE):
+    """Yield length bytes of a seekable stream starting at offset, in chunks"""
+    stream.seek(offset)
+    while length > 0:
+        chunk = stream.read(min(chunk_size, length))
+        if not chunk:
+            return
+        length -= len(chunk)
+        yield chunk
+
+def _decode_base64(data):
+    """Decode base64 leniently, like the email package does for bad padding"""
+    try:
+        return binascii.a2b_base64(data)
+    except binascii.Error:
+        return b""
+
+def decode_transfer_chunks(chunks, encoding):
+    """Undo a Content-Transfer-Encoding over a body given as chunks, yielding decoded chunks"""
+    if encoding == "base64":
+        # Decode whole groups of four characters and carry the rest over
+        pending = b""
+        for chunk in chunks:
+            data = pending + chunk.translate(None, BASE64_NOISE)
+            cut = len(data) - len(data) % 4
+            if cut:
+                yield _decode_base64(data[:cut])
+            pending = data[cut:]
+        if pending.rstrip(b"="):
+            yield _decode_base64(pending + b"=" * (-len(pending) % 4))
+    
+    elif encoding == "quoted-printable":
+        # Decode whole lines so no =XX escape or soft line break is split
+        pending = b""
+        for chunk in chunks:
+            data = pending + chunk
+            cut = data.rfind(b"\n") + 1
+            if cut:
+                yield quopri.decodestring(data[:cut])
+            pending = data[cut:]
+        if pending:
+            yield quopri.decodestring(pending)
+    
+    else:
+        yield from chunks
+
+def _mime_delimiter(line, boundaries):
+    """The delimiter or close delimiter a line is for one of the open boundaries, or None"""
+    if not line.startswith(b"--"):
+        return None
+    line = line.rstrip(b" \t\r\n")
+    for delimiter in reversed(boundaries):
+        if line == delimiter or line == delimiter + b"--":
+            return line
+    return None
+
+def _skip_to_delimiter(stream, boundaries):
+    """Read up to the next delimiter line; return it, or None at the end, and where the content before it ends"""
+    # The line break in front of a delimiter belongs to the delimiter
+    line_break = 0
+    while True:
+        offset = stream.tell()
+        line = stream.readline()
+        if not line:
+            return None, offset
+        delimiter = _mime_delimiter(line, boundaries)
+        if delimiter:
+            return delimiter, offset - line_break
+        line_break = len(line) - len(line.rstrip(b"\r\n"))
+
+def _read_header_block(stream, boundaries):
+    """Read header lines up to a blank line; return them and the delimiter or end of input that cut them short"""
+    lines = []
+    for line in iter(stream.readline, b""):
+        if line in (b"\r\n", b"\n"):
+            return lines, None
+        delimiter = _mime_delimiter(line, boundaries)
+        if delimiter:
+            return lines, delimiter
+        lines.append(line)
+    return lines, b""
+
+def _mime_part(index, lines, start):
+    """A scanned part whose body starts at start"""
+    # compat32 parses headers several times faster than the default policy;
+    # header_block is kept for a full parse of the few parts that need one
+    header_block = b"".join(lines)
+    headers = BytesHeaderParser(policy=compat32).parsebytes(header_block)
+    return {"index": index, "headers": headers, "header_block": header_block, "start": start, "end": start}
+
+def _scan_delivery_status(stream, parts, boundaries):
+    """Record the header blocks of a message/delivery-status body as parts, like the email parser does"""
+    while True:
+        lines, ended = _read_header_block(stream, boundaries)
+        if lines:
+            parts.append(_mime_part(len(parts), lines, stream.tell()))
+        if ended is not None:
+            return ended or None, stream.tell()
+
+def _scan_mime_part(stream, parts, boundaries):
+    """Record a part starting at its header block, then any parts inside it; return the delimiter that ended it and where it ended"""
+    lines, ended = _read_header_block(stream, boundaries)
+    part = _mime_part(len(parts), lines, stream.tell())
+    headers = part["headers"]
+    parts.append(part)
+    if ended is not None:
+        return ended or None, part["end"]
+    
+    content_type = headers.get_content_type()
+    boundary = headers.get_boundary() if headers.get_content_maintype() == "multipart" else None
+    if boundary:
+        # A multipart's children sit between its own boundary delimiters
+        delimiter = b"--" + boundary.encode("utf-8", "replace")
+        inner = boundaries + [delimiter]
+        ended, _ = _skip_to_delimiter(stream, inner)
+        while ended == delimiter:
+            ended, _ = _scan_mime_part(stream, parts, inner)
+        if ended == delimiter + b"--":
+            ended, part["end"] = _skip_to_delimiter(stream, boundaries)
+        else:
+            part["end"] = stream.tell()
+    elif content_type == "message/delivery-status":
+        ended, part["end"] = _scan_delivery_status(stream, parts, boundaries)
+    elif headers.get_content_maintype() == "message":
+        # An attached message is parsed as a part of its own
+        ended, part["end"] = _scan_mime_part(stream, parts, boundaries)
+    else:
+        ended, part["end"] = _skip_to_delimiter(stream, boundaries)
+    
+    part["end"] = max(part["start"], part["end"])
+    return ended, part["end"]
+
+def scan_mime_parts(stream):
+    """Walk a raw message's MIME tree in one pass: headers and encoded body range of each part, in walk() order"""
+    parts = []
+    stream.seek(0)
+    _scan_mime_part(stream, parts, [])
+    return parts
+
+class MessageCache:
+    """Thread-safe LRU of decoded message views, bounded by their approximate size in bytes"""
+    
+    def __init__(self, max_bytes=MESSAGE_CACHE_BYTES):
+        """Create a cache; max_bytes=0 disables it"""
+        self.max_bytes = max_bytes
+        self.bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+    
+    @staticmethod
+    def _size_of(view):
+        """Approximate memory used by a view: its text and bytes plus a little per field"""
+        return sum(len(value) + 64 if isinstance(value, (str, bytes)) else 64 for value in view.values())
+    
+    def __contains__(self, key):
+        """Check for a key without counting a hit or miss"""
+        with self._lock:
+            return key in self._entries
+    
+    def get(self, key):
+        """Return a copy of the cached view, or None"""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return dict(entry[0])
+    
+    def put(self, key, view):
+        """Cache a copy of a view, evicting the least recently used ones to stay within max_bytes"""
+        size = self._size_of(view)
+        if size > self.max_bytes:
+            return
+        
+        with self._lock:
+            self._discard(key)
+            self._entries[key] = (dict(view), size)
+            self.bytes += size
+            while self.bytes > self.max_bytes:
+                _, (_, evicted) = self._entries.popitem(last=False)
+                self.bytes -= evicted
+                self.evictions += 1
+    
+    def update(self, key, **fields):
+        """Change fields of a cached view in place, such as the read flag"""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                entry[0].update(fields)
+    
+    def invalidate(self, key):
+        """Drop one view"""
+        with self._lock:
+            self._discard(key)
+    
+    def invalidate_where(self, predicate):
+        """Drop every view for which predicate(view) is true"""
+        with self._lock:
+            for key in [key for key, (view, _) in self._entries.items() if predicate(view)]:
+                self._discard(key)
+    
+    def _discard(self, key):
+        """Remove an entry; the caller holds the lock"""
+        entry = self._entries.pop(key, None)
+        if entry is not None:
+            self.bytes -= entry[1]
+    
+    def clear(self):
+        """Drop every view"""
+        with self._lock:
+            self._entries.clear()
+            self.bytes = 0
+    
+    def stats(self):
+        """Hits, misses, evictions, entries and bytes used so far"""
+        with self._lock:
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "entries": len(self._entries),
+                "bytes": self.bytes,
+                "max_bytes": self.max_bytes,
+            }
 
 class EmailDatabase:
     """Database manager for storing and retrieving emails"""
     
-    def __init__(self, db_path="database/emails.db"):
-        """Initialize the email database"""
+    def __init__(self, db_path="database/emails.db", default_quota_messages=None, default_quota_bytes=None,
+                 pooled=True, profile=None, message_cache_bytes=MESSAGE_CACHE_BYTES):
+        """Initialize the email database; profile is a PROFILES name or a dict of PRAGMAs"""
         self.db_dir = os.path.dirname(db_path)
         self.db_path = db_path
         
-        # Create database directory if it doesn't exist
-        os.makedirs(self.db_dir, exist_ok=True)
+        # Resolve the tuning profile, letting .env choose the default
+        profile = profile or os.getenv("EMAIL_DB_PROFILE", DEFAULT_PROFILE)
+        if isinstance(profile, str):
+            if profile not in PROFILES:
+                raise ValueError(f"Unknown database profile: {profile}")
+            profile = PROFILES[profile]
+        self.profile = profile
+        
+        # Reuse one connection per thread instead of reconnecting on every call
+        self.pool = ConnectionPool(db_path, persistent=pooled, pragmas=profile)
+        
+        # Decoded emails returned by get_email, so reopening one skips the database
+        self.message_cache = MessageCache(message_cache_bytes)
+        
+        # Quotas applied to mailboxes without an entry in mailbox_quotas
+        self.default_quota_messages = default_quota_messages
+        self.default_quota_bytes = default_quota_bytes
+        
+        # Create database directory if it doesn't exist
+        os.makedirs(self.db_dir, exist_ok=True)
+        
+        # Connect to database and create tables if they don't exist
+        self._init_db()
+    
+    def _init_db(self):
+        """Initialize the database and create tables if they don't exist"""
+        conn = self.pool.acquire()
+        cursor = conn.cursor()
+        
+        # Let the maintenance job hand free pages back in small steps.
+        # This only takes effect on a new database; existing ones are
+        # converted with db_maintenance.py --convert-auto-vacuum
+        cursor.execute("PRAGMA auto_vacuum = INCREMENTAL")
+        
+        # WAL lets readers keep working while the SMTP server writes
+        cursor.execute(f"PRAGMA journal_mode = {self.profile.get('journal_mode', 'wal')}")
+        
+        try:
+            # Migrate atomically, and only once when several processes start together
+            cursor.execute("BEGIN IMMEDIATE")
+            version = cursor.execute("PRAGMA user_version").fetchone()[0]
+            
+            # Bring databases created by older versions up to date
+            if version < 4:
+                self._split_legacy_emails_table(cursor)
+            if version < 7:
+                self._add_missing_columns(cursor, "emails", EMAIL_COLUMNS_V7)
+            if version < 9:
+                self._add_missing_columns(cursor, "emails", EMAIL_COLUMNS_V9)
+            if version < 10:
+                self._add_missing_columns(cursor, "emails", EMAIL_COLUMNS_V10)
+            
+            self._create_schema(cursor)
+            
+            if version < 6:
+                self._convert_received_dates(conn, cursor)
+            
+            if version < 5:
+                # Replaced by the trigger-maintained mailbox_summary
+                cursor.execute("DROP TABLE IF EXISTS mailbox_usage")
+            if version < 6:
+                self._backfill_summary(cursor)
+            if version < 7:
+                self._backfill_threads(cursor)
+            if version < 8:
+                self._backfill_headers(cursor)
+            if version < 9:
+                self._backfill_content_hashes(conn, cursor)
+            if version < 10:
+                self._backfill_modseq(cursor)
+            if version < 11:
+                self._backfill_attachments(cursor)
+            
+            cursor.execute(f"PRAGMA user_version = {SCHEMA_VERSION}")
+            conn.commit()
+        
+        except Exception:
+            conn.rollback()
+            raise
+        
+        finally:
+            self.pool.release(conn)
+    
+    def _create_schema(self, cursor):
+        """Create every table, index and trigger of the current schema"""
+        # Narrow listing table: everything get_mailbox needs and nothing large.
+        # seq is a stable rowid that the content tables and search index refer to
+        cursor.execute('''
+        CREATE TABLE IF NOT EXISTS emails (
+            seq INTEGER PRIMARY KEY,
+            id TEXT NOT NULL UNIQUE,
+            sender TEXT NOT NULL,
+            recipient TEXT NOT NULL,
+            subject TEXT,
+            received_date INTEGER NOT NULL,
+            is_read BOOLEAN DEFAULT 0,
+            attachments TEXT,
+            size INTEGER NOT NULL DEFAULT 0,
+            message_id TEXT,
+            parent_message_id TEXT,
+            thread_id INTEGER,
+            content_hash TEXT,
+            modseq INTEGER NOT NULL DEFAULT 0
+        )
+        ''')
+        
+        # Message content lives apart so large bodies never bloat listing pages
+        cursor.execute('''
+        CREATE TABLE IF NOT EXISTS email_bodies (
+            email_seq INTEGER PRIMARY KEY,
+            body TEXT
+        )
+        ''')
+        cursor.execute('''
+        CREATE TABLE IF NOT EXISTS email_raw (
+            email_seq INTEGER PRIMARY KEY,
+            raw_email BLOB
+        )
+        ''')
+        
+        # Mailbox listings seek straight to a recipient's newest emails in
+        # index order, so neither sorting nor OFFSET scans are needed
+        cursor.execute('''
+        CREATE INDEX IF NOT EXISTS idx_recipient_date ON emails (recipient, received_date, id)
+        ''')
+        
+        # Date ranges across every mailbox (retention, admin queries)
+        cursor.execute('''
+        CREATE INDEX IF NOT EXISTS idx_received_date ON emails (received_date)
+        ''')
+        
+        # A message already stored for the same recipient with the same
+        # Message-ID and bytes is a duplicate delivery or a repeated migration
+        cursor.execute('''
+        CREATE INDEX IF NOT EXISTS idx_dedup ON emails (recipient, message_id, content_hash)
+        ''')
+        
+        self._create_usage_tables(cursor)
+        self._create_thread_tables(cursor)
+        self._create_header_tables(cursor)
+        self._create_modseq_tables(cursor)
+        self._create_attachment_tables(cursor)
+        self._create_sync_tables(cursor)
+        self._create_search_index(cursor)
+        
+        # Content goes with its email
+        cursor.execute('''
+        CREATE TRIGGER IF NOT EXISTS emails_delete_content AFTER DELETE ON emails BEGIN
+            DELETE FROM email_bodies WHERE email_seq = old.seq;
+            DELETE FROM email_raw WHERE email_seq = old.seq;
+        END
+        ''')
+    
+    def _convert_received_dates(self, conn, cursor):
+        """Rewrite ISO string dates from older versions as UTC epoch microseconds"""
+        # Done in Python because SQLite's julianday() loses microsecond precision
+        conn.create_function("iso_to_epoch_us", 1, _iso_to_epoch_us, deterministic=True)
+        cursor.execute('''
+        UPDATE emails SET received_date = iso_to_epoch_us(received_date)
+        WHERE typeof(received_date) != 'integer'
+        ''')
+    
+    def _backfill_content_hashes(self, conn, cursor):
+        """Hash the raw message of every email stored before duplicates were detected"""
+        conn.create_function("sha256_hex", 1, _sha256_hex, deterministic=True)
+        cursor.execute('''
+        UPDATE emails SET content_hash = (SELECT sha256_hex(raw_email) FROM email_raw WHERE email_seq = emails.seq)
+        WHERE content_hash IS NULL
+        ''')
+    
+    def _add_missing_columns(self, cursor, table, columns):
+        """Add columns introduced by later versions to an existing table"""
+        existing = {row[1] for row in cursor.execute(f"PRAGMA table_info({table})").fetchall()}
+        if not existing:
+            # New database; _create_schema creates the table with every column
+            return
+        
+        for name, declaration in columns.items():
+            if name not in existing:
+                cursor.execute(f"ALTER TABLE {table} ADD COLUMN {name} {declaration}")
+    
+    def _split_legacy_emails_table(self, cursor):
+        """Move bodies and raw messages out of a pre-version-4 emails table"""
+        columns = [row[1] for row in cursor.execute("PRAGMA table_info(emails)").fetchall()]
+        if "raw_email" not in columns:
+            return
+        
+        # The old search index and its triggers point at the old table
+        for trigger in ("emails_fts_insert", "emails_fts_delete", "emails_fts_update"):
+            cursor.execute(f"DROP TRIGGER IF EXISTS {trigger}")
+        cursor.execute("DROP TABLE IF EXISTS emails_fts")
+        cursor.execute("DROP INDEX IF EXISTS idx_recipient")
+        cursor.execute("DROP INDEX IF EXISTS idx_recipient_date")
+        cursor.execute("ALTER TABLE emails RENAME TO emails_legacy")
+        
+        self._create_schema(cursor)
+        
+        cursor.execute('''
+        INSERT INTO emails (id, sender, recipient, subject, received_date, is_read, attachments, size)
+        SELECT id, sender, recipient, subject, received_date, is_read, attachments, COALESCE(LENGTH(raw_email), 0)
+        FROM emails_legacy
+        ORDER BY rowid
+        ''')
+        # The body insert trigger indexes every copied message for search
+        cursor.execute('''
+        INSERT INTO email_bodies (email_seq, body)
+        SELECT e.seq, l.body FROM emails e JOIN emails_legacy l ON l.id = e.id
+        ''')
+        cursor.execute('''
+        INSERT INTO email_raw (email_seq, raw_email)
+        SELECT e.seq, l.raw_email FROM emails e JOIN emails_legacy l ON l.id = e.id
+        ''')
+        
+        # The freed pages are returned by the maintenance job's incremental vacuum
+        cursor.execute("DROP TABLE emails_legacy")
+    
+    def _create_usage_tables(self, cursor):
+        """Create the trigger-maintained mailbox summary and the quota table"""
+        # One row per mailbox, so counts never need a COUNT(*) over emails
+        cursor.execute('''
+        CREATE TABLE IF NOT EXISTS mailbox_summary (
+            recipient TEXT PRIMARY KEY,
+            total INTEGER NOT NULL DEFAULT 0,
+            unread INTEGER NOT NULL DEFAULT 0,
+            bytes INTEGER NOT NULL DEFAULT 0,
+            newest INTEGER
+        )
+        ''')
+        
+        # Every change to emails updates the summary in the same transaction
+        cursor.execute('''
+        CREATE TRIGGER IF NOT EXISTS mailbox_summary_insert AFTER INSERT ON emails BEGIN
+            INSERT INTO mailbox_summary (recipient, total, unread, bytes, newest)
+            VALUES (new.recipient, 1, new.is_read = 0, new.size, new.received_date)
+            ON CONFLICT (recipient) DO UPDATE SET
+                total = total + 1,
+                unread = unread + (new.is_read = 0),
+                bytes = bytes + new.size,
+                newest = MAX(COALESCE(newest, new.received_date), new.received_date);
+        END
+        ''')
+        cursor.execute('''
+        CREATE TRIGGER IF NOT EXISTS mailbox_summary_delete AFTER DELETE ON emails BEGIN
+            UPDATE mailbox_summary SET
+                total = total - 1,
+                unread = unread - (old.is_read = 0),
+                bytes = bytes - old.size,
+                newest = CASE WHEN newest > old.received_date THEN newest ELSE (
+                    SELECT MAX(received_date) FROM emails WHERE recipient = old.recipient
+                ) END
+            WHERE recipient = old.recipient;
+            DELETE FROM mailbox_summary WHERE recipient = old.recipient AND total <= 0;
+        END
+        ''')
+        cursor.execute('''
+        CREATE TRIGGER IF NOT EXISTS mailbox_summary_read AFTER UPDATE OF is_read ON emails
+        WHEN old.is_read != new.is_read BEGIN
+            UPDATE mailbox_summary SET unread = unread + (new.is_read = 0) - (old.is_read = 0)
+            WHERE recipient = new.recipient;
+        END
+        ''')
+        
+        # NULL limits fall back to the server-wide defaults
+        cursor.execute('''
+        CREATE TABLE IF NOT EXISTS mailbox_quotas (
+            recipient TEXT PRIMARY KEY,
+            max_messages INTEGER,
+            max_bytes INTEGER
+        )
+        ''')
+    
+    def _backfill_summary(self, cursor):
+        """Rebuild the mailbox summary from existing rows"""
+        cursor.execute("DELETE FROM mailbox_summary")
+        cursor.execute('''
+        INSERT INTO mailbox_summary (recipient, total, unread, bytes, newest)
+        SELECT recipient, COUNT(*), SUM(is_read = 0), SUM(size), MAX(received_date)
+        FROM emails
+        GROUP BY recipient
+        ''')
+    
+    def _create_thread_tables(self, cursor):
+        """Create the conversation index and the triggers that keep its counters current"""
+        # One row per conversation; get_threads pages through it by last activity
+        cursor.execute('''
+        CREATE TABLE IF NOT EXISTS threads (
+            thread_id INTEGER PRIMARY KEY,
+            recipient TEXT NOT NULL,
+            root_message_id TEXT,
+            subject TEXT,
+            message_count INTEGER NOT NULL DEFAULT 0,
+            unread_count INTEGER NOT NULL DEFAULT 0,
+            last_activity INTEGER
+        )
+        ''')
+        cursor.execute('''
+        CREATE INDEX IF NOT EXISTS idx_threads_recipient ON threads (recipient, last_activity, thread_id)
+        ''')
+        
+        # Every Message-ID seen in a mailbox, including ones only referenced by
+        # replies, so a message that arrives late still joins its conversation
+        cursor.execute('''
+        CREATE TABLE IF NOT EXISTS thread_messages (
+            recipient TEXT NOT NULL,
+            message_id TEXT NOT NULL,
+            thread_id INTEGER NOT NULL,
+            PRIMARY KEY (recipient, message_id)
+        ) WITHOUT ROWID
+        ''')
+        cursor.execute('''
+        CREATE INDEX IF NOT EXISTS idx_thread_messages_thread ON thread_messages (thread_id)
+        ''')
+        cursor.execute('''
+        CREATE INDEX IF NOT EXISTS idx_thread ON emails (thread_id, received_date)
+        ''')
+        
+        # Counters follow inserts, deletes, read flags and thread merges
+        cursor.execute('''
+        CREATE TRIGGER IF NOT EXISTS threads_insert AFTER INSERT ON emails
+        WHEN new.thread_id IS NOT NULL BEGIN
+            UPDATE threads SET
+                message_count = message_count + 1,
+                unread_count = unread_count + (new.is_read = 0),
+                last_activity = MAX(COALESCE(last_activity, new.received_date), new.received_date)
+            WHERE thread_id = new.thread_id;
+        END
+        ''')
+        cursor.execute('''
+        CREATE TRIGGER IF NOT EXISTS threads_delete AFTER DELETE ON emails
+        WHEN old.thread_id IS NOT NULL BEGIN
+            UPDATE threads SET
+                message_count = message_count - 1,
+                unread_count = unread_count - (old.is_read = 0),
+                last_activity = (SELECT MAX(received_date) FROM emails WHERE thread_id = old.thread_id)
+            WHERE thread_id = old.thread_id;
+            DELETE FROM thread_messages WHERE thread_id = old.thread_id
+                AND NOT EXISTS (SELECT 1 FROM emails WHERE thread_id = old.thread_id);
+            DELETE FROM threads WHERE thread_id = old.thread_id AND message_count <= 0;
+        END
+        ''')
+        cursor.execute('''
+        CREATE TRIGGER IF NOT EXISTS threads_read AFTER UPDATE OF is_read ON emails
+        WHEN old.is_read != new.is_read AND new.thread_id IS NOT NULL BEGIN
+            UPDATE threads SET unread_count = unread_count + (new.is_read = 0) - (old.is_read = 0)
+            WHERE thread_id = new.thread_id;
+        END
+        ''')
+        cursor.execute('''
+        CREATE TRIGGER IF NOT EXISTS threads_move AFTER UPDATE OF thread_id ON emails
+        WHEN old.thread_id IS NOT new.thread_id BEGIN
+            UPDATE threads SET
+                message_count = message_count - 1,
+                unread_count = unread_count - (old.is_read = 0),
+                last_activity = (SELECT MAX(received_date) FROM emails WHERE thread_id = old.thread_id)
+            WHERE thread_id = old.thread_id;
+            UPDATE threads SET
+                message_count = message_count + 1,
+                unread_count = unread_count + (new.is_read = 0),
+                last_activity = MAX(COALESCE(last_activity, new.received_date), new.received_date)
+            WHERE thread_id = new.thread_id;
+            DELETE FROM threads WHERE thread_id = old.thread_id AND message_count <= 0;
+        END
+        ''')
+    
+    def _backfill_threads(self, cursor):
+        """Thread every stored message, oldest first, from the headers of its raw message"""
+        seqs = [row[0] for row in cursor.execute('''
+        SELECT seq FROM emails WHERE thread_id IS NULL ORDER BY received_date, seq
+        ''').fetchall()]
+        
+        for start in range(0, len(seqs), 500):
+            chunk = seqs[start:start + 500]
+            placeholders = ",".join("?" * len(chunk))
+            
+            # Headers sit at the start of the message, so a prefix is enough
+            rows = cursor.execute(f'''
+            SELECT e.seq, e.recipient, e.subject, substr(r.raw_email, 1, {RAW_CHUNK_SIZE}) AS head
+            FROM emails e LEFT JOIN email_raw r ON r.email_seq = e.seq
+            WHERE e.seq IN ({placeholders})
+            ''', chunk).fetchall()
+            by_seq = {row["seq"]: row for row in rows}
+            
+            for seq in chunk:
+                row = by_seq[seq]
+                fields = self._thread_fields(self._parse_headers(row["head"]))
+                fields.update(recipient=row["recipient"], subject=row["subject"])
+                thread_id = self._assign_thread(cursor, fields)
+                cursor.execute('''
+                UPDATE emails SET message_id = ?, parent_message_id = ?, thread_id = ? WHERE seq = ?
+                ''', (fields["message_id"], fields["parent_message_id"], thread_id, seq))
+    
+    def _create_modseq_tables(self, cursor):
+        """Create the per-mailbox modification sequence, the tombstones and their triggers"""
+        # Highest modseq handed out per mailbox. Rows are never removed, so a
+        # mailbox that empties and refills keeps counting upwards. floor is the
+        # highest modseq whose tombstones were pruned
+        cursor.execute('''
+        CREATE TABLE IF NOT EXISTS mailbox_modseq (
+            recipient TEXT PRIMARY KEY,
+            modseq INTEGER NOT NULL DEFAULT 0,
+            floor INTEGER NOT NULL DEFAULT 0
+        )
+        ''')
+        
+        # Deleted emails, so clients can drop them without relisting the mailbox
+        cursor.execute('''
+        CREATE TABLE IF NOT EXISTS email_tombstones (
+            recipient TEXT NOT NULL,
+            modseq INTEGER NOT NULL,
+            id TEXT NOT NULL,
+            deleted_date INTEGER NOT NULL,
+            PRIMARY KEY (recipient, modseq)
+        ) WITHOUT ROWID
+        ''')
+        cursor.execute('''
+        CREATE INDEX IF NOT EXISTS idx_recipient_modseq ON emails (recipient, modseq)
+        ''')
+        
+        # Every insert, read flag change and delete takes the mailbox's next modseq
+        cursor.execute('''
+        CREATE TRIGGER IF NOT EXISTS modseq_insert AFTER INSERT ON emails BEGIN
+            INSERT INTO mailbox_modseq (recipient, modseq) VALUES (new.recipient, 1)
+            ON CONFLICT (recipient) DO UPDATE SET modseq = modseq + 1;
+            UPDATE emails SET modseq = (SELECT modseq FROM mailbox_modseq WHERE recipient = new.recipient)
+            WHERE seq = new.seq;
+        END
+        ''')
+        cursor.execute('''
+        CREATE TRIGGER IF NOT EXISTS modseq_read AFTER UPDATE OF is_read ON emails
+        WHEN old.is_read != new.is_read BEGIN
+            UPDATE mailbox_modseq SET modseq = modseq + 1 WHERE recipient = new.recipient;
+            UPDATE emails SET modseq = (SELECT modseq FROM mailbox_modseq WHERE recipient = new.recipient)
+            WHERE seq = new.seq;
+        END
+        ''')
+        cursor.execute('''
+        CREATE TRIGGER IF NOT EXISTS modseq_delete AFTER DELETE ON emails BEGIN
+            UPDATE mailbox_modseq SET modseq = modseq + 1 WHERE recipient = old.recipient;
+            INSERT INTO email_tombstones (recipient, modseq, id, deleted_date)
+            SELECT old.recipient, modseq, old.id, CAST(strftime('%s', 'now') AS INTEGER) * 1000000
+            FROM mailbox_modseq WHERE recipient = old.recipient;
+        END
+        ''')
+    
+    def _backfill_modseq(self, cursor):
+        """Number the existing emails of each mailbox in storage order"""
+        cursor.execute("DELETE FROM mailbox_modseq")
+        
+        modseqs = {}
+        updates = []
+        for seq, recipient in cursor.execute("SELECT seq, recipient FROM emails ORDER BY seq").fetchall():
+            modseqs[recipient] = modseqs.get(recipient, 0) + 1
+            updates.append((modseqs[recipient], seq))
+        
+        cursor.executemany("UPDATE emails SET modseq = ? WHERE seq = ?", updates)
+        cursor.executemany('''
+        INSERT INTO mailbox_modseq (recipient, modseq) VALUES (?, ?)
+        ''', list(modseqs.items()))
+    
+    def _create_header_tables(self, cursor):
+        """Create the tables that index header fields extracted at delivery"""
+        # One row per email for the single-valued headers
+        cursor.execute('''
+        CREATE TABLE IF NOT EXISTS email_headers (
+            email_seq INTEGER PRIMARY KEY,
+            to_header TEXT,
+            cc_header TEXT,
+            header_date INTEGER,
+            content_type TEXT
+        )
+        ''')
+        
+        # One row per address in From, To and Cc, lower-cased, with its domain
+        # split out so "all mail from example.com" is a single index range
+        cursor.execute('''
+        CREATE TABLE IF NOT EXISTS email_addresses (
+            email_seq INTEGER NOT NULL,
+            field TEXT NOT NULL,
+            address TEXT NOT NULL,
+            domain TEXT NOT NULL,
+            PRIMARY KEY (email_seq, field, address)
+        ) WITHOUT ROWID
+        ''')
+        cursor.execute('''
+        CREATE INDEX IF NOT EXISTS idx_addresses_domain ON email_addresses (domain, field, email_seq)
+        ''')
+        cursor.execute('''
+        CREATE INDEX IF NOT EXISTS idx_addresses_address ON email_addresses (address, field, email_seq)
+        ''')
+        
+        # Size filters ("larger than 10 MB") across every mailbox
+        cursor.execute('''
+        CREATE INDEX IF NOT EXISTS idx_size ON emails (size)
+        ''')
+        
+        cursor.execute('''
+        CREATE TRIGGER IF NOT EXISTS emails_delete_headers AFTER DELETE ON emails BEGIN
+            DELETE FROM email_headers WHERE email_seq = old.seq;
+            DELETE FROM email_addresses WHERE email_seq = old.seq;
+        END
+        ''')
+    
+    def _backfill_headers(self, cursor):
+        """Index the headers of emails stored before the header tables existed"""
+        seqs = [row[0] for row in cursor.execute('''
+        SELECT seq FROM emails WHERE seq NOT IN (SELECT email_seq FROM email_headers) ORDER BY seq
+        ''').fetchall()]
+        
+        for start in range(0, len(seqs), 500):
+            chunk = seqs[start:start + 500]
+            placeholders = ",".join("?" * len(chunk))
+            
+            rows = []
+            for row in cursor.execute(f'''
+            SELECT e.seq, substr(r.raw_email, 1, {RAW_CHUNK_SIZE}) AS head
+            FROM emails e LEFT JOIN email_raw r ON r.email_seq = e.seq
+            WHERE e.seq IN ({placeholders})
+            ''', chunk).fetchall():
+                fields = self._header_fields(self._parse_headers(row["head"]))
+                fields["seq"] = row["seq"]
+                rows.append(fields)
+            self._insert_header_rows(cursor, rows)
+    
+    def _create_attachment_tables(self, cursor):
+        """Create the attachment catalog filled at delivery"""
+        # One row per attachment part, numbered in walk() order. The byte range
+        # of the encoded body lets one attachment be read without parsing the rest
+        cursor.execute('''
+        CREATE TABLE IF NOT EXISTS email_attachments (
+            email_seq INTEGER NOT NULL,
+            part_index INTEGER NOT NULL,
+            filename TEXT,
+            content_type TEXT NOT NULL,
+            size INTEGER NOT NULL,
+            content_hash TEXT NOT NULL,
+            body_offset INTEGER NOT NULL,
+            body_length INTEGER NOT NULL,
+            transfer_encoding TEXT,
+            PRIMARY KEY (email_seq, part_index)
+        ) WITHOUT ROWID
+        ''')
+        
+        # The same file sent to many people is found by its hash
+        cursor.execute('''
+        CREATE INDEX IF NOT EXISTS idx_attachments_hash ON email_attachments (content_hash)
+        ''')
+        
+        cursor.execute('''
+        CREATE TRIGGER IF NOT EXISTS emails_delete_attachments AFTER DELETE ON emails BEGIN
+            DELETE FROM email_attachments WHERE email_seq = old.seq;
+        END
+        ''')
+    
+    def _create_sync_tables(self, cursor):
+        """Create the manifest that mailbox_sync.py keeps of the .eml tree"""
+        # One row per .eml file: its fingerprint when last synced and the email
+        # it maps to. status is 'ok', or flags a file gone from disk
+        # ('file_missing') or an email gone from the database ('email_deleted')
+        cursor.execute('''
+        CREATE TABLE IF NOT EXISTS file_manifest (
+            recipient TEXT NOT NULL,
+            filename TEXT NOT NULL,
+            size INTEGER NOT NULL,
+            mtime_ns INTEGER NOT NULL,
+            content_hash TEXT NOT NULL,
+            email_id TEXT,
+            status TEXT NOT NULL DEFAULT 'ok',
+            PRIMARY KEY (recipient, filename)
+        ) WITHOUT ROWID
+        ''')
+        cursor.execute('''
+        CREATE INDEX IF NOT EXISTS idx_file_manifest_email ON file_manifest (recipient, email_id)
+        ''')
+        
+        # Flagged rows are few, so listing them never walks the whole manifest
+        cursor.execute('''
+        CREATE INDEX IF NOT EXISTS idx_file_manifest_flagged ON file_manifest (recipient, status) WHERE status != 'ok'
+        ''')
+        
+        # Per mailbox: the directory mtime at the last full look and the modseq
+        # up to which database deletions have been applied to the manifest
+        cursor.execute('''
+        CREATE TABLE IF NOT EXISTS sync_state (
+            recipient TEXT PRIMARY KEY,
+            dir_mtime_ns INTEGER,
+            modseq INTEGER NOT NULL DEFAULT 0
+        )
+        ''')
+    
+    def _backfill_attachments(self, cursor):
+        """Catalog the attachments of emails stored before the catalog existed"""
+        # Only multipart messages or ones with attachment names can have any
+        seqs = [row[0] for row in cursor.execute('''
+        SELECT e.seq FROM emails e LEFT JOIN email_headers h ON h.email_seq = e.seq
+        WHERE h.content_type IS NULL OR h.content_type LIKE 'multipart/%'
+           OR COALESCE(e.attachments, '[]') NOT IN ('[]', '')
+        ORDER BY e.seq
+        ''').fetchall()]
+        
+        # Messages are read one at a time so a batch of large ones never sits in memory
+        for start in range(0, len(seqs), 500):
+            rows = []
+            for seq in seqs[start:start + 500]:
+                raw = cursor.execute("SELECT raw_email FROM email_raw WHERE email_seq = ?", (seq,)).fetchone()
+                rows.append({"seq": seq, "raw_email": raw[0] if raw else None})
+            self._insert_attachment_rows(cursor, rows)
+    
+    @staticmethod
+    def _attachment_parts(stream):
+        """Catalog entries for the attachments of a raw message on a seekable binary stream"""
+        attachments = []
+        for part in scan_mime_parts(stream):
+            headers = part["headers"]
+            if headers.get_content_maintype() == "multipart":
+                continue
+            
+            # Named parts count as attachments, as do unnamed ones marked as such
+            if not headers.get_filename() and headers.get_content_disposition() != "attachment":
+                continue
+            
+            # The default policy decodes encoded-word and RFC 2231 filenames
+            filename = BytesHeaderParser(policy=default).parsebytes(part["header_block"]).get_filename()
+            
+            # Size and hash are of the decoded file, not its transfer encoding
+            encoding = str(headers.get("Content-Transfer-Encoding", "")).strip().lower() or None
+            length = part["end"] - part["start"]
+            content_hash = hashlib.sha256()
+            size = 0
+            for chunk in decode_transfer_chunks(read_range(stream, part["start"], length), encoding):
+                content_hash.update(chunk)
+                size += len(chunk)
+            
+            attachments.append({
+                "part_index": part["index"],
+                "filename": filename,
+                "content_type": headers.get_content_type(),
+                "size": size,
+                "content_hash": content_hash.hexdigest(),
+                "body_offset": part["start"],
+                "body_length": length,
+                "transfer_encoding": encoding,
+            })
+        return attachments
+    
+    def _insert_attachment_rows(self, cursor, rows):
+        """Insert the catalog rows of emails whose seq is known, scanning raw_email where not done yet"""
+        for row in rows:
+            attachments = row.get("attachment_parts")
+            if attachments is None:
+                raw = row.get("raw_email") or b""
+                if isinstance(raw, str):
+                    raw = raw.encode("utf-8", "replace")
+                attachments = self._attachment_parts(io.BytesIO(raw))
+            
+            cursor.executemany('''
+            INSERT OR REPLACE INTO email_attachments (email_seq, part_index, filename, content_type, size,
+                                                      content_hash, body_offset, body_length, transfer_encoding)
+            VALUES (:seq, :part_index, :filename, :content_type, :size,
+                    :content_hash, :body_offset, :body_length, :transfer_encoding)
+            ''', [dict(attachment, seq=row["seq"]) for attachment in attachments])
+    
+    @staticmethod
+    def _header_fields(message):
+        """Normalized address, Date and Content-Type values of a parsed message"""
+        addresses = []
+        for field, header in ADDRESS_FIELDS:
+            values = [str(value) for value in message.get_all(header, [])]
+            seen = set()
+            for _, address in getaddresses(values):
+                address = address.strip().lower()
+                if "@" in address and address not in seen:
+                    seen.add(address)
+                    addresses.append((field, address, address.rsplit("@", 1)[1]))
+        
+        # An unparseable Date is left empty rather than rejecting the message
+        header_date = None
+        try:
+            parsed = parsedate_to_datetime(str(message.get("Date", "")))
+            if parsed.tzinfo is None:
+                parsed = parsed.replace(tzinfo=datetime.timezone.utc)
+            header_date = to_epoch_us(parsed)
+        except (TypeError, ValueError, IndexError):
+            pass
+        
+        return {
+            "addresses": addresses,
+            "to_header": str(message.get("To", "")) or None,
+            "cc_header": str(message.get("Cc", "")) or None,
+            "header_date": header_date,
+            "content_type": message.get_content_type(),
+        }
+    
+    def _insert_header_rows(self, cursor, rows):
+        """Insert the header index rows of emails whose seq is known"""
+        cursor.executemany('''
+        INSERT OR REPLACE INTO email_headers (email_seq, to_header, cc_header, header_date, content_type)
+        VALUES (:seq, :to_header, :cc_header, :header_date, :content_type)
+        ''', rows)
+        cursor.executemany('''
+        INSERT OR IGNORE INTO email_addresses (email_seq, field, address, domain) VALUES (?, ?, ?, ?)
+        ''', [(row["seq"],) + address for row in rows for address in row["addresses"]])
+    
+    def _parse_headers(self, raw):
+        """Parse just the headers of a raw message"""
+        if isinstance(raw, str):
+            raw = raw.encode("utf-8", "replace")
+        return BytesHeaderParser(policy=default).parsebytes(raw or b"")
+    
+    @staticmethod
+    def _thread_fields(message):
+        """Message-ID, parent and references of a parsed message, without angle brackets"""
+        def ids(header):
+            value = message.get(header)
+            return MESSAGE_ID_PATTERN.findall(str(value)) if value else []
+        
+        own = ids("Message-ID")
+        references = ids("References")
+        in_reply_to = ids("In-Reply-To")
+        parent = in_reply_to[0] if in_reply_to else (references[-1] if references else None)
+        if parent and parent not in references:
+            references.append(parent)
+        
+        return {
+            "message_id": own[0] if own else None,
+            "parent_message_id": parent,
+            "references": references,
+        }
+    
+    def _assign_thread(self, cursor, row):
+        """Find or create the thread for a message and record its Message-IDs"""
+        related = [message_id for message_id in row["references"] + [row["message_id"]] if message_id]
+        
+        thread_ids = []
+        if related:
+            placeholders = ",".join("?" * len(related))
+            thread_ids = sorted(found[0] for found in cursor.execute(f'''
+            SELECT DISTINCT thread_id FROM thread_messages
+            WHERE recipient = ? AND message_id IN ({placeholders})
+            ''', [row["recipient"]] + related).fetchall())
+        
+        if thread_ids:
+            # A message that links two conversations folds the newer into the older
+            thread_id = thread_ids[0]
+            for other in thread_ids[1:]:
+                cursor.execute("UPDATE thread_messages SET thread_id = ? WHERE thread_id = ?", (thread_id, other))
+                cursor.execute("UPDATE emails SET thread_id = ? WHERE thread_id = ?", (thread_id, other))
+                self.message_cache.invalidate_where(lambda view, other=other: view["thread_id"] == other)
+        else:
+            subject = SUBJECT_PREFIX_PATTERN.sub("", row["subject"] or "").strip()
+            cursor.execute('''
+            INSERT INTO threads (recipient, root_message_id, subject) VALUES (?, ?, ?)
+            ''', (row["recipient"], related[0] if related else None, subject))
+            thread_id = cursor.lastrowid
+        
+        cursor.executemany('''
+        INSERT OR IGNORE INTO thread_messages (recipient, message_id, thread_id) VALUES (?, ?, ?)
+        ''', [(row["recipient"], message_id, thread_id) for message_id in related])
+        return thread_id
+    
+    def _create_search_index(self, cursor):
+        """Create the FTS5 index over subject, sender and body"""
+        # External content: the text stays in emails and email_bodies, FTS5
+        # only keeps the index and reads snippets back through this view
+        cursor.execute('''
+        CREATE VIEW IF NOT EXISTS emails_search AS
+        SELECT e.seq AS seq, e.subject AS subject, e.sender AS sender, b.body AS body
+        FROM emails e JOIN email_bodies b ON b.email_seq = e.seq
+        ''')
+        cursor.execute('''
+        CREATE VIRTUAL TABLE IF NOT EXISTS emails_fts USING fts5(
+            subject, sender, body,
+            content='emails_search', content_rowid='seq',
+            tokenize='unicode61 remove_diacritics 2',
+            prefix='2 3'
+        )
+        ''')
+        
+        # Keep the index in step with every write. A message is indexed once
+        # its body row exists, which _insert_email_rows writes after emails
+        cursor.execute('''
+        CREATE TRIGGER IF NOT EXISTS email_bodies_fts_insert AFTER INSERT ON email_bodies BEGIN
+            INSERT INTO emails_fts (rowid, subject, sender, body)
+            SELECT seq, subject, sender, new.body FROM emails WHERE seq = new.email_seq;
+        END
+        ''')
+        cursor.execute('''
+        CREATE TRIGGER IF NOT EXISTS emails_fts_delete BEFORE DELETE ON emails BEGIN
+            INSERT INTO emails_fts (emails_fts, rowid, subject, sender, body)
+            SELECT 'delete', old.seq, old.subject, old.sender, body FROM email_bodies WHERE email_seq = old.seq;
+        END
+        ''')
+        cursor.execute('''
+        CREATE TRIGGER IF NOT EXISTS emails_fts_update AFTER UPDATE OF subject, sender ON emails BEGIN
+            INSERT INTO emails_fts (emails_fts, rowid, subject, sender, body)
+            SELECT 'delete', old.seq, old.subject, old.sender, body FROM email_bodies WHERE email_seq = old.seq;
+            INSERT INTO emails_fts (rowid, subject, sender, body)
+            SELECT new.seq, new.subject, new.sender, body FROM email_bodies WHERE email_seq = new.seq;
+        END
+        ''')
+    
+    @classmethod
+    def build_email_row(cls, recipient, message_data, catalog_attachments=True):
+        """Parse a raw message into the values stored for it; needs no database, so worker processes can call it"""
+        # Parse the email message
+        message = email.message_from_bytes(message_data, policy=default)
+        
+        # Extract email parts
+        email_id = new_email_id()
+        sender = message.get('From', 'Unknown')
+        subject = message.get('Subject', 'No Subject')
+        
+        # Get the body of the email
+        body = ""
+        attachments = []
+        
+        if message.is_multipart():
+            for part in message.walk():
+                content_type = part.get_content_type()
+                content_disposition = str(part.get("Content-Disposition", ""))
+                
+                # Handle text parts as body
+                if content_type == "text/plain" and "attachment" not in content_disposition:
+                    body = part.get_content()
+                
+                # Handle attachments (simplified)
+                elif "attachment" in content_disposition:
+                    filename = part.get_filename()
+                    if filename:
+                        attachments.append(filename)
+        else:
+            body = message.get_content()
+        
+        row = {
+            "id": email_id,
+            "sender": sender,
+            "recipient": recipient,
+            "subject": subject,
+            "body": body,
+            "received_date": time.time_ns() // 1000,
+            "is_read": False,
+            "raw_email": message_data,
+            "attachments": json.dumps(attachments),
+            "size": len(message_data),
+            "content_hash": hashlib.sha256(message_data).hexdigest()
+        }
+        row.update(cls._thread_fields(message))
+        row.update(cls._header_fields(message))
+        if catalog_attachments:
+            row["attachment_parts"] = cls._attachment_parts(io.BytesIO(message_data))
+        return row
+    
+    def _insert_email_rows(self, cursor, rows):
+        """Insert rows built by build_email_row inside the caller's transaction and return the new ones"""
+        # Metadata first; its seq links the content rows. Threads are assigned
+        # one row at a time so a reply later in the batch finds its original
+        new_rows = []
+        for row in rows:
+            # A duplicate takes the id of the stored copy and is not inserted
+            duplicate = self._find_duplicate(cursor, row)
+            row["duplicate"] = duplicate is not None
+            if duplicate is not None:
+                row["id"] = duplicate
+                continue
+            
+            row["thread_id"] = self._assign_thread(cursor, row)
+            cursor.execute('''
+            INSERT INTO emails (id, sender, recipient, subject, received_date, is_read, attachments, size,
+                                message_id, parent_message_id, thread_id, content_hash)
+            VALUES (:id, :sender, :recipient, :subject, :received_date, :is_read, :attachments, :size,
+                    :message_id, :parent_message_id, :thread_id, :content_hash)
+            ''', row)
+            row["seq"] = cursor.lastrowid
+            new_rows.append(row)
+        rows = new_rows
+        
+        cursor.executemany('''
+        INSERT INTO email_bodies (email_seq, body) VALUES (:seq, :body)
+        ''', rows)
+        cursor.executemany('''
+        INSERT INTO email_raw (email_seq, raw_email) VALUES (:seq, :raw_email)
+        ''', rows)
+        self._insert_header_rows(cursor, rows)
+        self._insert_attachment_rows(cursor, rows)
+        return rows
+    
+    def _find_duplicate(self, cursor, row):
+        """Id of an email already stored with the row's recipient, Message-ID and content hash"""
+        found = cursor.execute('''
+        SELECT id FROM emails WHERE recipient = ? AND message_id IS ? AND content_hash = ?
+        ''', (row["recipient"], row["message_id"], row["content_hash"])).fetchone()
+        return found[0] if found else None
+    
+    def store_email(self, recipient, message_data):
+        """Store an email in the database"""
+        return self.deliver_email(recipient, message_data)[0]
+    
+    def deliver_email(self, recipient, message_data):
+        """Store an email and return (id, created); created is False when it duplicates a stored email"""
+        conn = self.pool.acquire()
+        cursor = conn.cursor()
+        
+        try:
+            row = self.build_email_row(recipient, message_data)
+            
+            # Take the write lock up front so the duplicate check stays valid
+            cursor.execute("BEGIN IMMEDIATE")
+            
+            # Insert the email into the database
+            self._insert_email_rows(cursor, [row])
+            
+            conn.commit()
+            return row["id"], not row["duplicate"]
+        
+        except Exception as e:
+            # Log the error and rollback
+            print(f"Error storing email: {e}")
+            conn.rollback()
+            return None, False
+        
+        finally:
+            self.pool.release(conn)
+    
+    def store_many(self, items):
+        """Store (recipient, message_data) pairs in one transaction and return an id or None per item"""
+        items = list(items)
+        results = [None] * len(items)
+        rows = []
+        positions = []
+        
+        # Messages that fail to parse are skipped instead of failing the batch
+        for position, (recipient, message_data) in enumerate(items):
+            try:
+                rows.append(self.build_email_row(recipient, message_data))
+                positions.append(position)
+            except Exception as e:
+                print(f"Error parsing email {position}: {e}")
+        
+        for position, email_id in zip(positions, self.store_rows(rows)):
+            results[position] = email_id
+        return results
+    
+    def store_rows(self, rows):
+        """Store rows built by build_email_row in one transaction and return an id or None per row"""
+        if not rows:
+            return []
+        
+        conn = self.pool.acquire()
+        cursor = conn.cursor()
+        
+        try:
+            # Take the write lock up front so the duplicate check stays valid
+            cursor.execute("BEGIN IMMEDIATE")
+            
+            # Duplicates of stored messages, or of earlier ones in the batch,
+            # are not stored again and report the id of the stored copy
+            self._insert_email_rows(cursor, rows)
+            
+            conn.commit()
+            return [row["id"] for row in rows]
+        
+        except Exception as e:
+            print(f"Error storing emails: {e}")
+            conn.rollback()
+            return [None] * len(rows)
+        
+        finally:
+            self.pool.release(conn)
+    
+    def store_email_stream(self, recipient, stream, received_date=None, is_read=False):
+        """Store a message read from a binary file object without holding it in memory as one bytes object
+
+        received_date (epoch microseconds) and is_read carry over an archive's
+        own delivery date and read state; a duplicate keeps the stored copy's.
+        """
+        # Spool to learn the size and hash; small messages stay in memory, large ones go to disk
+        with tempfile.SpooledTemporaryFile(max_size=PARSE_LIMIT) as spool:
+            content_hash = hashlib.sha256()
+            for chunk in iter(lambda: stream.read(RAW_CHUNK_SIZE), b""):
+                content_hash.update(chunk)
+                spool.write(chunk)
+            size = spool.tell()
+            
+            # Metadata and body come from a bounded prefix of the message, the
+            # attachment catalog from a scan of all of it
+            spool.seek(0)
+            try:
+                row = self.build_email_row(recipient, spool.read(PARSE_LIMIT), catalog_attachments=False)
+                row["attachment_parts"] = self._attachment_parts(spool)
+            except Exception as e:
+                print(f"Error parsing email: {e}")
+                return None
+            row["raw_email"] = b""
+            row["size"] = size
+            row["content_hash"] = content_hash.hexdigest()
+            if received_date is not None:
+                row["received_date"] = received_date
+            row["is_read"] = is_read
+            
+            conn = self.pool.acquire()
+            cursor = conn.cursor()
+            
+            try:
+                cursor.execute("BEGIN IMMEDIATE")
+                if not self._insert_email_rows(cursor, [row]):
+                    conn.commit()
+                    return row["id"]
+                
+                # Reserve the full size, then fill it chunk by chunk through a blob handle
+                cursor.execute('''
+                UPDATE email_raw SET raw_email = zeroblob(?) WHERE email_seq = ?
+                ''', (size, row["seq"]))
+                
+                spool.seek(0)
+                with conn.blobopen("email_raw", "raw_email", row["seq"]) as blob:
+                    for chunk in iter(lambda: spool.read(RAW_CHUNK_SIZE), b""):
+                        blob.write(chunk)
+                
+                conn.commit()
+                return row["id"]
+            
+            except Exception as e:
+                print(f"Error storing email: {e}")
+                conn.rollback()
+                return None
+            
+            finally:
+                self.pool.release(conn)
+    
+    def get_mailbox(self, email_address, limit=50, offset=0):
+        """Get emails for a specific mailbox (recipient)"""
+        conn = self.pool.acquire()
+        cursor = conn.cursor()
+        
+        try:
+            cursor.execute('''
+            SELECT id, sender, recipient, subject, received_date, is_read 
+            FROM emails 
+            WHERE recipient = ? 
+            ORDER BY received_date DESC, id DESC
+            LIMIT ? OFFSET ?
+            ''', (email_address, limit, offset))
+            
+            emails = [dict(row) for row in cursor.fetchall()]
+            return emails
+        
+        except Exception as e:
+            print(f"Error getting mailbox: {e}")
+            return []
+        
+        finally:
+            self.pool.release(conn)
+    
+    def get_mailbox_page(self, email_address, limit=50, page_token=None):
+        """Get one page of a mailbox, newest first, and the token for the next page (None at the end)
+
+        Raises ValueError for a page token that was not produced by this method.
+        """
+        # A bad token is the caller's mistake, not an empty mailbox
+        if page_token is not None:
+            received_date, email_id = self._decode_page_token(page_token)
+        
+        conn = self.pool.acquire()
+        cursor = conn.cursor()
+        
+        try:
+            if page_token is None:
+                cursor.execute('''
+                SELECT id, sender, recipient, subject, received_date, is_read
+                FROM emails
+                WHERE recipient = ?
+                ORDER BY received_date DESC, id DESC
+                LIMIT ?
+                ''', (email_address, limit + 1))
+            else:
+                # Continue strictly after the last row of the previous page
+                cursor.execute('''
+                SELECT id, sender, recipient, subject, received_date, is_read
+                FROM emails
+                WHERE recipient = ? AND (received_date, id) < (?, ?)
+                ORDER BY received_date DESC, id DESC
+                LIMIT ?
+                ''', (email_address, received_date, email_id, limit + 1))
+            
+            # The extra row only tells us whether another page exists
+            emails = [dict(row) for row in cursor.fetchall()]
+            next_token = None
+            if len(emails) > limit:
+                emails = emails[:limit]
+                next_token = self._encode_page_token(emails[-1]["received_date"], emails[-1]["id"])
+            return emails, next_token
+        
+        except Exception as e:
+            print(f"Error getting mailbox page: {e}")
+            return [], None
+        
+        finally:
+            self.pool.release(conn)
+    
+    def get_emails_between(self, recipient, start=None, end=None, limit=50):
+        """Get a mailbox's emails received in [start, end), newest first; None leaves a side open"""
+        conn = self.pool.acquire()
+        cursor = conn.cursor()
+        
+        try:
+            # Both bounds are integer comparisons inside idx_recipient_date
+            cursor.execute('''
+            SELECT id, sender, recipient, subject, received_date, is_read
+            FROM emails
+            WHERE recipient = ? AND received_date >= ? AND received_date < ?
+            ORDER BY received_date DESC, id DESC
+            LIMIT ?
+            ''', (
+                recipient,
+                to_epoch_us(start) if start is not None else -2 ** 63,
+                to_epoch_us(end) if end is not None else 2 ** 63 - 1,
+                limit
+            ))
+            
+            return [dict(row) for row in cursor.fetchall()]
+        
+        except Exception as e:
+            print(f"Error getting emails by date: {e}")
+            return []
+        
+        finally:
+            self.pool.release(conn)
+    
+    def get_emails_since(self, recipient, since, limit=50):
+        """Get a mailbox's emails received at or after since, newest first"""
+        return self.get_emails_between(recipient, start=since, limit=limit)
+    
+    def get_emails_before(self, recipient, before, limit=50):
+        """Get a mailbox's emails received before a moment, newest first"""
+        return self.get_emails_between(recipient, end=before, limit=limit)
+    
+    def find_emails(self, recipient=None, sender=None, sender_domain=None, to=None, cc=None,
+                    since=None, before=None, min_size=None, max_size=None, content_type=None, limit=50):
+        """Get emails matching every given header filter, newest first; recipient=None searches all mailboxes"""
+        conditions = []
+        params = []
+        
+        if recipient is not None:
+            conditions.append("e.recipient = ?")
+            params.append(recipient)
+        
+        # Address filters read the seqs straight out of an email_addresses index
+        for field, column, value in (("from", "address", sender), ("from", "domain", sender_domain),
+                                     ("to", "address", to), ("cc", "address", cc)):
+            if value is not None:
+                conditions.append(f"e.seq IN (SELECT email_seq FROM email_addresses WHERE {column} = ? AND field = ?)")
+                params.extend([value.strip().lower(), field])
+        
+        if since is not None:
+            conditions.append("e.received_date >= ?")
+            params.append(to_epoch_us(since))
+        if before is not None:
+            conditions.append("e.received_date < ?")
+            params.append(to_epoch_us(before))
+        if min_size is not None:
+            conditions.append("e.size >= ?")
+            params.append(min_size)
+        if max_size is not None:
+            conditions.append("e.size <= ?")
+            params.append(max_size)
+        if content_type is not None:
+            conditions.append("e.seq IN (SELECT email_seq FROM email_headers WHERE content_type = ?)")
+            params.append(content_type.lower())
+        
+        # Without value statistics SQLite walks the date index and filters by
+        # size; when size is the only narrowing filter, the unary plus stops
+        # that so the few large emails are read from idx_size and sorted
+        order = "e.received_date"
+        if min_size is not None and recipient is None and not any((sender, sender_domain, to, cc)):
+            order = "+e.received_date"
+        
+        conn = self.pool.acquire()
+        cursor = conn.cursor()
+        
+        try:
+            cursor.execute(f'''
+            SELECT e.id, e.sender, e.recipient, e.subject, e.received_date, e.is_read, e.size
+            FROM emails e
+            WHERE {" AND ".join(conditions) or "1"}
+            ORDER BY {order} DESC, e.id DESC
+            LIMIT ?
+            ''', params + [limit])
+            
+            return [dict(row) for row in cursor.fetchall()]
+        
+        except Exception as e:
+            print(f"Error finding emails: {e}")
+            return []
+        
+        finally:
+            self.pool.release(conn)
+    
+    def get_emails_from_domain(self, domain, since=None, before=None, recipient=None, limit=50):
+        """Get emails whose From address is at a domain, newest first"""
+        return self.find_emails(recipient=recipient, sender_domain=domain, since=since, before=before, limit=limit)
+    
+    def get_large_emails(self, min_size, recipient=None, limit=50):
+        """Get emails of at least min_size bytes, newest first"""
+        return self.find_emails(recipient=recipient, min_size=min_size, limit=limit)
+    
+    def get_headers(self, email_id):
+        """Get the indexed header fields of an email, with its addresses grouped by field"""
+        conn = self.pool.acquire()
+        cursor = conn.cursor()
+        
+        try:
+            row = cursor.execute('''
+            SELECT e.seq, e.message_id, e.size, h.to_header, h.cc_header, h.header_date, h.content_type
+            FROM emails e LEFT JOIN email_headers h ON h.email_seq = e.seq
+            WHERE e.id = ?
+            ''', (email_id,)).fetchone()
+            if not row:
+                return None
+            
+            headers = dict(row)
+            headers["addresses"] = {field: [] for field, _ in ADDRESS_FIELDS}
+            for field, address in cursor.execute('''
+            SELECT field, address FROM email_addresses WHERE email_seq = ?
+            ''', (headers.pop("seq"),)).fetchall():
+                headers["addresses"][field].append(address)
+            return headers
+        
+        except Exception as e:
+            print(f"Error getting headers: {e}")
+            return None
+        
+        finally:
+            self.pool.release(conn)
+    
+    def get_threads(self, recipient, limit=50, page_token=None):
+        """Get one page of a mailbox's conversations, most recently active first, and the next page token
+
+        Raises ValueError for a page token that was not produced by this method.
+        """
+        if page_token is not None:
+            last_activity, thread_id = self._decode_page_token(page_token)
+        
+        conn = self.pool.acquire()
+        cursor = conn.cursor()
+        
+        try:
+            if page_token is None:
+                cursor.execute('''
+                SELECT thread_id, root_message_id, subject, message_count, unread_count, last_activity
+                FROM threads
+                WHERE recipient = ?
+                ORDER BY last_activity DESC, thread_id DESC
+                LIMIT ?
+                ''', (recipient, limit + 1))
+            else:
+                cursor.execute('''
+                SELECT thread_id, root_message_id, subject, message_count, unread_count, last_activity
+                FROM threads
+                WHERE recipient = ? AND (last_activity, thread_id) < (?, ?)
+                ORDER BY last_activity DESC, thread_id DESC
+                LIMIT ?
+                ''', (recipient, last_activity, thread_id, limit + 1))
+            
+            threads = [dict(row) for row in cursor.fetchall()]
+            next_token = None
+            if len(threads) > limit:
+                threads = threads[:limit]
+                next_token = self._encode_page_token(threads[-1]["last_activity"], threads[-1]["thread_id"])
+            return threads, next_token
+        
+        except Exception as e:
+            print(f"Error getting threads: {e}")
+            return [], None
+        
+        finally:
+            self.pool.release(conn)
+    
+    def get_thread_messages(self, recipient, thread_id):
+        """Get the emails of one conversation in a mailbox, oldest first"""
+        conn = self.pool.acquire()
+        cursor = conn.cursor()
+        
+        try:
+            cursor.execute('''
+            SELECT id, sender, recipient, subject, received_date, is_read, message_id, parent_message_id
+            FROM emails
+            WHERE thread_id = ? AND recipient = ?
+            ORDER BY received_date, id
+            ''', (thread_id, recipient))
+            
+            return [dict(row) for row in cursor.fetchall()]
+        
+        except Exception as e:
+            print(f"Error getting thread: {e}")
+            return []
+        
+        finally:
+            self.pool.release(conn)
+    
+    def _encode_page_token(self, received_date, email_id):
+        """Pack a page position into an opaque continuation token"""
+        raw = json.dumps([received_date, email_id]).encode()
+        return base64.urlsafe_b64encode(raw).decode().rstrip("=")
+    
+    def _decode_page_token(self, page_token):
+        """Unpack a continuation token produced by _encode_page_token"""
+        try:
+            padded = page_token + "=" * (-len(page_token) % 4)
+            received_date, email_id = json.loads(base64.urlsafe_b64decode(padded))
+            if not isinstance(received_date, int):
+                raise TypeError("received_date must be epoch microseconds")
+            return received_date, email_id
+        except (ValueError, TypeError) as e:
+            raise ValueError(f"Invalid page token: {page_token}") from e
+    
+    def get_email(self, email_id, include_raw=False):
+        """Get a specific email by ID; the raw message is only loaded when asked for"""
+        # The raw message is never cached, only the decoded view
+        email_data = self.message_cache.get(email_id) if not include_raw else None
+        if email_data is not None:
+            return email_data
+        
+        conn = self.pool.acquire()
+        cursor = conn.cursor()
+        
+        try:
+            cursor.execute('''
+            SELECT e.id, e.sender, e.recipient, e.subject, b.body, e.received_date,
+                   e.is_read, e.attachments, e.size, e.message_id, e.parent_message_id, e.thread_id,
+                   h.to_header, h.cc_header, h.header_date, h.content_type
+            FROM emails e
+            LEFT JOIN email_bodies b ON b.email_seq = e.seq
+            LEFT JOIN email_headers h ON h.email_seq = e.seq
+            WHERE e.id = ?
+            ''', (email_id,))
+            
+            email_data = cursor.fetchone()
+            if not email_data:
+                return None
+            
+            email_data = dict(email_data)
+            self.message_cache.put(email_id, email_data)
+            if include_raw:
+                email_data["raw_email"] = self._fetch_raw_email(cursor, email_id)
+            return email_data
+        
+        except Exception as e:
+            print(f"Error getting email: {e}")
+            return None
+        
+        finally:
+            self.pool.release(conn)
+    
+    def get_raw_email(self, email_id):
+        """Get the original message bytes of an email"""
+        conn = self.pool.acquire()
+        cursor = conn.cursor()
+        
+        try:
+            return self._fetch_raw_email(cursor, email_id)
+        
+        except Exception as e:
+            print(f"Error getting raw email: {e}")
+            return None
+        
+        finally:
+            self.pool.release(conn)
+    
+    def open_raw_email(self, email_id):
+        """Open the original message as a read-only file object (use it in a with block), or return None"""
+        conn = self.pool.acquire()
+        
+        try:
+            row = conn.execute('''
+            SELECT seq FROM emails WHERE id = ?
+            ''', (email_id,)).fetchone()
+            
+            if row:
+                # email_raw is keyed by the rowid, so the blob can be opened directly
+                blob = conn.blobopen("email_raw", "raw_email", row[0], readonly=True)
+                return RawEmailReader(self.pool, conn, blob)
+        
+        except Exception as e:
+            print(f"Error opening raw email: {e}")
+        
+        self.pool.release(conn)
+        return None
+    
+    def get_attachments(self, email_id):
+        """List an email's attachments from the catalog, in part order"""
+        conn = self.pool.acquire()
+        cursor = conn.cursor()
+        
+        try:
+            cursor.execute('''
+            SELECT a.part_index, a.filename, a.content_type, a.size, a.content_hash
+            FROM emails e
+            JOIN email_attachments a ON a.email_seq = e.seq
+            WHERE e.id = ?
+            ORDER BY a.part_index
+            ''', (email_id,))
+            
+            return [dict(row) for row in cursor.fetchall()]
+        
+        except Exception as e:
+            print(f"Error getting attachments: {e}")
+            return []
+        
+        finally:
+            self.pool.release(conn)
+    
+    def stream_attachment(self, email_id, part_index, chunk_size=RAW_CHUNK_SIZE):
+        """Get an iterator over one attachment's decoded bytes, or None if the email has no such part"""
+        conn = self.pool.acquire()
+        
+        try:
+            part = conn.execute('''
+            SELECT a.body_offset, a.body_length, a.transfer_encoding
+            FROM emails e
+            JOIN email_attachments a ON a.email_seq = e.seq
+            WHERE e.id = ? AND a.part_index = ?
+            ''', (email_id, part_index)).fetchone()
+        
+        except Exception as e:
+            print(f"Error finding attachment: {e}")
+            return None
+        
+        finally:
+            self.pool.release(conn)
+        
+        if part is None:
+            return None
+        reader = self.open_raw_email(email_id)
+        if reader is None:
+            return None
+        return self._iter_attachment(reader, part, chunk_size)
+    
+    def get_attachment(self, email_id, part_index):
+        """Get one attachment's decoded bytes, or None; stream_attachment avoids holding them all"""
+        chunks = self.stream_attachment(email_id, part_index)
+        return b"".join(chunks) if chunks is not None else None
+    
+    def _iter_attachment(self, reader, part, chunk_size):
+        """Decode an attachment's byte range of an open raw message, closing it when done"""
+        # Only the attachment's own bytes are read, through the blob handle
+        with reader:
+            chunks = read_range(reader, part["body_offset"], part["body_length"], chunk_size)
+            yield from decode_transfer_chunks(chunks, part["transfer_encoding"])
+    
+    def _fetch_raw_email(self, cursor, email_id):
+        """Read the raw message for an email id"""
+        cursor.execute('''
+        SELECT r.raw_email FROM emails e
+        JOIN email_raw r ON r.email_seq = e.seq
+        WHERE e.id = ?
+        ''', (email_id,))
+        
+        row = cursor.fetchone()
+        return row[0] if row else None
+    
+    def mark_as_read(self, email_id):
+        """Mark an email as read"""
+        conn = self.pool.acquire()
+        cursor = conn.cursor()
+        
+        try:
+            cursor.execute('''
+            UPDATE emails SET is_read = 1 WHERE id = ? AND is_read = 0
+            ''', (email_id,))
+            
+            conn.commit()
+            self.message_cache.update(email_id, is_read=1)
+            return True
+        
+        except Exception as e:
+            print(f"Error marking email as read: {e}")
+            conn.rollback()
+            return False
+        
+        finally:
+            self.pool.release(conn)
+    
+    def delete_email(self, email_id):
+        """Delete an email from the database"""
+        conn = self.pool.acquire()
+        cursor = conn.cursor()
+        
+        try:
+            cursor.execute('''
+            DELETE FROM emails WHERE id = ?
+            ''', (email_id,))
+            
+            conn.commit()
+            self.message_cache.invalidate(email_id)
+            return True
+        
+        except Exception as e:
+            print(f"Error deleting email: {e}")
+            conn.rollback()
+            return False
+        
+        finally:
+            self.pool.release(conn)
+    
+    def mark_read_many(self, email_ids):
+        """Mark several emails as read in one transaction and return True/False per id"""
+        email_ids = list(email_ids)
+        conn = self.pool.acquire()
+        cursor = conn.cursor()
+        
+        try:
+            cursor.execute("BEGIN IMMEDIATE")
+            rows = self._select_by_ids(cursor, "id, is_read", email_ids)
+            
+            # Only unread emails need updating
+            unread = [row for row in rows.values() if not row["is_read"]]
+            cursor.executemany('''
+            UPDATE emails SET is_read = 1 WHERE id = ?
+            ''', [(row["id"],) for row in unread])
+            
+            conn.commit()
+            for row in unread:
+                self.message_cache.update(row["id"], is_read=1)
+            return [email_id in rows for email_id in email_ids]
+        
+        except Exception as e:
+            print(f"Error marking emails as read: {e}")
+            conn.rollback()
+            return [False] * len(email_ids)
+        
+        finally:
+            self.pool.release(conn)
+    
+    def mark_all_read(self, recipient):
+        """Mark every email in a mailbox as read and return how many changed"""
+        conn = self.pool.acquire()
+        cursor = conn.cursor()
+        
+        try:
+            cursor.execute('''
+            UPDATE emails SET is_read = 1 WHERE recipient = ? AND is_read = 0
+            ''', (recipient,))
+            
+            conn.commit()
+            self.message_cache.invalidate_where(lambda view: view["recipient"] == recipient)
+            return cursor.rowcount
+        
+        except Exception as e:
+            print(f"Error marking mailbox as read: {e}")
+            conn.rollback()
+            return 0
+        
+        finally:
+            self.pool.release(conn)
+    
+    def delete_many(self, email_ids):
+        """Delete several emails in one transaction and return True/False per id"""
+        email_ids = list(email_ids)
+        conn = self.pool.acquire()
+        cursor = conn.cursor()
+        
+        try:
+            cursor.execute("BEGIN IMMEDIATE")
+            rows = self._select_by_ids(cursor, "id", email_ids)
+            
+            cursor.executemany('''
+            DELETE FROM emails WHERE id = ?
+            ''', [(email_id,) for email_id in rows])
+            
+            conn.commit()
+            for email_id in rows:
+                self.message_cache.invalidate(email_id)
+            return [email_id in rows for email_id in email_ids]
+        
+        except Exception as e:
+            print(f"Error deleting emails: {e}")
+            conn.rollback()
+            return [False] * len(email_ids)
+        
+        finally:
+            self.pool.release(conn)
+    
+    def _select_by_ids(self, cursor, columns, email_ids):
+        """Fetch the given columns for a list of ids, keyed by id"""
+        rows = {}
+        # Stay well below SQLite's bound parameter limit
+        for start in range(0, len(email_ids), 500):
+            chunk = email_ids[start:start + 500]
+            placeholders = ",".join("?" * len(chunk))
+            cursor.execute(f'''
+            SELECT {columns} FROM emails WHERE id IN ({placeholders})
+            ''', chunk)
+            for row in cursor.fetchall():
+                rows[row["id"]] = row
+        return rows
+    
+    def _find_existing_ids(self, cursor, email_ids):
+        """Return the subset of email_ids already stored"""
+        return set(self._select_by_ids(cursor, "id", list(email_ids)))
+    
+    def search_emails(self, recipient, query, limit=50, offset=0):
+        """Search emails in a mailbox by subject, sender or content, best matches first"""
+        # Field terms, AND, NOT and grouping go through the query compiler;
+        # plain words, optionally joined by OR, keep relevance ranking and snippets
+        if has_filters(tokenize(query)):
+            return self.query_emails(recipient, query, limit, offset)
+        
+        fts_query = self._to_fts_query(query)
+        if not fts_query:
+            return []
+        
+        conn = self.pool.acquire()
+        cursor = conn.cursor()
+        
+        try:
+            # bm25 weights rank subject hits above sender and body hits
+            cursor.execute('''
+            SELECT e.id, e.sender, e.recipient, e.subject, e.received_date, e.is_read,
+                   snippet(emails_fts, 2, '[', ']', '...', 12) AS snippet
+            FROM emails_fts
+            JOIN emails e ON e.seq = emails_fts.rowid
+            WHERE emails_fts MATCH ? AND e.recipient = ?
+            ORDER BY bm25(emails_fts, 10.0, 5.0, 1.0)
+            LIMIT ? OFFSET ?
+            ''', (fts_query, recipient, limit, offset))
+            
+            emails = [dict(row) for row in cursor.fetchall()]
+            return emails
+        
+        except Exception as e:
+            print(f"Error searching emails: {e}")
+            return []
+        
+        finally:
+            self.pool.release(conn)
+    
+    def query_emails(self, recipient, query, limit=50, offset=0):
+        """Get a mailbox's emails matching a search query (see mail_query), newest first"""
+        try:
+            compiled = compile_query(query)
+        except QuerySyntaxError as e:
+            print(f"Invalid search query: {e}")
+            return []
+        if compiled is None:
+            return []
+        condition, params = compiled
+        
+        conn = self.pool.acquire()
+        cursor = conn.cursor()
+        
+        try:
+            # The recipient bounds every query to one mailbox's range of idx_recipient_date
+            cursor.execute(f'''
+            SELECT e.id, e.sender, e.recipient, e.subject, e.received_date, e.is_read, e.size
+            FROM emails e
+            WHERE e.recipient = ? AND {condition}
+            ORDER BY e.received_date DESC, e.id DESC
+            LIMIT ? OFFSET ?
+            ''', [recipient] + params + [limit, offset])
+            
+            return [dict(row) for row in cursor.fetchall()]
+        
+        except Exception as e:
+            print(f"Error querying emails: {e}")
+            return []
+        
+        finally:
+            self.pool.release(conn)
+    
+    def _to_fts_query(self, query):
+        """Turn search box input into a safe FTS5 query"""
+        # Words must all match, "quoted text" is a phrase, a trailing * makes
+        # a prefix query and OR between two terms matches either of them.
+        # Every term is quoted so punctuation can never break the FTS syntax.
+        terms = []
+        for phrase, word in re.findall(r'"([^"]*)"|(\S+)', query):
+            if word == "OR":
+                if terms and terms[-1] != "OR":
+                    terms.append("OR")
+                continue
+            
+            prefix = word.endswith("*")
+            text = (phrase or word).rstrip("*").replace('"', "")
+            if not re.search(r"\w", text):
+                continue
+            terms.append(f'"{text}"' + ("*" if prefix else ""))
+        
+        # A dangling OR would be a syntax error
+        while terms and terms[-1] == "OR":
+            terms.pop()
+        return " ".join(terms)
+    
+    def rebuild_search_index(self):
+        """Rebuild the full-text index from the emails table"""
+        conn = self.pool.acquire()
+        
+        try:
+            conn.execute("INSERT INTO emails_fts (emails_fts) VALUES ('rebuild')")
+            conn.commit()
+            return True
+        
+        except Exception as e:
+            print(f"Error rebuilding search index: {e}")
+            conn.rollback()
+            return False
+        
+        finally:
+            self.pool.release(conn)
+    
+    def get_cache_stats(self):
+        """Hit, miss and eviction counters and current size of the message cache"""
+        return self.message_cache.stats()
+    
+    def get_recipients(self):
+        """Get every recipient that has at least one stored email"""
+        conn = self.pool.acquire()
+        cursor = conn.cursor()
+        
+        try:
+            cursor.execute('''
+            SELECT DISTINCT recipient FROM emails
+            ''')
+            
+            return [row[0] for row in cursor.fetchall()]
+        
+        except Exception as e:
+            print(f"Error listing recipients: {e}")
+            return []
+        
+        finally:
+            self.pool.release(conn)
+    
+    def delete_older_than(self, recipient, cutoff, batch_size=500):
+        """Delete up to batch_size emails received before cutoff and return how many were removed"""
+        conn = self.pool.acquire()
+        cursor = conn.cursor()
+        
+        try:
+            cursor.execute('''
+            DELETE FROM emails WHERE id IN (
+                SELECT id FROM emails
+                WHERE recipient = ? AND received_date < ?
+                LIMIT ?
+            )
+            ''', (recipient, to_epoch_us(cutoff), batch_size))
+            
+            conn.commit()
+            cutoff_us = to_epoch_us(cutoff)
+            self.message_cache.invalidate_where(
+                lambda view: view["recipient"] == recipient and view["received_date"] < cutoff_us
+            )
+            return cursor.rowcount
+        
+        except Exception as e:
+            print(f"Error applying retention: {e}")
+            conn.rollback()
+            return 0
+        
+        finally:
+            self.pool.release(conn)
+    
+    def existing_ids(self, email_ids):
+        """Return the subset of email_ids that still have a row in the database"""
+        conn = self.pool.acquire()
+        cursor = conn.cursor()
+        email_ids = list(email_ids)
+        
+        try:
+            return self._find_existing_ids(cursor, email_ids)
+        
+        except Exception as e:
+            print(f"Error checking email ids: {e}")
+            # Report every id as present so callers never remove live files
+            return set(email_ids)
+        
+        finally:
+            self.pool.release(conn)
+    
+    def deleted_ids(self, recipient, email_ids):
+        """Return the subset of email_ids that a mailbox's tombstones record as deleted and that are not stored"""
+        conn = self.pool.acquire()
+        cursor = conn.cursor()
+        email_ids = list(email_ids)
+        
+        try:
+            # Read inside the recipient's range of the tombstone primary key
+            deleted = set()
+            for start in range(0, len(email_ids), 500):
+                chunk = email_ids[start:start + 500]
+                placeholders = ",".join("?" * len(chunk))
+                cursor.execute(f'''
+                SELECT id FROM email_tombstones WHERE recipient = ? AND id IN ({placeholders})
+                ''', [recipient] + chunk)
+                deleted.update(row["id"] for row in cursor.fetchall())
+            return deleted - self._find_existing_ids(cursor, deleted)
+        
+        except Exception as e:
+            print(f"Error checking deleted email ids: {e}")
+            # Report nothing as deleted so callers never remove live files
+            return set()
+        
+        finally:
+            self.pool.release(conn)
+    
+    def export_mailbox(self, recipient, batch_size=500, include_content=True):
+        """Yield every stored row of a mailbox in batches, with body and raw message unless include_content is False"""
+        last_seq = 0
+        
+        # Callers that stream the raw message themselves only need the metadata table
+        if include_content:
+            content = "b.body, r.raw_email"
+            joins = "LEFT JOIN email_bodies b ON b.email_seq = e.seq LEFT JOIN email_raw r ON r.email_seq = e.seq"
+        else:
+            content = "NULL AS body, NULL AS raw_email"
+            joins = ""
+        
+        while True:
+            conn = self.pool.acquire()
+            cursor = conn.cursor()
+            
+            try:
+                # Seek past the previous batch so rows deleted meanwhile are harmless
+                cursor.execute(f'''
+                SELECT e.seq, e.id, e.sender, e.recipient, e.subject, {content}, e.received_date,
+                       e.is_read, e.attachments, e.size, e.content_hash
+                FROM emails e
+                {joins}
+                WHERE e.recipient = ? AND e.seq > ?
+                ORDER BY e.seq
+                LIMIT ?
+                ''', (recipient, last_seq, batch_size))
+                
+                rows = [dict(row) for row in cursor.fetchall()]
+            
+            finally:
+                self.pool.release(conn)
+            
+            if not rows:
+                return
+            last_seq = rows[-1]["seq"]
+            yield rows
+    
+    def import_rows(self, rows):
+        """Insert rows from export_mailbox as they are and return how many were new"""
+        conn = self.pool.acquire()
+        cursor = conn.cursor()
+        
+        try:
+            cursor.execute("BEGIN IMMEDIATE")
+            
+            # Ids that are already here were copied by an earlier, interrupted run
+            taken = self._find_existing_ids(cursor, [row["id"] for row in rows])
+            new_rows = [dict(row) for row in rows if row["id"] not in taken]
+            
+            # Thread ids belong to the source database, so thread again here
+            for row in new_rows:
+                headers = self._parse_headers((row["raw_email"] or b"")[:RAW_CHUNK_SIZE])
+                row.update(self._thread_fields(headers))
+                row.update(self._header_fields(headers))
+                if not row.get("content_hash"):
+                    row["content_hash"] = _sha256_hex(row["raw_email"])
+            inserted = self._insert_email_rows(cursor, new_rows)
+            
+            conn.commit()
+            return len(inserted)
+        
+        except Exception as e:
+            print(f"Error importing emails: {e}")
+            conn.rollback()
+            return None
+        
+        finally:
+            self.pool.release(conn)
+    
+    def get_modseq(self, recipient):
+        """Highest modseq of a mailbox; 0 if nothing was ever stored in it"""
+        conn = self.pool.acquire()
+        cursor = conn.cursor()
+        
+        try:
+            row = cursor.execute('''
+            SELECT modseq FROM mailbox_modseq WHERE recipient = ?
+            ''', (recipient,)).fetchone()
+            return row[0] if row else 0
+        
+        except Exception as e:
+            print(f"Error getting modseq: {e}")
+            return 0
+        
+        finally:
+            self.pool.release(conn)
+    
+    def changes_since(self, recipient, modseq):
+        """Get the mailbox's current modseq, the rows added or changed after modseq and the ids deleted since"""
+        conn = self.pool.acquire()
+        cursor = conn.cursor()
+        
+        try:
+            # One snapshot, so the rows and tombstones agree with the returned modseq
+            cursor.execute("BEGIN")
+            state = cursor.execute('''
+            SELECT modseq, floor FROM mailbox_modseq WHERE recipient = ?
+            ''', (recipient,)).fetchone()
+            highest, floor = (state["modseq"], state["floor"]) if state else (0, 0)
+            
+            # full_resync means tombstones the caller needs were pruned, so it must list the mailbox again
+            changes = {"modseq": highest, "changed": [], "deleted": [], "full_resync": modseq < floor}
+            if modseq >= highest or changes["full_resync"]:
+                return changes
+            
+            # Both reads are range scans over (recipient, modseq)
+            cursor.execute('''
+            SELECT id, sender, recipient, subject, received_date, is_read, modseq
+            FROM emails
+            WHERE recipient = ? AND modseq > ?
+            ORDER BY modseq
+            ''', (recipient, modseq))
+            changes["changed"] = [dict(row) for row in cursor.fetchall()]
+            
+            cursor.execute('''
+            SELECT id FROM email_tombstones
+            WHERE recipient = ? AND modseq > ?
+            ORDER BY modseq
+            ''', (recipient, modseq))
+            changes["deleted"] = [row[0] for row in cursor.fetchall()]
+            return changes
+        
+        except Exception as e:
+            print(f"Error getting changes: {e}")
+            return None
+        
+        finally:
+            conn.rollback()
+            self.pool.release(conn)
+    
+    def raise_modseq(self, recipient, modseq):
+        """Continue a mailbox's modseq above one reached elsewhere, making older clients relist it"""
+        conn = self.pool.acquire()
+        cursor = conn.cursor()
+        
+        try:
+            cursor.execute('''
+            INSERT INTO mailbox_modseq (recipient, modseq, floor) VALUES (?, ?, ?)
+            ON CONFLICT (recipient) DO UPDATE SET modseq = MAX(modseq, excluded.modseq), floor = MAX(floor, excluded.floor)
+            ''', (recipient, modseq, modseq))
+            
+            conn.commit()
+            return True
+        
+        except Exception as e:
+            print(f"Error raising modseq: {e}")
+            conn.rollback()
+            return False
         
-        # Connect to database and create tables if they don't exist
-        self._init_db()
+        finally:
+            self.pool.release(conn)
     
-    def _init_db(self):
-        """Initialize the database and create tables if they don't exist"""
-        conn = sqlite3.connect(self.db_path)
+    def prune_tombstones(self, cutoff, batch_size=500):
+        """Delete up to batch_size tombstones older than cutoff and return how many were removed"""
+        conn = self.pool.acquire()
         cursor = conn.cursor()
         
-        # Create emails table
-        cursor.execute('''
-        CREATE TABLE IF NOT EXISTS emails (
-            id TEXT PRIMARY KEY,
-            sender TEXT NOT NULL,
-            recipient TEXT NOT NULL,
-            subject TEXT,
-            body TEXT,
-            received_date TIMESTAMP NOT NULL,
-            is_read BOOLEAN DEFAULT 0,
-            raw_email BLOB,
-            attachments TEXT
-        )
-        ''')
+        try:
+            cursor.execute("BEGIN IMMEDIATE")
+            rows = cursor.execute('''
+            SELECT recipient, modseq FROM email_tombstones WHERE deleted_date < ? LIMIT ?
+            ''', (to_epoch_us(cutoff), batch_size)).fetchall()
+            
+            # Clients older than a pruned tombstone can no longer sync incrementally
+            cursor.executemany('''
+            UPDATE mailbox_modseq SET floor = MAX(floor, ?) WHERE recipient = ?
+            ''', [(row["modseq"], row["recipient"]) for row in rows])
+            cursor.executemany('''
+            DELETE FROM email_tombstones WHERE recipient = ? AND modseq = ?
+            ''', [(row["recipient"], row["modseq"]) for row in rows])
+            
+            conn.commit()
+            return len(rows)
         
-        # Create index on recipient for faster mailbox access
-        cursor.execute('''
-        CREATE INDEX IF NOT EXISTS idx_recipient ON emails (recipient)
-        ''')
+        except Exception as e:
+            print(f"Error pruning tombstones: {e}")
+            conn.rollback()
+            return 0
         
-        conn.commit()
-        conn.close()
+        finally:
+            self.pool.release(conn)
     
-    def store_email(self, recipient, message_data):
-        """Store an email in the database"""
-        conn = sqlite3.connect(self.db_path)
-        cursor = conn.cursor()
-        
-        try:
-            # Parse the email message
-            message = email.message_from_bytes(message_data, policy=default)
-            
-            # Extract email parts
-            email_id = f"{datetime.datetime.now().strftime('%Y%m%d%H%M%S')}_{message.get('Message-ID', '')}"
-            sender = message.get('From', 'Unknown')
-            subject = message.get('Subject', 'No Subject')
-            
-            # Get the body of the email
-            body = ""
-            attachments = []
-            
-            if message.is_multipart():
-                for part in message.walk():
-                    content_type = part.get_content_type()
-                    content_disposition = str(part.get("Content-Disposition", ""))
-                    
-                    # Handle text parts as body
-                    if content_type == "text/plain" and "attachment" not in content_disposition:
-                        body = part.get_content()
-                    
-                    # Handle attachments (simplified)
-                    elif "attachment" in content_disposition:
-                        filename = part.get_filename()
-                        if filename:
-                            attachments.append(filename)
-            else:
-                body = message.get_content()
-            
-            # Insert the email into the database
-            cursor.execute('''
-            INSERT INTO emails (id, sender, recipient, subject, body, received_date, is_read, raw_email, attachments)
-            VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
-            ''', (
-                email_id,
-                sender,
-                recipient,
-                subject,
-                body,
-                datetime.datetime.now().isoformat(),
-                False,
-                message_data,
-                json.dumps(attachments)
-            ))
+    def get_sync_state(self, recipient):
+        """Directory mtime and modseq recorded by the last sync of a mailbox, or None"""
+        conn = self.pool.acquire()
+        
+        try:
+            row = conn.execute('''
+            SELECT dir_mtime_ns, modseq FROM sync_state WHERE recipient = ?
+            ''', (recipient,)).fetchone()
+            return dict(row) if row else None
+        
+        except Exception as e:
+            print(f"Error getting sync state: {e}")
+            return None
+        
+        finally:
+            self.pool.release(conn)
+    
+    def set_sync_state(self, recipient, dir_mtime_ns, modseq):
+        """Record how far a mailbox has been synced"""
+        conn = self.pool.acquire()
+        
+        try:
+            conn.execute('''
+            INSERT OR REPLACE INTO sync_state (recipient, dir_mtime_ns, modseq) VALUES (?, ?, ?)
+            ''', (recipient, dir_mtime_ns, modseq))
             
             conn.commit()
-            return email_id
-            
+            return True
+        
         except Exception as e:
-            # Log the error and rollback
-            print(f"Error storing email: {e}")
+            print(f"Error setting sync state: {e}")
             conn.rollback()
+            return False
+        
+        finally:
+            self.pool.release(conn)
+    
+    def get_file_manifest(self, recipient):
+        """Manifest rows of a mailbox keyed by filename"""
+        conn = self.pool.acquire()
+        
+        try:
+            rows = conn.execute('''
+            SELECT filename, size, mtime_ns, content_hash, email_id, status
+            FROM file_manifest WHERE recipient = ?
+            ''', (recipient,)).fetchall()
+            return {row["filename"]: dict(row) for row in rows}
+        
+        except Exception as e:
+            print(f"Error getting file manifest: {e}")
             return None
-            
+        
         finally:
-            conn.close()
+            self.pool.release(conn)
     
-    def get_mailbox(self, email_address, limit=50, offset=0):
-        """Get emails for a specific mailbox (recipient)"""
-        conn = sqlite3.connect(self.db_path)
-        conn.row_factory = sqlite3.Row  # Return rows as dictionaries
-        cursor = conn.cursor()
+    def update_file_manifest(self, recipient, entries):
+        """Insert or replace manifest rows (filename, size, mtime_ns, content_hash, email_id, status) of a mailbox"""
+        conn = self.pool.acquire()
         
         try:
-            cursor.execute('''
-            SELECT id, sender, recipient, subject, received_date, is_read 
-            FROM emails 
-            WHERE recipient = ? 
-            ORDER BY received_date DESC
-            LIMIT ? OFFSET ?
-            ''', (email_address, limit, offset))
-            
-            emails = [dict(row) for row in cursor.fetchall()]
-            return emails
+            conn.executemany('''
+            INSERT OR REPLACE INTO file_manifest (recipient, filename, size, mtime_ns, content_hash, email_id, status)
+            VALUES (:recipient, :filename, :size, :mtime_ns, :content_hash, :email_id, :status)
+            ''', [dict(entry, recipient=recipient, status=entry.get("status", "ok")) for entry in entries])
             
+            conn.commit()
+            return True
+        
         except Exception as e:
-            print(f"Error getting mailbox: {e}")
-            return []
+            print(f"Error updating file manifest: {e}")
+            conn.rollback()
+            return False
+        
+        finally:
+            self.pool.release(conn)
+    
+    def set_manifest_status(self, recipient, filenames, status):
+        """Flag manifest rows of a mailbox, or clear the flag with status 'ok'"""
+        conn = self.pool.acquire()
+        
+        try:
+            conn.executemany('''
+            UPDATE file_manifest SET status = ? WHERE recipient = ? AND filename = ?
+            ''', [(status, recipient, filename) for filename in filenames])
             
+            conn.commit()
+            return True
+        
+        except Exception as e:
+            print(f"Error flagging manifest rows: {e}")
+            conn.rollback()
+            return False
+        
         finally:
-            conn.close()
+            self.pool.release(conn)
     
-    def get_email(self, email_id):
-        """Get a specific email by ID"""
-        conn = sqlite3.connect(self.db_path)
-        conn.row_factory = sqlite3.Row
+    def flag_deleted_emails(self, recipient, email_ids=None):
+        """Flag the manifest rows of deleted emails, checking every row when email_ids is None; returns how many"""
+        conn = self.pool.acquire()
         cursor = conn.cursor()
         
         try:
-            cursor.execute('''
-            SELECT * FROM emails WHERE id = ?
-            ''', (email_id,))
+            if email_ids is None:
+                # Tombstones were pruned, so look every mapped email up
+                cursor.execute('''
+                UPDATE file_manifest SET status = 'email_deleted'
+                WHERE recipient = ? AND status = 'ok' AND email_id IS NOT NULL
+                  AND NOT EXISTS (SELECT 1 FROM emails WHERE id = file_manifest.email_id)
+                ''', (recipient,))
+                flagged = cursor.rowcount
+            else:
+                flagged = 0
+                for email_id in email_ids:
+                    cursor.execute('''
+                    UPDATE file_manifest SET status = 'email_deleted'
+                    WHERE recipient = ? AND email_id = ? AND status = 'ok'
+                    ''', (recipient, email_id))
+                    flagged += cursor.rowcount
             
-            email_data = cursor.fetchone()
-            if email_data:
-                return dict(email_data)
-            return None
+            conn.commit()
+            return flagged
+        
+        except Exception as e:
+            print(f"Error flagging deleted emails: {e}")
+            conn.rollback()
+            return 0
+        
+        finally:
+            self.pool.release(conn)
+    
+    def get_flagged_files(self, recipient):
+        """Manifest rows of a mailbox whose file or email has gone"""
+        conn = self.pool.acquire()
+        
+        try:
+            rows = conn.execute('''
+            SELECT filename, size, mtime_ns, content_hash, email_id, status
+            FROM file_manifest WHERE recipient = ? AND status != 'ok'
+            ''', (recipient,)).fetchall()
+            return [dict(row) for row in rows]
+        
+        except Exception as e:
+            print(f"Error getting flagged files: {e}")
+            return []
+        
+        finally:
+            self.pool.release(conn)
+    
+    def remove_file_manifest(self, recipient, filenames):
+        """Forget manifest rows of a mailbox"""
+        conn = self.pool.acquire()
+        
+        try:
+            conn.executemany('''
+            DELETE FROM file_manifest WHERE recipient = ? AND filename = ?
+            ''', [(recipient, filename) for filename in filenames])
             
+            conn.commit()
+            return True
+        
         except Exception as e:
-            print(f"Error getting email: {e}")
+            print(f"Error removing manifest rows: {e}")
+            conn.rollback()
+            return False
+        
+        finally:
+            self.pool.release(conn)
+    
+    def export_mailbox_state(self, recipient):
+        """Tombstones, file manifest and sync state of a mailbox, for moving it to another database"""
+        conn = self.pool.acquire()
+        
+        try:
+            tombstones = conn.execute('''
+            SELECT modseq, id, deleted_date FROM email_tombstones WHERE recipient = ?
+            ''', (recipient,)).fetchall()
+            manifest = conn.execute('''
+            SELECT filename, size, mtime_ns, content_hash, email_id, status
+            FROM file_manifest WHERE recipient = ?
+            ''', (recipient,)).fetchall()
+            sync_state = conn.execute('''
+            SELECT dir_mtime_ns, modseq FROM sync_state WHERE recipient = ?
+            ''', (recipient,)).fetchone()
+        
+            return {
+                "tombstones": [dict(row) for row in tombstones],
+                "manifest": [dict(row) for row in manifest],
+                "sync_state": dict(sync_state) if sync_state else None
+            }
+        
+        except Exception as e:
+            print(f"Error exporting mailbox state: {e}")
             return None
-            
+        
         finally:
-            conn.close()
+            conn.rollback()
+            self.pool.release(conn)
     
-    def mark_as_read(self, email_id):
-        """Mark an email as read"""
-        conn = sqlite3.connect(self.db_path)
+    def import_mailbox_state(self, recipient, state):
+        """Add state from export_mailbox_state, skipping tombstones of emails stored here"""
+        conn = self.pool.acquire()
         cursor = conn.cursor()
         
         try:
-            cursor.execute('''
-            UPDATE emails SET is_read = 1 WHERE id = ?
-            ''', (email_id,))
-            
+            cursor.execute("BEGIN IMMEDIATE")
+        
+            # Copying a mailbox deletes every moved email from the source, which
+            # leaves tombstones for ids that are alive here
+            stored = self._find_existing_ids(cursor, [row["id"] for row in state["tombstones"]])
+            cursor.executemany('''
+            INSERT OR IGNORE INTO email_tombstones (recipient, modseq, id, deleted_date)
+            VALUES (?, ?, ?, ?)
+            ''', [(recipient, row["modseq"], row["id"], row["deleted_date"])
+                  for row in state["tombstones"] if row["id"] not in stored])
+        
+            cursor.executemany('''
+            INSERT OR REPLACE INTO file_manifest (recipient, filename, size, mtime_ns, content_hash, email_id, status)
+            VALUES (:recipient, :filename, :size, :mtime_ns, :content_hash, :email_id, :status)
+            ''', [dict(row, recipient=recipient) for row in state["manifest"]])
+        
+            if state["sync_state"]:
+                cursor.execute('''
+                INSERT OR REPLACE INTO sync_state (recipient, dir_mtime_ns, modseq) VALUES (?, ?, ?)
+                ''', (recipient, state["sync_state"]["dir_mtime_ns"], state["sync_state"]["modseq"]))
+        
             conn.commit()
             return True
-            
+        
         except Exception as e:
-            print(f"Error marking email as read: {e}")
+            print(f"Error importing mailbox state: {e}")
             conn.rollback()
             return False
-            
+        
         finally:
-            conn.close()
+            self.pool.release(conn)
     
-    def delete_email(self, email_id):
-        """Delete an email from the database"""
-        conn = sqlite3.connect(self.db_path)
+    def remove_mailbox_state(self, recipient):
+        """Delete the tombstones, file manifest and sync state of a mailbox that moved away"""
+        conn = self.pool.acquire()
         cursor = conn.cursor()
         
         try:
-            cursor.execute('''
-            DELETE FROM emails WHERE id = ?
-            ''', (email_id,))
-            
+            cursor.execute("BEGIN IMMEDIATE")
+            for table in ("email_tombstones", "file_manifest", "sync_state"):
+                cursor.execute(f"DELETE FROM {table} WHERE recipient = ?", (recipient,))
+        
             conn.commit()
             return True
-            
+        
         except Exception as e:
-            print(f"Error deleting email: {e}")
+            print(f"Error removing mailbox state: {e}")
             conn.rollback()
             return False
+        
+        finally:
+            self.pool.release(conn)
+    
+    def get_mailbox_summary(self, recipient=None):
+        """Get total, unread, bytes and newest date for one mailbox, or a list for all mailboxes"""
+        conn = self.pool.acquire()
+        cursor = conn.cursor()
+        
+        try:
+            if recipient is None:
+                cursor.execute('''
+                SELECT recipient, total, unread, bytes, newest
+                FROM mailbox_summary
+                ORDER BY recipient
+                ''')
+                return [dict(row) for row in cursor.fetchall()]
             
+            cursor.execute('''
+            SELECT recipient, total, unread, bytes, newest
+            FROM mailbox_summary WHERE recipient = ?
+            ''', (recipient,))
+            
+            row = cursor.fetchone()
+            if row:
+                return dict(row)
+            return {"recipient": recipient, "total": 0, "unread": 0, "bytes": 0, "newest": None}
+        
+        except Exception as e:
+            print(f"Error getting mailbox summary: {e}")
+            return None if recipient is not None else []
+        
         finally:
-            conn.close()
+            self.pool.release(conn)
     
-    def search_emails(self, recipient, query, limit=50, offset=0):
-        """Search emails in a mailbox by subject or content"""
-        conn = sqlite3.connect(self.db_path)
-        conn.row_factory = sqlite3.Row
+    def get_usage(self, recipient):
+        """Get message count, bytes and unread count for a mailbox from its summary row"""
+        conn = self.pool.acquire()
         cursor = conn.cursor()
         
         try:
             cursor.execute('''
-            SELECT id, sender, recipient, subject, received_date, is_read 
-            FROM emails 
-            WHERE recipient = ? AND (subject LIKE ? OR body LIKE ?) 
-            ORDER BY received_date DESC
-            LIMIT ? OFFSET ?
-            ''', (recipient, f"%{query}%", f"%{query}%", limit, offset))
+            SELECT recipient, total AS message_count, bytes AS total_bytes, unread AS unread_count
+            FROM mailbox_summary WHERE recipient = ?
+            ''', (recipient,))
             
-            emails = [dict(row) for row in cursor.fetchall()]
-            return emails
+            row = cursor.fetchone()
+            if row:
+                return dict(row)
+            return {"recipient": recipient, "message_count": 0, "total_bytes": 0, "unread_count": 0}
+        
+        except Exception as e:
+            print(f"Error getting mailbox usage: {e}")
+            return None
+        
+        finally:
+            self.pool.release(conn)
+    
+    def get_all_usage(self, limit=50):
+        """Get usage for the largest mailboxes, biggest first"""
+        conn = self.pool.acquire()
+        cursor = conn.cursor()
+        
+        try:
+            cursor.execute('''
+            SELECT recipient, total AS message_count, bytes AS total_bytes, unread AS unread_count
+            FROM mailbox_summary
+            ORDER BY bytes DESC
+            LIMIT ?
+            ''', (limit,))
             
+            return [dict(row) for row in cursor.fetchall()]
+        
         except Exception as e:
-            print(f"Error searching emails: {e}")
+            print(f"Error getting mailbox usage: {e}")
             return []
+        
+        finally:
+            self.pool.release(conn)
+    
+    def set_quota(self, recipient, max_messages=None, max_bytes=None):
+        """Set a mailbox's quota; None for a limit means use the default"""
+        conn = self.pool.acquire()
+        cursor = conn.cursor()
+        
+        try:
+            cursor.execute('''
+            INSERT OR REPLACE INTO mailbox_quotas (recipient, max_messages, max_bytes)
+            VALUES (?, ?, ?)
+            ''', (recipient, max_messages, max_bytes))
             
+            conn.commit()
+            return True
+        
+        except Exception as e:
+            print(f"Error setting quota: {e}")
+            conn.rollback()
+            return False
+        
         finally:
-            conn.close()
+            self.pool.release(conn)
+    
+    def get_quota(self, recipient):
+        """Get the effective quota for a mailbox as (max_messages, max_bytes)"""
+        conn = self.pool.acquire()
+        cursor = conn.cursor()
+        
+        try:
+            cursor.execute('''
+            SELECT max_messages, max_bytes FROM mailbox_quotas WHERE recipient = ?
+            ''', (recipient,))
+            
+            row = cursor.fetchone() or (None, None)
+            max_messages = row[0] if row[0] is not None else self.default_quota_messages
+            max_bytes = row[1] if row[1] is not None else self.default_quota_bytes
+            return max_messages, max_bytes
+        
+        except Exception as e:
+            print(f"Error getting quota: {e}")
+            return self.default_quota_messages, self.default_quota_bytes
+        
+        finally:
+            self.pool.release(conn)
+    
+    def is_over_quota(self, recipient, incoming_bytes=0):
+        """Check whether accepting another message would exceed the mailbox quota"""
+        max_messages, max_bytes = self.get_quota(recipient)
+        if max_messages is None and max_bytes is None:
+            return False
+        
+        usage = self.get_usage(recipient)
+        if usage is None:
+            # Never refuse mail because the counters could not be read
+            return False
+        
+        if max_messages is not None and usage["message_count"] >= max_messages:
+            return True
+        # With no size known yet (RCPT time) a completely full mailbox is over quota
+        if max_bytes is not None and usage["total_bytes"] + max(incoming_bytes, 1) > max_bytes:
+            return True
+        return False
+    
+    def checkpoint(self, mode="PASSIVE"):
+        """Checkpoint the WAL into the database and return (busy, wal_pages, checkpointed_pages)"""
+        if mode not in ("PASSIVE", "FULL", "RESTART", "TRUNCATE"):
+            raise ValueError(f"Unknown checkpoint mode: {mode}")
+        
+        conn = self.pool.acquire()
+        
+        try:
+            return tuple(conn.execute(f"PRAGMA wal_checkpoint({mode})").fetchone())
+        
+        except Exception as e:
+            print(f"Error checkpointing database: {e}")
+            return None
+        
+        finally:
+            self.pool.release(conn)
+    
+    def get_wal_size(self):
+        """Size of the write-ahead log file in bytes (0 when there is none)"""
+        try:
+            return os.path.getsize(self.db_path + "-wal")
+        except OSError:
+            return 0
+    
+    def get_auto_vacuum_mode(self):
+        """Return the auto_vacuum mode of the database (0 none, 1 full, 2 incremental)"""
+        conn = self.pool.acquire()
+        
+        try:
+            return conn.execute("PRAGMA auto_vacuum").fetchone()[0]
+        finally:
+            self.pool.release(conn)
+    
+    def enable_incremental_vacuum(self):
+        """Switch an existing database to incremental auto_vacuum (rewrites the whole file once)"""
+        conn = self.pool.acquire()
+        
+        try:
+            conn.execute("PRAGMA auto_vacuum = INCREMENTAL")
+            conn.execute("VACUUM")
+            return True
+        
+        except Exception as e:
+            print(f"Error converting database to incremental vacuum: {e}")
+            return False
+        
+        finally:
+            self.pool.release(conn)
+    
+    def incremental_vacuum(self, pages=256):
+        """Release up to `pages` free pages to the filesystem and return how many remain free"""
+        conn = self.pool.acquire()
+        
+        try:
+            # The pragma frees one page per result row, so drain it fully
+            conn.execute(f"PRAGMA incremental_vacuum({int(pages)})").fetchall()
+            return conn.execute("PRAGMA freelist_count").fetchone()[0]
+        
+        except Exception as e:
+            print(f"Error running incremental vacuum: {e}")
+            return 0
+        
+        finally:
+            self.pool.release(conn)
+    
+    def close(self):
+        """Close all pooled connections"""
+        self.pool.close_all()
 
 # Example usage
 if __name__ == "__main__":
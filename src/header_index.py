@@ -0,0 +1,109 @@
+#!/usr/bin/env python3
+import os
+import json
+from email.parser import BytesHeaderParser
+from email.policy import default
+
+# Index file kept in each mailbox directory; it does not end in .eml, so
+# the readers, the migration and the sync never take it for an email
+INDEX_FILE = ".header_index.json"
+
+# Bumped when the entry layout changes, so older indexes are rebuilt
+INDEX_VERSION = 1
+
+# Header blocks are cut off here, in case a file has no blank line at all
+HEADER_LIMIT = 256 * 1024
+
+def read_header_block(stream, limit=HEADER_LIMIT):
+    """Read a message's header lines up to the first blank line, leaving the body unread"""
+    lines = []
+    size = 0
+    for line in iter(stream.readline, b""):
+        if line in (b"\r\n", b"\n"):
+            break
+        lines.append(line)
+        size += len(line)
+        if size >= limit:
+            break
+    return b"".join(lines)
+
+def parse_listing_headers(header_block):
+    """From, Subject and Date of a header block as display strings"""
+    headers = BytesHeaderParser(policy=default).parsebytes(header_block)
+    return {
+        "from": str(headers.get("From", "Unknown")),
+        "subject": str(headers.get("Subject", "No Subject")),
+        "date": str(headers.get("Date", "Unknown")),
+    }
+
+class HeaderIndex:
+    """Listing headers of a mailbox directory's .eml files, cached by file name, mtime and size"""
+
+    def __init__(self, mailbox_path):
+        """Prepare the index of one mailbox directory; nothing is read until list_emails()"""
+        self.mailbox_path = mailbox_path
+        self.index_path = os.path.join(mailbox_path, INDEX_FILE)
+        self.parsed = 0
+        self.reused = 0
+
+    def load(self):
+        """Read {file name: entry} from the index file, or an empty dict"""
+        try:
+            with open(self.index_path) as f:
+                index = json.load(f)
+        except FileNotFoundError:
+            return {}
+        except (ValueError, OSError) as e:
+            print(f"Ignoring unreadable header index {self.index_path}: {e}")
+            return {}
+
+        if not isinstance(index, dict) or index.get("version") != INDEX_VERSION:
+            return {}
+        return index.get("entries", {})
+
+    def save(self, entries):
+        """Replace the index file atomically; a mailbox that cannot be written to just goes unindexed"""
+        # A per-process temporary name keeps concurrent listings from mixing their writes
+        temp_path = f"{self.index_path}.{os.getpid()}.tmp"
+        try:
+            with open(temp_path, 'w') as f:
+                json.dump({"version": INDEX_VERSION, "entries": entries}, f)
+            os.replace(temp_path, self.index_path)
+        except OSError as e:
+            print(f"Could not write header index {self.index_path}: {e}")
+
+    def list_emails(self):
+        """Return listing entries (name, path, from, subject, date) for every .eml file in name order"""
+        cached = self.load()
+        entries = {}
+        self.parsed = 0
+        self.reused = 0
+
+        # Only stat() calls for files whose mtime and size match the index
+        with os.scandir(self.mailbox_path) as files:
+            for entry in files:
+                if not entry.name.endswith(".eml") or not entry.is_file():
+                    continue
+                stat = entry.stat()
+                known = cached.get(entry.name)
+                if known and known["mtime_ns"] == stat.st_mtime_ns and known["size"] == stat.st_size:
+                    entries[entry.name] = known
+                    self.reused += 1
+                    continue
+
+                try:
+                    with open(entry.path, 'rb') as f:
+                        headers = parse_listing_headers(read_header_block(f))
+                except OSError as e:
+                    print(f"Error reading {entry.path}: {e}")
+                    continue
+                headers.update(mtime_ns=stat.st_mtime_ns, size=stat.st_size)
+                entries[entry.name] = headers
+                self.parsed += 1
+
+        # Rewritten only when a file was added, changed or removed
+        if self.parsed or len(entries) != len(cached):
+            self.save(entries)
+
+        return [dict(entries[name], name=name, path=os.path.join(self.mailbox_path, name))
+                for name in sorted(entries)]
@@ -0,0 +1,317 @@
+#!/usr/bin/env python3
+import os
+import re
+import time
+import socket
+import calendar
+import shutil
+import tempfile
+import argparse
+from email.utils import parseaddr
+from email_db import PARSE_LIMIT, EmailDatabase
+from sharded_db import open_email_database
+from migrate_to_db import BATCH_BYTES, BATCH_SIZE, format_duration
+
+# Bytes read from or written to an mbox file at a time
+MBOX_CHUNK_SIZE = 1024 * 1024
+
+# A line starting with "From " opens the next message of an mbox file
+FROM_LINE = re.compile(rb'^From ', re.MULTILINE)
+
+# mboxrd quoting: writers add one ">" to every ">*From " line and readers take it off again
+QUOTED_FROM = re.compile(rb'^>(>*From )', re.MULTILINE)
+UNQUOTED_FROM = re.compile(rb'^(>*From )', re.MULTILINE)
+
+# The Status header mbox readers use to remember read messages
+STATUS_HEADER = re.compile(rb'^Status:[ \t]*([A-Za-z]*)[ \t]*\r?\n$', re.IGNORECASE)
+
+def from_line_date(from_line):
+    """Epoch microseconds of the asctime date ending an mbox From_ line, or None"""
+    try:
+        fields = from_line.decode("ascii", "replace").split()[-5:]
+        return calendar.timegm(time.strptime(" ".join(fields), "%a %b %d %H:%M:%S %Y")) * 1000000
+    except ValueError:
+        return None
+
+def split_status(spool):
+    """Take the Status header out of a spooled mbox message; returns the message without it and whether it was read"""
+    # Status is mailbox state, not part of the message: read state is kept in
+    # is_read instead, so an exported and re-imported message is byte for byte
+    # the one that was exported and still deduplicates against it
+    lines = []
+    status = None
+    for line in iter(spool.readline, b""):
+        match = STATUS_HEADER.match(line)
+        if match and status is None:
+            status = match.group(1)
+            continue
+        lines.append(line)
+        if line in (b"\r\n", b"\n"):
+            break
+
+    if status is None:
+        spool.seek(0)
+        return spool, False
+
+    message = tempfile.SpooledTemporaryFile(max_size=PARSE_LIMIT)
+    message.writelines(lines)
+    shutil.copyfileobj(spool, message, MBOX_CHUNK_SIZE)
+    message.seek(0)
+    return message, b"R" in status.upper()
+
+def _write_unquoted(spool, held, piece):
+    """Append whole lines of a message to its spool, holding back the final line break; returns the new held bytes"""
+    # The line break before the next From_ line belongs to the separator, so it
+    # is only written once more of the message follows
+    if not piece:
+        return held
+    spool.write(held)
+    piece = QUOTED_FROM.sub(rb'\1', piece)
+    keep = 2 if piece.endswith(b"\r\n") else 1 if piece.endswith(b"\n") else 0
+    spool.write(piece[:len(piece) - keep])
+    return piece[len(piece) - keep:]
+
+def iter_mbox(stream, chunk_size=MBOX_CHUNK_SIZE):
+    """Yield (From_ line, spool) per message of an mbox file; each spool is closed when the next message is read"""
+    # Chunks are cut at the last line break so every match starts a line;
+    # messages go through a spool that moves to disk once it passes PARSE_LIMIT
+    spool = None
+    from_line = None
+    held = b""
+    pending = b""
+
+    for chunk in iter(lambda: stream.read(chunk_size), b""):
+        data = pending + chunk
+        cut = data.rfind(b"\n") + 1
+        data, pending = data[:cut], data[cut:]
+
+        start = 0
+        for match in FROM_LINE.finditer(data):
+            if spool is not None:
+                _write_unquoted(spool, held, data[start:match.start()])
+                spool.seek(0)
+                yield from_line, spool
+                spool.close()
+            start = data.index(b"\n", match.start()) + 1
+            from_line = data[match.start():start].rstrip()
+            spool = tempfile.SpooledTemporaryFile(max_size=PARSE_LIMIT)
+            held = b""
+
+        # Text before the first From_ line is not part of any message
+        if spool is not None:
+            held = _write_unquoted(spool, held, data[start:])
+
+    if spool is not None:
+        _write_unquoted(spool, held, pending)
+        spool.seek(0)
+        yield from_line, spool
+        spool.close()
+
+def iter_maildir(maildir):
+    """Yield (path, stat, seen) for every message in a Maildir's new and cur directories"""
+    for folder in ("new", "cur"):
+        folder_path = os.path.join(maildir, folder)
+        if not os.path.isdir(folder_path):
+            continue
+        with os.scandir(folder_path) as entries:
+            for entry in entries:
+                if entry.name.startswith(".") or not entry.is_file():
+                    continue
+                # Flags follow ":2," at the end of the name; S means seen
+                _, _, flags = entry.name.rpartition(":2,")
+                yield entry.path, entry.stat(), ":2," in entry.name and "S" in flags
+
+class ArchiveImport:
+    """Feed messages one at a time into the database through the bulk insert path"""
+
+    def __init__(self, db, recipient, batch_size=BATCH_SIZE):
+        """Prepare an import into recipient's mailbox"""
+        self.db = db
+        self.recipient = recipient
+        self.batch_size = batch_size
+        self.imported = 0
+        self.failed = 0
+        self.bytes = 0
+        self.rows = []
+        self.rows_bytes = 0
+
+    def add(self, stream, received_date=None, is_read=False):
+        """Queue a message read from a seekable binary file object, committing whenever the batch is full"""
+        data = stream.read(PARSE_LIMIT + 1)
+        if len(data) > PARSE_LIMIT:
+            # Large messages are streamed after the rows before them are committed
+            self.flush()
+            stream.seek(0)
+            # A duplicate keeps the stored copy's read state
+            email_id = self.db.store_email_stream(self.recipient, stream, received_date, is_read)
+            if email_id is None:
+                self.failed += 1
+                return
+            self.imported += 1
+            self.bytes += stream.tell()
+            return
+
+        try:
+            row = EmailDatabase.build_email_row(self.recipient, data)
+        except Exception as e:
+            print(f"Error parsing message {self.imported + self.failed + len(self.rows) + 1}: {e}")
+            self.failed += 1
+            return
+
+        # The archive's own delivery date and read state carry over
+        if received_date is not None:
+            row["received_date"] = received_date
+        row["is_read"] = is_read
+        self.rows.append(row)
+        self.rows_bytes += row["size"]
+
+        if len(self.rows) >= self.batch_size or self.rows_bytes >= BATCH_BYTES:
+            self.flush()
+
+    def flush(self):
+        """Commit the queued rows in one transaction"""
+        if not self.rows:
+            return
+        for row, email_id in zip(self.rows, self.db.store_rows(self.rows)):
+            if email_id:
+                self.imported += 1
+                self.bytes += row["size"]
+            else:
+                self.failed += 1
+        self.rows = []
+        self.rows_bytes = 0
+
+def import_mbox(db, recipient, path, batch_size=BATCH_SIZE):
+    """Import an mbox file into a mailbox and return the finished ArchiveImport"""
+    archive = ArchiveImport(db, recipient, batch_size)
+    with open(path, 'rb') as f:
+        for from_line, spool in iter_mbox(f):
+            # Read state lives in the Status header, written by most mbox clients
+            message, is_read = split_status(spool)
+            with message:
+                archive.add(message, from_line_date(from_line), is_read)
+    archive.flush()
+    return archive
+
+def import_maildir(db, recipient, maildir, batch_size=BATCH_SIZE):
+    """Import a Maildir into a mailbox and return the finished ArchiveImport"""
+    archive = ArchiveImport(db, recipient, batch_size)
+    for path, stat, seen in iter_maildir(maildir):
+        try:
+            with open(path, 'rb') as f:
+                # Maildir deliveries keep their arrival time as the file mtime
+                archive.add(f, stat.st_mtime_ns // 1000, seen)
+        except OSError as e:
+            print(f"Error reading {path}: {e}")
+            archive.failed += 1
+    archive.flush()
+    return archive
+
+def _write_quoted(stream, reader):
+    """Copy a raw message into an mbox file with mboxrd From quoting, ending with a blank line"""
+    pending = b""
+    for chunk in reader.iter_chunks(MBOX_CHUNK_SIZE):
+        data = pending + chunk
+        cut = data.rfind(b"\n") + 1
+        data, pending = data[:cut], data[cut:]
+        stream.write(UNQUOTED_FROM.sub(rb'>\1', data))
+
+    # A message without a final line break gets one so the separator stays on its own line
+    if pending:
+        stream.write(UNQUOTED_FROM.sub(rb'>\1', pending) + b"\n")
+    stream.write(b"\n")
+
+def export_mbox(db, recipient, path):
+    """Write a mailbox to an mbox file one raw message at a time; returns (messages, bytes)"""
+    count = 0
+    size = 0
+    with open(path, 'wb') as f:
+        for rows in db.export_mailbox(recipient, include_content=False):
+            for row in rows:
+                reader = db.open_raw_email(row["id"])
+                if reader is None:
+                    continue
+                with reader:
+                    sender = parseaddr(row["sender"] or "")[1] or "MAILER-DAEMON"
+                    received = time.asctime(time.gmtime(row["received_date"] // 1000000))
+                    f.write(f"From {sender} {received}\n".encode("utf-8", "replace"))
+                    # Read state goes in a Status header ahead of the message's own headers
+                    if row["is_read"]:
+                        f.write(b"Status: RO\n")
+                    _write_quoted(f, reader)
+                count += 1
+                size += row["size"]
+    return count, size
+
+def export_maildir(db, recipient, maildir):
+    """Write a mailbox to a Maildir, one file per message with its read flag; returns (messages, bytes)"""
+    for folder in ("tmp", "new", "cur"):
+        os.makedirs(os.path.join(maildir, folder), exist_ok=True)
+    host = socket.gethostname().replace("/", "\\057").replace(":", "\\072")
+
+    count = 0
+    size = 0
+    for rows in db.export_mailbox(recipient, include_content=False):
+        for row in rows:
+            reader = db.open_raw_email(row["id"])
+            if reader is None:
+                continue
+
+            # Written under tmp and renamed into cur, so readers never see half a file
+            name = f"{row['received_date'] // 1000000}.{row['id']}.{host}"
+            temp_path = os.path.join(maildir, "tmp", name)
+            with reader, open(temp_path, 'wb') as f:
+                for chunk in reader.iter_chunks():
+                    f.write(chunk)
+            received_ns = row["received_date"] * 1000
+            os.utime(temp_path, ns=(received_ns, received_ns))
+            os.rename(temp_path, os.path.join(maildir, "cur", f"{name}:2,{'S' if row['is_read'] else ''}"))
+            count += 1
+            size += row["size"]
+    return count, size
+
+def parse_arguments():
+    """Parse command line arguments"""
+    parser = argparse.ArgumentParser(description="Import and export mailboxes as mbox files or Maildirs")
+    action = parser.add_mutually_exclusive_group(required=True)
+    action.add_argument("--import-mbox", metavar="FILE", help="Import an mbox file")
+    action.add_argument("--import-maildir", metavar="DIR", help="Import a Maildir")
+    action.add_argument("--export-mbox", metavar="FILE", help="Export to an mbox file")
+    action.add_argument("--export-maildir", metavar="DIR", help="Export to a Maildir")
+    parser.add_argument("--mailbox", required=True, help="Email address of the mailbox to import into or export")
+    parser.add_argument("--batch-size", type=int, default=BATCH_SIZE, help="Emails stored per transaction")
+    parser.add_argument("--profile", help="Database PRAGMA profile, e.g. throughput for a large import")
+
+    return parser.parse_args()
+
+def main():
+    args = parse_arguments()
+    db = open_email_database(profile=args.profile)
+    started = time.monotonic()
+
+    try:
+        if args.import_mbox or args.import_maildir:
+            if args.import_mbox:
+                archive = import_mbox(db, args.mailbox, args.import_mbox, args.batch_size)
+            else:
+                archive = import_maildir(db, args.mailbox, args.import_maildir, args.batch_size)
+            count, size = archive.imported, archive.bytes
+            print(f"Imported {count} emails into {args.mailbox} ({archive.failed} failed)")
+        elif args.export_mbox:
+            count, size = export_mbox(db, args.mailbox, args.export_mbox)
+            print(f"Exported {count} emails to {args.export_mbox}")
+        else:
+            count, size = export_maildir(db, args.mailbox, args.export_maildir)
+            print(f"Exported {count} emails to {args.export_maildir}")
+    except OSError as e:
+        print(f"Error: {e}")
+        return
+    finally:
+        db.close()
+
+    elapsed = max(time.monotonic() - started, 1e-6)
+    print(f"{size / 1024 / 1024:.1f} MB in {format_duration(elapsed)}: "
+          f"{count / elapsed:.0f} emails/s, {size / elapsed / 1024 / 1024:.1f} MB/s")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,38 @@
+#!/usr/bin/env python3
+import os
+import shutil
+import tempfile
+from contextlib import contextmanager
+from email.mime.text import MIMEText
+from email_db import EmailDatabase
+
+def build_message(recipient="test@example.com", i=0, subject=None, body=None, sender="sender@example.com",
+                  message_id=None, headers=None):
+    """Build a small text message; i keeps the subject, body and Message-ID of each message apart"""
+    msg = MIMEText(f"Test body {i}" if body is None else body)
+    msg["From"] = sender
+    msg["To"] = recipient
+    msg["Subject"] = f"Test message {i}" if subject is None else subject
+    msg["Message-ID"] = f"<{message_id or f'test-{i}-' + recipient.replace('@', '.')}@example.com>"
+    for name, value in (headers or {}).items():
+        msg[name] = value
+    return msg.as_bytes()
+
+@contextmanager
+def temp_dir():
+    """A new temporary directory, removed with everything in it afterwards"""
+    path = tempfile.mkdtemp(prefix="email_test_")
+    try:
+        yield path
+    finally:
+        shutil.rmtree(path)
+
+@contextmanager
+def temp_database(**kwargs):
+    """An EmailDatabase in a new temporary directory, closed when the block ends"""
+    with temp_dir() as path:
+        db = EmailDatabase(os.path.join(path, "emails.db"), **kwargs)
+        try:
+            yield db
+        finally:
+            db.close()
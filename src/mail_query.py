@@ -0,0 +1,232 @@
+#!/usr/bin/env python3
+import re
+import datetime
+
+# Search box syntax, compiled to SQL over the emails table (aliased e):
+#   from:alice@example.com  from:@example.com  from:example.com  from:alice
+#   to:...  cc:...           same forms as from:
+#   subject:word  subject:"exact phrase"
+#   after:2024-01-31  before:2024-02-01   local dates, after: is inclusive
+#   is:unread  is:read  has:attachment  larger:5M  smaller:100K
+#   other words and "quoted phrases" are full-text terms, word* is a prefix
+# Terms next to each other must all match; OR, NOT (or a leading -) and
+# parentheses combine them. NOT binds tightest, then AND, then OR.
+QUERY_FIELDS = ("from", "to", "cc", "subject", "before", "after", "is", "has", "larger", "smaller")
+
+TOKEN_PATTERN = re.compile(r'\s*(?:(\()|(\))|(-)(?=\S)|(\w+):(?:"([^"]*)"?|(\S+?))(?=[\s()]|$)|"([^"]*)"?|([^\s()]+))')
+
+SIZE_UNITS = {"": 1, "B": 1, "K": 1024, "KB": 1024, "M": 1024 ** 2, "MB": 1024 ** 2, "G": 1024 ** 3, "GB": 1024 ** 3}
+
+class QuerySyntaxError(ValueError):
+    """A search query that cannot be compiled"""
+
+def tokenize(query):
+    """Split a query into ("(" | ")" | "NOT" | "AND" | "OR" | "term", field, value) tokens"""
+    tokens = []
+    position = 0
+    
+    while position < len(query):
+        match = TOKEN_PATTERN.match(query, position)
+        if not match or match.end() == position:
+            break
+        position = match.end()
+        opening, closing, minus, field, field_quoted, field_value, phrase, word = match.groups()
+        
+        if opening or closing:
+            tokens.append((opening or closing, None, None))
+        elif minus:
+            tokens.append(("NOT", None, None))
+        elif field and field.lower() in QUERY_FIELDS:
+            tokens.append(("term", field.lower(), field_quoted if field_quoted is not None else field_value))
+        elif field:
+            # An unknown prefix such as a URL scheme is ordinary text
+            tokens.append(("term", None, match.group(0).strip()))
+        elif phrase is not None:
+            tokens.append(("term", None, f'"{phrase}"'))
+        elif word in ("AND", "OR", "NOT"):
+            tokens.append((word, None, None))
+        else:
+            tokens.append(("term", None, word))
+    
+    return tokens
+
+class QueryParser:
+    """Recursive descent parser from tokens to a tree of ("and" | "or", [nodes]), ("not", node) and ("term", field, value)"""
+    
+    def __init__(self, tokens):
+        """Parse the given tokens"""
+        self.tokens = tokens
+        self.position = 0
+    
+    def _peek(self):
+        """Kind of the next token, or None at the end"""
+        return self.tokens[self.position][0] if self.position < len(self.tokens) else None
+    
+    def parse(self):
+        """Parse the whole query; None when it has no terms"""
+        node = self._parse_or()
+        
+        # A stray closing parenthesis ends a group that was never opened
+        while self._peek() == ")":
+            self.position += 1
+            rest = self._parse_or()
+            node = self._combine("and", [node, rest])
+        return node
+    
+    def _combine(self, kind, nodes):
+        """Join nodes with AND or OR, dropping empty ones"""
+        nodes = [node for node in nodes if node is not None]
+        if not nodes:
+            return None
+        return nodes[0] if len(nodes) == 1 else (kind, nodes)
+    
+    def _parse_or(self):
+        """alternatives separated by OR"""
+        nodes = [self._parse_and()]
+        while self._peek() == "OR":
+            self.position += 1
+            nodes.append(self._parse_and())
+        return self._combine("or", nodes)
+    
+    def _parse_and(self):
+        """terms that must all match, with or without AND between them"""
+        nodes = []
+        while self._peek() not in (None, ")", "OR"):
+            if self._peek() == "AND":
+                self.position += 1
+                continue
+            nodes.append(self._parse_unary())
+        return self._combine("and", nodes)
+    
+    def _parse_unary(self):
+        """NOT, a parenthesized group or a single term"""
+        kind, field, value = self.tokens[self.position]
+        self.position += 1
+        
+        if kind == "NOT":
+            if self._peek() in (None, ")", "OR"):
+                return None
+            node = self._parse_unary()
+            return ("not", node) if node is not None else None
+        
+        if kind == "(":
+            node = self._parse_or()
+            # A missing closing parenthesis is assumed at the end
+            if self._peek() == ")":
+                self.position += 1
+            return node
+        
+        return ("term", field, value)
+
+def parse_query(query):
+    """Parse search box input into a query tree; None when it has no terms"""
+    return QueryParser(tokenize(query)).parse()
+
+def has_filters(tokens):
+    """True when a tokenized query needs more than a plain full-text match: field terms, AND, NOT or parentheses"""
+    # OR between plain words is left to the FTS query, which supports it
+    return any(kind in ("AND", "NOT", "(", ")") or (kind == "term" and field is not None)
+               for kind, field, _ in tokens)
+
+def fts_term(value, column=None):
+    """Quote one word or phrase for FTS5, or None when it has nothing to match"""
+    # Every term is quoted so punctuation can never break the FTS syntax
+    phrase = value.startswith('"')
+    prefix = not phrase and value.endswith("*")
+    text = value.rstrip("*").replace('"', "")
+    if not re.search(r"\w", text):
+        return None
+    
+    term = f'"{text}"' + ("*" if prefix else "")
+    return f"{column} : {term}" if column else term
+
+def parse_date(value, field):
+    """Local midnight at the start of a YYYY-MM-DD date, as epoch microseconds"""
+    try:
+        day = datetime.date.fromisoformat(value.replace("/", "-"))
+    except ValueError:
+        raise QuerySyntaxError(f"{field}: expects a date like 2024-01-31, not {value!r}")
+    
+    midnight = datetime.datetime(day.year, day.month, day.day)
+    return int(midnight.timestamp()) * 1000000
+
+def parse_size(value, field):
+    """Bytes in a size such as 500, 20K or 1.5MB"""
+    match = re.fullmatch(r'(\d+(?:\.\d+)?)\s*([a-zA-Z]*)', value)
+    if not match or match.group(2).upper() not in SIZE_UNITS:
+        raise QuerySyntaxError(f"{field}: expects a size like 500K or 2M, not {value!r}")
+    return int(float(match.group(1)) * SIZE_UNITS[match.group(2).upper()])
+
+def compile_term(field, value):
+    """SQL condition and parameters for one term; None when the term matches nothing useful"""
+    if field is None or field == "subject":
+        # Full-text terms are looked up in the FTS index by rowid, which is emails.seq
+        match = fts_term(value, "subject" if field else None)
+        if match is None:
+            return None
+        return "e.seq IN (SELECT rowid FROM emails_fts WHERE emails_fts MATCH ?)", [match]
+    
+    if field in ("from", "to", "cc"):
+        # Addresses and domains come straight out of the email_addresses indexes
+        value = value.strip().lower()
+        if not value:
+            return None
+        if value.startswith("@") or ("@" not in value and "." in value):
+            condition = "domain = ?"
+            params = [value.lstrip("@")]
+        elif "@" in value:
+            condition = "address = ?"
+            params = [value]
+        else:
+            # A bare name matches addresses starting with it, as an index range
+            condition = "address >= ? AND address < ?"
+            params = [value, value + "\uffff"]
+        return (f"e.seq IN (SELECT email_seq FROM email_addresses WHERE {condition} AND field = ?)",
+                params + [field])
+    
+    if field == "after":
+        return "e.received_date >= ?", [parse_date(value, field)]
+    if field == "before":
+        return "e.received_date < ?", [parse_date(value, field)]
+    
+    if field == "larger":
+        return "e.size > ?", [parse_size(value, field)]
+    if field == "smaller":
+        return "e.size < ?", [parse_size(value, field)]
+    
+    if field == "is":
+        flags = {"unread": "e.is_read = 0", "read": "e.is_read = 1"}
+        if value.lower() not in flags:
+            raise QuerySyntaxError(f"is: expects unread or read, not {value!r}")
+        return flags[value.lower()], []
+    
+    # field == "has"
+    if value.lower() not in ("attachment", "attachments"):
+        raise QuerySyntaxError(f"has: expects attachment, not {value!r}")
+    # One primary key probe into the attachment catalog instead of reading the JSON column
+    return "EXISTS (SELECT 1 FROM email_attachments a WHERE a.email_seq = e.seq)", []
+
+def compile_node(node):
+    """SQL condition and parameters for a query tree; None when it has no usable terms"""
+    if node[0] == "term":
+        return compile_term(node[1], node[2])
+    
+    if node[0] == "not":
+        inner = compile_node(node[1])
+        if inner is None:
+            return None
+        return f"NOT ({inner[0]})", inner[1]
+    
+    parts = [part for part in (compile_node(child) for child in node[1]) if part is not None]
+    if not parts:
+        return None
+    if len(parts) == 1:
+        return parts[0]
+    
+    joiner = " AND " if node[0] == "and" else " OR "
+    return "(" + joiner.join(sql for sql, _ in parts) + ")", [param for _, params in parts for param in params]
+
+def compile_query(query):
+    """Compile search box input to a parameterized WHERE condition on emails e, or None when it is empty"""
+    node = parse_query(query)
+    return compile_node(node) if node is not None else None
\ No newline at end of file
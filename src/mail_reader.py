@@ -5,7 +5,30 @@ import argparse
 import email
 from email.policy import default
 import glob
-from email_db import EmailDatabase  # Import EmailDatabase
+import shutil
+import datetime
+from email_db import from_epoch_us
+from header_index import HeaderIndex
+from mail_query import QuerySyntaxError, compile_query
+from sharded_db import open_email_database, database_available
+
+def format_date(epoch_us):
+    """Format a stored received_date for display in local time"""
+    return from_epoch_us(epoch_us).strftime("%Y-%m-%d %H:%M:%S") if epoch_us is not None else "n/a"
+
+def list_mailboxes_from_db():
+    """List mailboxes with their counts from the database summary table"""
+    db = open_email_database()
+    summaries = db.get_mailbox_summary()
+    
+    if not summaries:
+        print("No mailboxes found.")
+        return
+    
+    print("Available mailboxes:")
+    for summary in summaries:
+        print(f"  - {summary['recipient']}: {summary['total']} emails, {summary['unread']} unread, "
+              f"{summary['bytes']} bytes (newest: {format_date(summary['newest'])})")
 
 def list_mailboxes():
     """List all available mailboxes"""
@@ -34,28 +57,28 @@ def list_emails_from_files(mailbox):
         print(f"Mailbox for {mailbox} not found.")
         return
     
-    emails = glob.glob(os.path.join(mailbox_path, "*.eml"))
+    # Headers come from the mailbox's header index; only new or changed files are read
+    emails = HeaderIndex(mailbox_path).list_emails()
     if not emails:
         print(f"No emails found in mailbox for {mailbox}.")
         return
     
     print(f"Emails in mailbox for {mailbox}:")
-    for i, email_path in enumerate(sorted(emails, reverse=True), 1):
-        with open(email_path, 'rb') as f:
-            msg = email.message_from_binary_file(f, policy=default)
-            subject = msg.get('Subject', 'No Subject')
-            from_addr = msg.get('From', 'Unknown')
-            date = msg.get('Date', 'Unknown')
-            print(f"  {i}. From: {from_addr}")
-            print(f"     Subject: {subject}")
-            print(f"     Date: {date}")
-            print(f"     ID: {os.path.basename(email_path)}")
-            print()
-
-def list_emails_from_db(mailbox):
-    """List emails in a mailbox from database"""
-    db = EmailDatabase()
-    emails = db.get_mailbox(mailbox)
+    for i, entry in enumerate(reversed(emails), 1):
+        print(f"  {i}. From: {entry['from']}")
+        print(f"     Subject: {entry['subject']}")
+        print(f"     Date: {entry['date']}")
+        print(f"     ID: {entry['name']}")
+        print()
+
+def list_emails_from_db(mailbox, page_size=50, page_token=None):
+    """List one page of emails in a mailbox from database"""
+    db = open_email_database()
+    try:
+        emails, next_token = db.get_mailbox_page(mailbox, limit=page_size, page_token=page_token)
+    except ValueError as e:
+        print(e)
+        return
     
     if not emails:
         print(f"No emails found in mailbox for {mailbox}.")
@@ -65,10 +88,62 @@ def list_emails_from_db(mailbox):
     for i, mail in enumerate(emails, 1):
         print(f"  {i}. From: {mail['sender']}")
         print(f"     Subject: {mail['subject']}")
-        print(f"     Date: {mail['received_date']}")
+        print(f"     Date: {format_date(mail['received_date'])}")
         print(f"     ID: {mail['id']}")
         print(f"     Read: {'Yes' if mail['is_read'] else 'No'}")
         print()
+    
+    if next_token:
+        print(f"More emails available. Next page: --page {next_token}")
+
+def list_emails_by_date(mailbox, since=None, before=None, limit=50):
+    """List emails received in a date range from database"""
+    db = open_email_database()
+    emails = db.get_emails_between(mailbox, since, before, limit)
+    
+    if not emails:
+        print(f"No emails found in that date range for {mailbox}.")
+        return
+    
+    print(f"Emails in mailbox for {mailbox}:")
+    for i, mail in enumerate(emails, 1):
+        print(f"  {i}. {format_date(mail['received_date'])}  {mail['sender']}: {mail['subject']}")
+        print(f"     ID: {mail['id']}")
+
+def find_emails_in_db(mailbox=None, from_domain=None, min_size=None, since=None, before=None, limit=50):
+    """List emails matching header filters from the database's header index"""
+    db = open_email_database()
+    emails = db.find_emails(mailbox, sender_domain=from_domain, min_size=min_size,
+                            since=since, before=before, limit=limit)
+    
+    if not emails:
+        print("No matching emails found.")
+        return
+    
+    print(f"Matching emails{f' for {mailbox}' if mailbox else ''}:")
+    for i, mail in enumerate(emails, 1):
+        print(f"  {i}. {format_date(mail['received_date'])}  {mail['sender']}: {mail['subject']} ({mail['size']} bytes)")
+        print(f"     To: {mail['recipient']}  ID: {mail['id']}")
+
+def search_emails_in_db(mailbox, query, limit=50):
+    """List a mailbox's emails matching a search query such as 'from:alice is:unread'"""
+    try:
+        compile_query(query)
+    except QuerySyntaxError as e:
+        print(f"Invalid search query: {e}")
+        return
+    
+    db = open_email_database()
+    emails = db.search_emails(mailbox, query, limit)
+    
+    if not emails:
+        print(f"No emails matching '{query}' in mailbox for {mailbox}.")
+        return
+    
+    print(f"Emails matching '{query}' in mailbox for {mailbox}:")
+    for i, mail in enumerate(emails, 1):
+        print(f"  {i}. {format_date(mail['received_date'])}  {mail['sender']}: {mail['subject']}")
+        print(f"     ID: {mail['id']}  Read: {'Yes' if mail['is_read'] else 'No'}")
 
 def read_email_from_files(mailbox, index):
     """Read a specific email from file system"""
@@ -106,7 +181,7 @@ def read_email_from_files(mailbox, index):
 
 def read_email_from_db(mailbox, email_id):
     """Read a specific email from database"""
-    db = EmailDatabase()
+    db = open_email_database()
     
     # If email_id is an integer, fetch the corresponding email from the list
     if isinstance(email_id, int):
@@ -124,27 +199,84 @@ def read_email_from_db(mailbox, email_id):
         print(f"Email with ID {email_id} not found.")
         return
     
-    # Mark as read
-    db.mark_as_read(email_id)
+    # Mark as read; an email that already is needs no write
+    if not mail_data['is_read']:
+        db.mark_as_read(email_id)
     
     # Print email details
     print(f"From: {mail_data['sender']}")
-    print(f"To: {mail_data['recipient']}")
+    print(f"To: {mail_data['to_header'] or mail_data['recipient']}")
+    if mail_data['cc_header']:
+        print(f"Cc: {mail_data['cc_header']}")
     print(f"Subject: {mail_data['subject']}")
-    print(f"Date: {mail_data['received_date']}")
+    print(f"Date: {format_date(mail_data['received_date'])}")
     print()
     
     # Print email body
     print(mail_data['body'])
     
-    # Print attachments if any
-    if mail_data['attachments']:
-        import json
-        attachments = json.loads(mail_data['attachments'])
-        if attachments:
-            print("\nAttachments:")
-            for attachment in attachments:
-                print(f"  - {attachment}")
+    # Print attachments if any, numbered by the part to pass to --attachment
+    attachments = db.get_attachments(email_id)
+    if attachments:
+        print("\nAttachments:")
+        for attachment in attachments:
+            print(f"  [{attachment['part_index']}] {attachment['filename'] or '(unnamed)'} "
+                  f"({attachment['content_type']}, {attachment['size']} bytes)")
+
+def save_raw_email_from_db(email_id, output_path):
+    """Stream the original message of an email into a file"""
+    db = open_email_database()
+    reader = db.open_raw_email(email_id)
+    
+    if reader is None:
+        print(f"Email with ID {email_id} not found.")
+        return
+    
+    # Copy in chunks so memory use does not depend on the message size
+    with reader, open(output_path, 'wb') as f:
+        shutil.copyfileobj(reader, f)
+        size = reader.tell()
+    
+    print(f"Saved {size} bytes to {output_path}")
+
+def save_attachment_from_db(email_id, part_index, output_path):
+    """Stream one decoded attachment of an email into a file"""
+    db = open_email_database()
+    chunks = db.stream_attachment(email_id, part_index)
+    
+    if chunks is None:
+        print(f"Email with ID {email_id} has no attachment {part_index}.")
+        return
+    
+    # Only the attachment's part of the message is read and decoded
+    size = 0
+    with open(output_path, 'wb') as f:
+        for chunk in chunks:
+            f.write(chunk)
+            size += len(chunk)
+    
+    print(f"Saved {size} bytes to {output_path}")
+
+def show_mailbox_usage(limit=20):
+    """Show the largest mailboxes from the database usage counters"""
+    db = open_email_database()
+    usage = db.get_all_usage(limit)
+    
+    if not usage:
+        print("No mailbox usage recorded.")
+        return
+    
+    print("Mailbox usage (largest first):")
+    for row in usage:
+        max_messages, max_bytes = db.get_quota(row['recipient'])
+        quota = []
+        if max_messages is not None:
+            quota.append(f"{max_messages} messages")
+        if max_bytes is not None:
+            quota.append(f"{max_bytes} bytes")
+        print(f"  - {row['recipient']}: {row['message_count']} messages, "
+              f"{row['total_bytes']} bytes, {row['unread_count']} unread"
+              f" (quota: {', '.join(quota) if quota else 'none'})")
 
 def parse_arguments():
     """Parse command line arguments"""
@@ -155,6 +287,20 @@ def parse_arguments():
     parser.add_argument("--read", type=int, help="Read a specific email by index")
     parser.add_argument("--id", help="Read a specific email by ID")
     parser.add_argument("--use-db", action="store_true", help="Use database instead of file system")
+    parser.add_argument("--page-size", type=int, default=50, help="Number of emails to list per page (database only)")
+    parser.add_argument("--page", help="Continuation token printed at the end of the previous page (database only)")
+    parser.add_argument("--usage", action="store_true", help="Show per-mailbox usage from the database")
+    parser.add_argument("--since", type=datetime.datetime.fromisoformat,
+                        help="Only list emails received on or after this local date/time, e.g. 2024-01-31 (database only)")
+    parser.add_argument("--before", type=datetime.datetime.fromisoformat,
+                        help="Only list emails received before this local date/time (database only)")
+    parser.add_argument("--save", metavar="FILE", help="Save the original message of --id to FILE (database only)")
+    parser.add_argument("--attachment", type=int, metavar="PART",
+                        help="With --save, save this attachment of --id instead, as numbered when reading it (database only)")
+    parser.add_argument("--from-domain", help="Only list emails sent from this domain, in every mailbox unless --mailbox is given (database only)")
+    parser.add_argument("--min-size", type=int, help="Only list emails of at least this many bytes (database only)")
+    parser.add_argument("--search", metavar="QUERY",
+                        help="Search --mailbox, e.g. 'from:alice is:unread (report OR invoice)' (database only)")
     
     return parser.parse_args()
 
@@ -162,24 +308,45 @@ def main():
     args = parse_arguments()
     
     # Determine whether to use database or files
-    use_db = args.use_db or os.path.exists("database/emails.db")
+    use_db = args.use_db or database_available()
     
     if args.list:
-        list_mailboxes()
+        if use_db:
+            list_mailboxes_from_db()
+        else:
+            list_mailboxes()
+    elif args.usage:
+        show_mailbox_usage()
+    elif args.from_domain or args.min_size:
+        if use_db:
+            find_emails_in_db(args.mailbox, args.from_domain, args.min_size, args.since, args.before, args.page_size)
+        else:
+            print("Header filters are only supported with database storage")
     elif args.mailbox:
         if args.read:
             if use_db:
                 read_email_from_db(args.mailbox, args.read)
             else:
                 read_email_from_files(args.mailbox, args.read)
-        elif args.id:
+        elif args.search:
             if use_db:
+                search_emails_in_db(args.mailbox, args.search, args.page_size)
+            else:
+                print("Search is only supported with database storage")
+        elif args.id:
+            if use_db and args.save and args.attachment is not None:
+                save_attachment_from_db(args.id, args.attachment, args.save)
+            elif use_db and args.save:
+                save_raw_email_from_db(args.id, args.save)
+            elif use_db:
                 read_email_from_db(args.mailbox, args.id)
             else:
                 print("Reading by ID is only supported with database storage")
         else:
-            if use_db:
-                list_emails_from_db(args.mailbox)
+            if use_db and (args.since or args.before):
+                list_emails_by_date(args.mailbox, args.since, args.before, args.page_size)
+            elif use_db:
+                list_emails_from_db(args.mailbox, args.page_size, args.page)
             else:
                 list_emails_from_files(args.mailbox)
     else:
@@ -0,0 +1,272 @@
+#!/usr/bin/env python3
+import os
+import time
+import hashlib
+import argparse
+from email_db import PARSE_LIMIT, RAW_CHUNK_SIZE, EmailDatabase
+from sharded_db import open_email_database
+from db_maintenance import DB_BACKED_FILE
+
+# Files modified this recently may still be being written and wait for the next run
+SETTLE_SECONDS = 2
+
+# Emails stored per transaction
+BATCH_SIZE = 500
+
+def mailbox_address(mailbox):
+    """Convert a mailbox directory name to its email address"""
+    return mailbox.replace('_at_', '@').replace('_dot_', '.')
+
+def file_fingerprint(path):
+    """Size, mtime and SHA-256 of a file, read in chunks"""
+    content_hash = hashlib.sha256()
+    with open(path, 'rb') as f:
+        stat = os.fstat(f.fileno())
+        for chunk in iter(lambda: f.read(RAW_CHUNK_SIZE), b""):
+            content_hash.update(chunk)
+    return {"size": stat.st_size, "mtime_ns": stat.st_mtime_ns, "content_hash": content_hash.hexdigest()}
+
+class MailboxSync:
+    """Keeps the .eml tree and the database in step through the file_manifest table"""
+    
+    def __init__(self, email_db=None, mailbox_dir="mailboxes", apply_deletions=False, full=False,
+                 batch_size=BATCH_SIZE):
+        """Create a sync job; apply_deletions propagates deletions instead of only flagging them and
+        full lists every directory and fingerprints every file, even one whose size and mtime match
+        its manifest row"""
+        self.email_db = email_db or open_email_database()
+        self.mailbox_dir = mailbox_dir
+        self.apply_deletions = apply_deletions
+        self.full = full
+        self.batch_size = batch_size
+    
+    def run_once(self):
+        """Sync every mailbox directory and return counters plus the flagged files"""
+        stats = {"mailboxes": 0, "scanned": 0, "skipped": 0, "imported": 0, "linked": 0, "changed": 0,
+                 "removed_files": 0, "removed_emails": 0, "flagged": []}
+        if not os.path.exists(self.mailbox_dir):
+            return stats
+        
+        for mailbox in sorted(os.listdir(self.mailbox_dir)):
+            if os.path.isdir(os.path.join(self.mailbox_dir, mailbox)):
+                self.sync_mailbox(mailbox, stats)
+        return stats
+    
+    def sync_mailbox(self, mailbox, stats):
+        """Bring one mailbox's manifest up to date with its directory and the database"""
+        recipient = mailbox_address(mailbox)
+        mailbox_path = os.path.join(self.mailbox_dir, mailbox)
+        state = self.email_db.get_sync_state(recipient) or {"dir_mtime_ns": None, "modseq": 0}
+        stats["mailboxes"] += 1
+        
+        # Emails deleted in the database since the last run come from its
+        # tombstones; if those were pruned, every mapped email is checked
+        changes = self.email_db.changes_since(recipient, state["modseq"])
+        if changes is None:
+            return
+        if changes["full_resync"]:
+            self.email_db.flag_deleted_emails(recipient)
+        elif changes["deleted"]:
+            self.email_db.flag_deleted_emails(recipient, changes["deleted"])
+        
+        # Adding, removing or renaming a file changes the directory mtime, so an
+        # unchanged directory needs no listing at all. A file rewritten in place
+        # changes only its own mtime and is left to --full. The directory mtime
+        # is read before the listing so files arriving meanwhile show up next time
+        dir_mtime_ns = os.stat(mailbox_path).st_mtime_ns
+        if self.full or dir_mtime_ns != state["dir_mtime_ns"]:
+            changed, settled = self._scan(recipient, mailbox_path, stats)
+            if changed:
+                stats["scanned"] += 1
+            # A directory with files still being written, or one modified so
+            # recently that a coarse mtime might not move again, is listed next run
+            if not settled or dir_mtime_ns > time.time_ns() - SETTLE_SECONDS * 1000000000:
+                dir_mtime_ns = None
+        else:
+            stats["skipped"] += 1
+        
+        if self.apply_deletions:
+            self._apply_deletions(recipient, mailbox_path, stats)
+        
+        stats["flagged"].extend((recipient, entry) for entry in self.email_db.get_flagged_files(recipient))
+        self.email_db.set_sync_state(recipient, dir_mtime_ns, changes["modseq"])
+    
+    def _scan(self, recipient, mailbox_path, stats):
+        """Compare a directory with its manifest and import what is new or changed
+
+        Returns (changed, settled): whether anything was new, changed or missing,
+        and False for settled when a file was left for the next run.
+        """
+        manifest = self.email_db.get_file_manifest(recipient)
+        if manifest is None:
+            return False, False
+        
+        # Only stat() calls here: files whose size and mtime match their
+        # manifest row are never opened unless the sync is a full one
+        settled = True
+        pending = []
+        seen = set()
+        recent = time.time_ns() - SETTLE_SECONDS * 1000000000
+        with os.scandir(mailbox_path) as entries:
+            for entry in entries:
+                if not entry.name.endswith(".eml") or not entry.is_file():
+                    continue
+                seen.add(entry.name)
+                stat = entry.stat()
+                known = manifest.get(entry.name)
+                unchanged = known and known["size"] == stat.st_size and known["mtime_ns"] == stat.st_mtime_ns
+                if unchanged and known["status"] == "file_missing":
+                    self.email_db.set_manifest_status(recipient, [entry.name], "ok")
+                if unchanged and not self.full:
+                    continue
+                # Files still being written are left for the next run
+                if stat.st_mtime_ns > recent:
+                    settled = False
+                    continue
+                pending.append(entry.name)
+        
+        # Files gone from disk are flagged until their deletion is applied
+        missing = [name for name, known in manifest.items() if name not in seen and known["status"] == "ok"]
+        if missing:
+            self.email_db.set_manifest_status(recipient, missing, "file_missing")
+        
+        for start in range(0, len(pending), self.batch_size):
+            self._import(recipient, mailbox_path, pending[start:start + self.batch_size], manifest, stats)
+        return bool(pending or missing), settled
+    
+    def _import(self, recipient, mailbox_path, names, manifest, stats):
+        """Fingerprint new or changed files, store the ones the database lacks and record them in the manifest"""
+        entries = []
+        rows = []
+        replaced = []
+        
+        # Files written by the SMTP server carry the id of the stored email
+        named_ids = {}
+        for name in names:
+            match = DB_BACKED_FILE.match(name)
+            if match and name not in manifest:
+                named_ids[name] = match.group(1)
+        live_ids = self.email_db.existing_ids(named_ids.values()) if named_ids else set()
+        
+        for name in names:
+            path = os.path.join(mailbox_path, name)
+            try:
+                with open(path, 'rb') as f:
+                    data = f.read(PARSE_LIMIT + 1)
+                    stat = os.fstat(f.fileno())
+            except OSError as e:
+                print(f"Error reading {path}: {e}")
+                continue
+            
+            entry = {"filename": name, "size": stat.st_size, "mtime_ns": stat.st_mtime_ns, "email_id": None}
+            known = manifest.get(name)
+            
+            if len(data) > PARSE_LIMIT:
+                # Large files are hashed and stored in chunks
+                entry.update(file_fingerprint(path))
+                if known and known["content_hash"] == entry["content_hash"]:
+                    entry["email_id"] = known["email_id"]
+                else:
+                    with open(path, 'rb') as f:
+                        entry["email_id"] = self.email_db.store_email_stream(recipient, f)
+                    stats["imported"] += 1
+                    if known:
+                        replaced.append(known)
+                entries.append(entry)
+                continue
+            
+            entry["content_hash"] = hashlib.sha256(data).hexdigest()
+            if known and known["content_hash"] == entry["content_hash"]:
+                # Touched but not changed: only the fingerprint moves on
+                entry["email_id"] = known["email_id"]
+                entries.append(entry)
+            elif named_ids.get(name) in live_ids:
+                entry["email_id"] = named_ids[name]
+                entries.append(entry)
+                stats["linked"] += 1
+            else:
+                try:
+                    rows.append((entry, EmailDatabase.build_email_row(recipient, data)))
+                except Exception as e:
+                    print(f"Error parsing {path}: {e}")
+                    continue
+                if known:
+                    replaced.append(known)
+        
+        # New content goes through the bulk path; duplicates map to the stored email
+        for (entry, _), email_id in zip(rows, self.email_db.store_rows([row for _, row in rows])):
+            if email_id:
+                entry["email_id"] = email_id
+                entries.append(entry)
+                stats["imported"] += 1
+        
+        self.email_db.update_file_manifest(recipient, entries)
+        
+        # A changed file replaces the email stored from its old content
+        stats["changed"] += len(replaced)
+        stale = [known["email_id"] for known in replaced
+                 if known["email_id"] and known["email_id"] not in {entry["email_id"] for entry in entries}]
+        if stale and self.apply_deletions:
+            stats["removed_emails"] += sum(self.email_db.delete_many(stale))
+        elif stale:
+            print(f"{len(stale)} email(s) in {recipient} were stored from files that have since changed: {', '.join(stale)}")
+    
+    def _apply_deletions(self, recipient, mailbox_path, stats):
+        """Delete the email of every missing file and the file of every deleted email, then forget them"""
+        flagged = self.email_db.get_flagged_files(recipient)
+        if not flagged:
+            return
+        
+        email_ids = [entry["email_id"] for entry in flagged if entry["status"] == "file_missing" and entry["email_id"]]
+        if email_ids:
+            stats["removed_emails"] += sum(self.email_db.delete_many(email_ids))
+        
+        forgotten = []
+        for entry in flagged:
+            if entry["status"] == "email_deleted":
+                try:
+                    os.remove(os.path.join(mailbox_path, entry["filename"]))
+                    stats["removed_files"] += 1
+                except FileNotFoundError:
+                    pass
+                except OSError as e:
+                    print(f"Error removing {entry['filename']}: {e}")
+                    continue
+            forgotten.append(entry["filename"])
+        self.email_db.remove_file_manifest(recipient, forgotten)
+
+def parse_arguments():
+    """Parse command line arguments"""
+    parser = argparse.ArgumentParser(description="Sync the .eml mailboxes with the email database")
+    parser.add_argument("--mailbox-dir", default="mailboxes", help="Directory holding the .eml mailboxes")
+    parser.add_argument("--apply-deletions", action="store_true",
+                        help="Delete emails whose file is gone and files whose email is gone, instead of only listing them")
+    parser.add_argument("--full", action="store_true",
+                        help="List every mailbox directory and fingerprint every file, even where mtimes are "
+                             "unchanged; needed to pick up files rewritten in place")
+    
+    return parser.parse_args()
+
+def main():
+    args = parse_arguments()
+    sync = MailboxSync(mailbox_dir=args.mailbox_dir, apply_deletions=args.apply_deletions, full=args.full)
+    
+    started = time.monotonic()
+    stats = sync.run_once()
+    
+    print(f"Synced {stats['mailboxes']} mailboxes ({stats['scanned']} changed, {stats['skipped']} not listed "
+          f"as unchanged) in {time.monotonic() - started:.2f}s")
+    print(f"Imported: {stats['imported']}, linked to stored emails: {stats['linked']}, changed files: {stats['changed']}")
+    if args.apply_deletions:
+        print(f"Removed emails: {stats['removed_emails']}, removed files: {stats['removed_files']}")
+    
+    if stats["flagged"]:
+        print(f"\n{len(stats['flagged'])} file(s) out of step (run with --apply-deletions to resolve):")
+        for recipient, entry in stats["flagged"]:
+            reason = "file deleted" if entry["status"] == "file_missing" else "email deleted"
+            print(f"  {recipient}: {entry['filename']} ({reason})")
+    
+    sync.email_db.close()
+
+if __name__ == "__main__":
+    main() 
\ No newline at end of file
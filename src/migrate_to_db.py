@@ -1,77 +1,267 @@
 #!/usr/bin/env python3
 import os
-import glob
-import email
-from email.policy import default
-from email_db import EmailDatabase
+import time
+import signal
+import argparse
+import collections
+import multiprocessing
+from email_db import PARSE_LIMIT, EmailDatabase
+from sharded_db import open_email_database
+from mailbox_sync import file_fingerprint, mailbox_address
 
-def migrate_emails_to_db():
+# Most emails and raw bytes stored per transaction
+BATCH_SIZE = 500
+BATCH_BYTES = 64 * 1024 * 1024
+
+# Files handed to a worker process at a time
+CHUNK_SIZE = 64
+
+# Seconds between progress lines
+PROGRESS_INTERVAL = 5
+
+def list_pending(db, mailboxes_dir, restart=False):
+    """Yield (mailbox, file name) for every .eml file not yet in its mailbox's file manifest, in name order"""
+    # The manifest rows written after every batch are the checkpoint: a file
+    # is skipped once its email is committed, whatever its name or mtime
+    for mailbox in sorted(os.listdir(mailboxes_dir)):
+        mailbox_path = os.path.join(mailboxes_dir, mailbox)
+        if not os.path.isdir(mailbox_path):
+            continue
+        
+        done = set() if restart else set(db.get_file_manifest(mailbox_address(mailbox)) or ())
+        with os.scandir(mailbox_path) as entries:
+            names = sorted(entry.name for entry in entries if entry.name.endswith(".eml") and entry.is_file())
+        for name in names:
+            if name not in done:
+                yield mailbox, name
+
+def ignore_interrupts():
+    """Leave Ctrl+C to the writer process, which stops the pool itself"""
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+
+def parse_email_files(mailboxes_dir, tasks):
+    """Read and parse files in a worker process; each gives (mailbox, name, row, (size, mtime_ns), error)"""
+    results = []
+    for mailbox, name in tasks:
+        path = os.path.join(mailboxes_dir, mailbox, name)
+        try:
+            # Large messages are streamed by the writer instead of copied between processes
+            if os.path.getsize(path) > PARSE_LIMIT:
+                results.append((mailbox, name, None, None, None))
+                continue
+            with open(path, 'rb') as f:
+                stat = os.fstat(f.fileno())
+                row = EmailDatabase.build_email_row(mailbox_address(mailbox), f.read())
+            results.append((mailbox, name, row, (stat.st_size, stat.st_mtime_ns), None))
+        except Exception as e:
+            results.append((mailbox, name, None, None, str(e)))
+    return results
+
+def format_duration(seconds):
+    """Render seconds as 1h02m, 3m05s or 42s"""
+    seconds = int(seconds)
+    if seconds >= 3600:
+        return f"{seconds // 3600}h{seconds % 3600 // 60:02d}m"
+    if seconds >= 60:
+        return f"{seconds // 60}m{seconds % 60:02d}s"
+    return f"{seconds}s"
+
+class Migration:
+    """Copy the file mailboxes into the database: worker processes parse, this process writes in large batches"""
+    
+    def __init__(self, db, mailboxes_dir="mailboxes", workers=None, batch_size=BATCH_SIZE, restart=False):
+        """Prepare a run; workers defaults to one per CPU, and 1 parses in this process.
+        restart goes through files already recorded in the manifest again"""
+        self.db = db
+        self.mailboxes_dir = mailboxes_dir
+        self.workers = workers or os.cpu_count() or 1
+        self.batch_size = batch_size
+        self.restart = restart
+        
+        self.total = 0
+        self.processed = 0
+        self.migrated = 0
+        self.failed = 0
+        self.bytes = 0
+        self.started = None
+        self.reported = 0
+        
+        # Parsed rows waiting for the next commit with their files
+        self.rows = []
+        self.files = []
+        self.rows_bytes = 0
+    
+    def run(self):
+        """Migrate every file missing from the manifest and return the counters"""
+        self.total = sum(1 for _ in list_pending(self.db, self.mailboxes_dir, self.restart))
+        self.started = time.monotonic()
+        self.reported = self.started
+        if self.total:
+            print(f"Migrating {self.total} emails with {self.workers} parser process(es)...")
+        
+        tasks = list_pending(self.db, self.mailboxes_dir, self.restart)
+        if self.workers > 1:
+            with multiprocessing.Pool(self.workers, initializer=ignore_interrupts) as pool:
+                self._run_pool(pool, tasks)
+        else:
+            for chunk in self._chunks(tasks):
+                self._write(parse_email_files(self.mailboxes_dir, chunk))
+        
+        self._flush()
+        if self.total:
+            self._report()
+        return {"total": self.total, "migrated": self.migrated, "failed": self.failed,
+                "seconds": time.monotonic() - self.started}
+    
+    def _chunks(self, tasks):
+        """Group tasks into lists of CHUNK_SIZE"""
+        chunk = []
+        for task in tasks:
+            chunk.append(task)
+            if len(chunk) == CHUNK_SIZE:
+                yield chunk
+                chunk = []
+        if chunk:
+            yield chunk
+    
+    def _run_pool(self, pool, tasks):
+        """Keep the workers busy a few chunks ahead while writing results in file order"""
+        # Bounding the chunks in flight bounds memory when the writer is the slower side
+        pending = collections.deque()
+        for chunk in self._chunks(tasks):
+            pending.append(pool.apply_async(parse_email_files, (self.mailboxes_dir, chunk)))
+            if len(pending) >= self.workers * 4:
+                self._write(pending.popleft().get())
+        while pending:
+            self._write(pending.popleft().get())
+    
+    def _write(self, results):
+        """Queue parsed rows for the next batch, committing whenever it is full"""
+        for mailbox, name, row, stat, error in results:
+            self.processed += 1
+            if error is not None:
+                self.failed += 1
+                print(f"Failed to migrate {os.path.join(mailbox, name)}: {error}")
+            elif row is None:
+                self._store_large(mailbox, name)
+            else:
+                self.rows.append(row)
+                self.files.append((mailbox, name, stat))
+                self.rows_bytes += row["size"]
+            
+            if len(self.rows) >= self.batch_size or self.rows_bytes >= BATCH_BYTES:
+                self._flush()
+        
+        if time.monotonic() - self.reported >= PROGRESS_INTERVAL:
+            self._report()
+    
+    def _store_large(self, mailbox, name):
+        """Stream a message too large to parse in full, after committing the rows before it"""
+        self._flush()
+        path = os.path.join(self.mailboxes_dir, mailbox, name)
+        with open(path, 'rb') as f:
+            email_id = self.db.store_email_stream(mailbox_address(mailbox), f)
+        if email_id:
+            self.migrated += 1
+            self.bytes += os.path.getsize(path)
+            entry = dict(file_fingerprint(path), filename=name, email_id=email_id)
+            self.db.update_file_manifest(mailbox_address(mailbox), [entry])
+        else:
+            self.failed += 1
+            print(f"Failed to migrate {os.path.join(mailbox, name)}")
+    
+    def _flush(self):
+        """Commit the queued rows in one transaction, then record their files in the manifest"""
+        if self.rows:
+            ids = self.db.store_rows(self.rows)
+            if not any(ids):
+                # Nothing reached the manifest, so the next run retries this batch
+                raise RuntimeError("Storing a batch failed; run the migration again to resume")
+            # The manifest is the checkpoint, and mailbox_sync.py never reads these files again.
+            # Should the run stop before it is written, the next run stores the files again
+            # and duplicate detection maps them to the emails already stored
+            manifest = {}
+            for row, (mailbox, name, stat), email_id in zip(self.rows, self.files, ids):
+                if email_id:
+                    self.migrated += 1
+                    self.bytes += row["size"]
+                    manifest.setdefault(row["recipient"], []).append({
+                        "filename": name, "size": stat[0], "mtime_ns": stat[1],
+                        "content_hash": row["content_hash"], "email_id": email_id
+                    })
+                else:
+                    self.failed += 1
+                    print(f"Failed to migrate {os.path.join(mailbox, name)}")
+            for recipient, entries in manifest.items():
+                self.db.update_file_manifest(recipient, entries)
+        
+        self.rows = []
+        self.files = []
+        self.rows_bytes = 0
+    
+    def _report(self):
+        """Print progress, throughput and the estimated time left"""
+        self.reported = time.monotonic()
+        elapsed = max(self.reported - self.started, 1e-6)
+        rate = self.processed / elapsed
+        eta = (self.total - self.processed) / rate if rate else 0
+        print(f"{self.processed}/{self.total} emails ({self.processed * 100 // self.total}%), "
+              f"{rate:.0f} emails/s, {self.bytes / elapsed / 1024 / 1024:.1f} MB/s, "
+              f"elapsed {format_duration(elapsed)}, ETA {format_duration(eta)}")
+
+def migrate_emails_to_db(mailboxes_dir="mailboxes", workers=None, batch_size=BATCH_SIZE, restart=False, profile=None):
     """Migrate emails from file-based storage to the database"""
     print("Starting email migration from file system to database...")
     
-    # Initialize the database
-    db = EmailDatabase()
-    
-    # Get all mailboxes
-    mailboxes_dir = "mailboxes"
     if not os.path.exists(mailboxes_dir):
         print("No mailboxes directory found. Nothing to migrate.")
         return
     
-    mailboxes = os.listdir(mailboxes_dir)
-    if not mailboxes:
-        print("No mailboxes found. Nothing to migrate.")
-        return
+    # Initialize the database
+    db = open_email_database(profile=profile)
+    migration = Migration(db, mailboxes_dir, workers, batch_size, restart)
     
-    total_emails = 0
-    total_migrated = 0
+    try:
+        result = migration.run()
+    except (KeyboardInterrupt, RuntimeError) as e:
+        # Everything committed so far is in the file manifest
+        print(f"\n{str(e) or 'Interrupted'}. Run again to migrate the remaining files.")
+        return
+    finally:
+        db.close()
     
-    # Process each mailbox
-    for mailbox_dir in mailboxes:
-        # Convert mailbox name to email address
-        email_address = mailbox_dir.replace('_at_', '@').replace('_dot_', '.')
-        mailbox_path = os.path.join(mailboxes_dir, mailbox_dir)
-        
-        if not os.path.isdir(mailbox_path):
-            continue
-        
-        # Get all .eml files in the mailbox
-        email_files = glob.glob(os.path.join(mailbox_path, "*.eml"))
-        
-        if not email_files:
-            print(f"No emails found in mailbox for {email_address}. Skipping.")
-            continue
-        
-        print(f"Migrating {len(email_files)} emails for {email_address}...")
-        
-        # Process each email file
-        for email_file in email_files:
-            total_emails += 1
-            try:
-                with open(email_file, 'rb') as f:
-                    # Read the email data
-                    message_data = f.read()
-                    
-                    # Store in database
-                    email_id = db.store_email(email_address, message_data)
-                    
-                    if email_id:
-                        total_migrated += 1
-                        print(f"Migrated: {os.path.basename(email_file)} -> {email_id}")
-                    else:
-                        print(f"Failed to migrate: {email_file}")
-            except Exception as e:
-                print(f"Error migrating {email_file}: {e}")
+    if not result["total"]:
+        print("Every file is already in the database. Nothing to migrate.")
+        return
     
     # Print results
     print("\nMigration completed.")
-    print(f"Total emails processed: {total_emails}")
-    print(f"Successfully migrated: {total_migrated}")
-    print(f"Failed migrations: {total_emails - total_migrated}")
+    print(f"Total emails processed: {result['total']}")
+    print(f"Successfully migrated: {result['migrated']}")
+    print(f"Failed migrations: {result['failed']}")
+    if result["failed"]:
+        print("Failed files are not recorded as migrated and are retried on the next run.")
+    print(f"Time taken: {format_duration(result['seconds'])}")
     
-    if total_migrated > 0:
+    if result["migrated"] > 0:
         print("\nEmails are now available in both the database and file system.")
         print("You can use the --use-db flag with mail_reader.py to read from the database.")
 
+def parse_arguments():
+    """Parse command line arguments"""
+    parser = argparse.ArgumentParser(description="Copy file mailboxes into the email database")
+    parser.add_argument("--mailboxes-dir", default="mailboxes", help="Directory holding the .eml mailboxes")
+    parser.add_argument("--workers", type=int, help="Parser processes (default: one per CPU)")
+    parser.add_argument("--batch-size", type=int, default=BATCH_SIZE, help="Emails stored per transaction")
+    parser.add_argument("--restart", action="store_true",
+                        help="Go through every file again, including those the file manifest records as migrated")
+    parser.add_argument("--profile", help="Database PRAGMA profile, e.g. throughput for a one-off bulk load")
+    
+    return parser.parse_args()
+
+def main():
+    args = parse_arguments()
+    migrate_emails_to_db(args.mailboxes_dir, args.workers, args.batch_size, args.restart, args.profile)
+
 if __name__ == "__main__":
-    migrate_emails_to_db() 
\ No newline at end of file
+    main() 
\ No newline at end of file
@@ -0,0 +1,171 @@
+#!/usr/bin/env python3
+import os
+import time
+import argparse
+from email_db import EmailDatabase
+from sharded_db import (SHARD_DIR, SHARD_STRATEGIES, ShardedEmailDatabase,
+                        load_layout, save_layout, shard_index, shard_path)
+
+def source_paths(source):
+    """Database files of a single database or of an existing shard directory"""
+    layout = load_layout(source) if os.path.isdir(source) else None
+    if layout:
+        return [shard_path(source, index) for index in range(layout["count"])]
+    return [source]
+
+class ShardRebalancer:
+    """Moves whole mailboxes into the shard a new layout assigns them to"""
+    
+    def __init__(self, sources, shard_dir=SHARD_DIR, shard_count=4, shard_by="recipient",
+                 batch_size=500, pause=0.05):
+        """Create a rebalancer; batch_size and pause keep each write transaction short"""
+        self.sources = sources
+        self.shard_dir = shard_dir
+        self.shard_count = shard_count
+        self.shard_by = shard_by
+        self.batch_size = batch_size
+        self.pause = pause
+        self.databases = {}
+    
+    def _open(self, path):
+        """Open each file once, so a file that is both source and target shares a pool"""
+        if path not in self.databases:
+            self.databases[path] = EmailDatabase(path)
+        return self.databases[path]
+    
+    def plan(self):
+        """List the (recipient, source, target, messages) moves the new layout needs"""
+        moves = []
+        for path in self.sources:
+            if not os.path.exists(path):
+                continue
+            
+            for summary in self._open(path).get_mailbox_summary():
+                target = shard_path(self.shard_dir, shard_index(summary["recipient"], self.shard_count, self.shard_by))
+                if os.path.abspath(target) != os.path.abspath(path):
+                    moves.append((summary["recipient"], path, target, summary["total"]))
+        return moves
+    
+    def move_mailbox(self, recipient, source_path, target_path):
+        """Copy a mailbox batch by batch, deleting each batch from the source once it is stored"""
+        source = self._open(source_path)
+        target = self._open(target_path)
+        
+        # The source has no default quotas, so this is the mailbox's own override
+        max_messages, max_bytes = source.get_quota(recipient)
+        if max_messages is not None or max_bytes is not None:
+            target.set_quota(recipient, max_messages, max_bytes)
+        
+        # Copies get modseqs above anything a client saw on the source
+        target.raise_modseq(recipient, source.get_modseq(recipient))
+        
+        moved = 0
+        for rows in source.export_mailbox(recipient, self.batch_size):
+            # Copies skip ids the target already has, so an interrupted run can be repeated
+            if target.import_rows(rows) is None:
+                raise RuntimeError(f"Could not copy {recipient} to {target_path}")
+            source.delete_many([row["id"] for row in rows])
+            moved += len(rows)
+            time.sleep(self.pause)
+        
+        # Tombstones, file manifest and sync state follow once every email is on the target
+        state = source.export_mailbox_state(recipient)
+        if state is None or not target.import_mailbox_state(recipient, state):
+            raise RuntimeError(f"Could not copy the sync state of {recipient} to {target_path}")
+        source.remove_mailbox_state(recipient)
+        return moved
+    
+    def remove_unused_shards(self):
+        """Delete shard files beyond the new shard count once they are empty"""
+        removed = []
+        for path in list(self.databases):
+            if os.path.dirname(os.path.abspath(path)) != os.path.abspath(self.shard_dir):
+                continue
+            if path in [shard_path(self.shard_dir, index) for index in range(self.shard_count)]:
+                continue
+            if self.databases[path].get_recipients():
+                continue
+            
+            self.databases.pop(path).close()
+            for suffix in ("", "-wal", "-shm"):
+                if os.path.exists(path + suffix):
+                    os.remove(path + suffix)
+            removed.append(path)
+        return removed
+    
+    def run(self, dry_run=False):
+        """Move every mailbox that is on the wrong shard and record the new layout"""
+        moves = self.plan()
+        for recipient, source_path, target_path, messages in moves:
+            print(f"  {recipient}: {messages} emails {source_path} -> {target_path}")
+            if not dry_run:
+                self.move_mailbox(recipient, source_path, target_path)
+        
+        if not dry_run:
+            # Only switch routing once every mailbox is where the layout says
+            save_layout(self.shard_dir, self.shard_count, self.shard_by)
+            for path in self.remove_unused_shards():
+                print(f"  Removed empty shard {path}")
+        return moves
+    
+    def close(self):
+        """Close every database opened during the run"""
+        for database in self.databases.values():
+            database.close()
+
+def parse_arguments():
+    """Parse command line arguments"""
+    parser = argparse.ArgumentParser(description="Split the email database into shards or change the shard layout")
+    
+    parser.add_argument("--source", default="database/emails.db",
+                        help="Single database file or existing shard directory to move mail from")
+    parser.add_argument("--shard-dir", default=SHARD_DIR, help="Directory for the shard files")
+    parser.add_argument("--shards", type=int, required=True, help="Number of shards in the new layout")
+    parser.add_argument("--by", choices=SHARD_STRATEGIES, default="recipient",
+                        help="Route by full address or by domain")
+    parser.add_argument("--batch-size", type=int, default=500, help="Emails moved per transaction")
+    parser.add_argument("--pause", type=float, default=0.05, help="Seconds to sleep between batches")
+    parser.add_argument("--dry-run", action="store_true", help="Only print the mailboxes that would move")
+    
+    return parser.parse_args()
+
+def main():
+    args = parse_arguments()
+    
+    if args.shards < 1:
+        print("--shards must be at least 1")
+        return
+    
+    # Mail already in the shard directory is only rebalanced when it is the source
+    layout = load_layout(args.shard_dir)
+    if layout and os.path.abspath(args.source) != os.path.abspath(args.shard_dir):
+        print(f"{args.shard_dir} already holds {layout['count']} shards; use --source {args.shard_dir} to rebalance them")
+        return
+    
+    rebalancer = ShardRebalancer(
+        source_paths(args.source),
+        shard_dir=args.shard_dir,
+        shard_count=args.shards,
+        shard_by=args.by,
+        batch_size=args.batch_size,
+        pause=args.pause
+    )
+    
+    print(f"Rebalancing into {args.shards} shards by {args.by}{' (dry run)' if args.dry_run else ''}:")
+    try:
+        moves = rebalancer.run(dry_run=args.dry_run)
+    finally:
+        rebalancer.close()
+    
+    print(f"{len(moves)} mailboxes {'would move' if args.dry_run else 'moved'}")
+    if args.dry_run:
+        return
+    
+    db = ShardedEmailDatabase(args.shard_dir)
+    for stats in db.get_shard_stats():
+        print(f"  shard {stats['shard']}: {stats['mailboxes']} mailboxes, "
+              f"{stats['messages']} emails, {stats['bytes']} bytes")
+    db.close()
+
+if __name__ == "__main__":
+    main() 
\ No newline at end of file
@@ -0,0 +1,452 @@
+#!/usr/bin/env python3
+import os
+import json
+import zlib
+from email_db import RAW_CHUNK_SIZE, EmailDatabase
+
+SHARD_DIR = "database/shards"
+LAYOUT_FILE = "shards.json"
+SHARD_STRATEGIES = ("recipient", "domain")
+
+def shard_key(recipient, by="recipient"):
+    """The part of an address that decides its shard"""
+    recipient = recipient.strip().lower()
+    if by == "domain":
+        return recipient.rpartition('@')[2]
+    return recipient
+
+def shard_index(recipient, count, by="recipient"):
+    """Stable shard number for a recipient; the same on every run and platform"""
+    return zlib.crc32(shard_key(recipient, by).encode("utf-8")) % count
+
+def shard_path(shard_dir, index):
+    """Database file of one shard"""
+    return os.path.join(shard_dir, f"emails_{index}.db")
+
+def load_layout(shard_dir=SHARD_DIR):
+    """Read the shard count and strategy, or None when the directory is not sharded"""
+    layout_path = os.path.join(shard_dir, LAYOUT_FILE)
+    if not os.path.exists(layout_path):
+        return None
+    
+    with open(layout_path, 'r') as f:
+        layout = json.load(f)
+    return {"count": int(layout["count"]), "by": layout.get("by", "recipient")}
+
+def save_layout(shard_dir, count, by="recipient"):
+    """Record the shard count and strategy so every process routes the same way"""
+    os.makedirs(shard_dir, exist_ok=True)
+    layout_path = os.path.join(shard_dir, LAYOUT_FILE)
+    
+    # Write a new file and swap it in so readers never see half a layout
+    with open(layout_path + ".tmp", 'w') as f:
+        json.dump({"count": count, "by": by}, f)
+    os.replace(layout_path + ".tmp", layout_path)
+
+def is_sharded(shard_dir=SHARD_DIR):
+    """True when sharding is configured in .env or a shard layout exists on disk"""
+    return int(os.getenv("EMAIL_DB_SHARDS", "0") or 0) > 1 or load_layout(shard_dir) is not None
+
+def database_available(db_path="database/emails.db", shard_dir=SHARD_DIR):
+    """True when mail is stored in the single database or in shards"""
+    return os.path.exists(db_path) or is_sharded(shard_dir)
+
+def open_email_database(shard_dir=SHARD_DIR, db_path="database/emails.db", **kwargs):
+    """Open the sharded facade when sharding is enabled, otherwise the single database"""
+    if is_sharded(shard_dir):
+        return ShardedEmailDatabase(shard_dir, **kwargs)
+    return EmailDatabase(db_path, **kwargs)
+
+class ShardedEmailDatabase:
+    """EmailDatabase facade that spreads mailboxes over several SQLite files, each with its own write lock"""
+    
+    def __init__(self, shard_dir=SHARD_DIR, shard_count=None, shard_by=None, **kwargs):
+        """Open every shard; an existing layout on disk wins over the arguments"""
+        layout = load_layout(shard_dir)
+        if layout is None:
+            count = shard_count or int(os.getenv("EMAIL_DB_SHARDS", "0") or 0) or 1
+            by = shard_by or os.getenv("EMAIL_DB_SHARD_BY", "recipient")
+            if by not in SHARD_STRATEGIES:
+                raise ValueError(f"Unknown shard strategy: {by}")
+            save_layout(shard_dir, count, by)
+            layout = {"count": count, "by": by}
+        elif (shard_count and shard_count != layout["count"]) or (shard_by and shard_by != layout["by"]):
+            raise ValueError(f"{shard_dir} is laid out as {layout['count']} shards by {layout['by']}; "
+                             f"use shard_rebalance.py to change it")
+        
+        self.shard_dir = shard_dir
+        self.shard_count = layout["count"]
+        self.shard_by = layout["by"]
+        self.shards = [
+            EmailDatabase(shard_path(shard_dir, index), **kwargs)
+            for index in range(self.shard_count)
+        ]
+    
+    def shard_for(self, recipient):
+        """The shard that holds a recipient's mailbox"""
+        return self.shards[shard_index(recipient, self.shard_count, self.shard_by)]
+    
+    def _shard_for_id(self, email_id):
+        """The shard that holds an email id, or None"""
+        # An email opened before is in its shard's message cache
+        for shard in self.shards:
+            if email_id in shard.message_cache:
+                return shard
+        
+        for shard in self.shards:
+            if email_id in shard.existing_ids([email_id]):
+                return shard
+        return None
+    
+    def _group_ids(self, email_ids):
+        """Split email ids by the shard that holds them"""
+        remaining = set(email_ids)
+        groups = []
+        for shard in self.shards:
+            if not remaining:
+                break
+            found = shard.existing_ids(remaining)
+            if found:
+                groups.append((shard, found))
+                remaining -= found
+        return groups
+    
+    # Mailbox operations go to the recipient's shard
+    
+    def store_email(self, recipient, message_data):
+        """Store an email in the recipient's shard"""
+        return self.shard_for(recipient).store_email(recipient, message_data)
+    
+    def deliver_email(self, recipient, message_data):
+        """Store an email in the recipient's shard and return (id, created)"""
+        return self.shard_for(recipient).deliver_email(recipient, message_data)
+    
+    def store_many(self, items):
+        """Store (recipient, message_data) pairs with one transaction per shard"""
+        items = list(items)
+        results = [None] * len(items)
+        
+        # Group item positions by shard
+        batches = {}
+        for position, (recipient, _) in enumerate(items):
+            index = shard_index(recipient, self.shard_count, self.shard_by)
+            batches.setdefault(index, []).append(position)
+        
+        for index, positions in batches.items():
+            stored = self.shards[index].store_many([items[position] for position in positions])
+            for position, email_id in zip(positions, stored):
+                results[position] = email_id
+        return results
+    
+    def store_rows(self, rows):
+        """Store rows built by EmailDatabase.build_email_row with one transaction per shard"""
+        results = [None] * len(rows)
+        
+        # Group row positions by shard
+        batches = {}
+        for position, row in enumerate(rows):
+            index = shard_index(row["recipient"], self.shard_count, self.shard_by)
+            batches.setdefault(index, []).append(position)
+        
+        for index, positions in batches.items():
+            stored = self.shards[index].store_rows([rows[position] for position in positions])
+            for position, email_id in zip(positions, stored):
+                results[position] = email_id
+        return results
+    
+    def store_email_stream(self, recipient, stream, received_date=None, is_read=False):
+        """Stream a message from a file object into the recipient's shard"""
+        return self.shard_for(recipient).store_email_stream(recipient, stream, received_date, is_read)
+    
+    def get_mailbox(self, email_address, limit=50, offset=0):
+        """Get emails for a specific mailbox (recipient)"""
+        return self.shard_for(email_address).get_mailbox(email_address, limit, offset)
+    
+    def get_mailbox_page(self, email_address, limit=50, page_token=None):
+        """Get one page of a mailbox and the token for the next one"""
+        return self.shard_for(email_address).get_mailbox_page(email_address, limit, page_token)
+    
+    def get_emails_between(self, recipient, start=None, end=None, limit=50):
+        """Get a mailbox's emails received in [start, end), newest first"""
+        return self.shard_for(recipient).get_emails_between(recipient, start, end, limit)
+    
+    def get_emails_since(self, recipient, since, limit=50):
+        """Get a mailbox's emails received at or after since"""
+        return self.shard_for(recipient).get_emails_since(recipient, since, limit)
+    
+    def get_emails_before(self, recipient, before, limit=50):
+        """Get a mailbox's emails received before a moment"""
+        return self.shard_for(recipient).get_emails_before(recipient, before, limit)
+    
+    def find_emails(self, recipient=None, limit=50, **filters):
+        """Get emails matching header filters from the recipient's shard, or newest first from every shard"""
+        if recipient is not None:
+            return self.shard_for(recipient).find_emails(recipient, limit=limit, **filters)
+        
+        emails = []
+        for shard in self.shards:
+            emails.extend(shard.find_emails(limit=limit, **filters))
+        emails.sort(key=lambda row: (row["received_date"], row["id"]), reverse=True)
+        return emails[:limit]
+    
+    def get_emails_from_domain(self, domain, since=None, before=None, recipient=None, limit=50):
+        """Get emails whose From address is at a domain, newest first"""
+        return self.find_emails(recipient, limit, sender_domain=domain, since=since, before=before)
+    
+    def get_large_emails(self, min_size, recipient=None, limit=50):
+        """Get emails of at least min_size bytes, newest first"""
+        return self.find_emails(recipient, limit, min_size=min_size)
+    
+    def get_threads(self, recipient, limit=50, page_token=None):
+        """Get one page of a mailbox's conversations and the next page token"""
+        return self.shard_for(recipient).get_threads(recipient, limit, page_token)
+    
+    def get_thread_messages(self, recipient, thread_id):
+        """Get the emails of one conversation in a mailbox"""
+        return self.shard_for(recipient).get_thread_messages(recipient, thread_id)
+    
+    def mark_all_read(self, recipient):
+        """Mark every email in a mailbox as read and return how many changed"""
+        return self.shard_for(recipient).mark_all_read(recipient)
+    
+    def search_emails(self, recipient, query, limit=50, offset=0):
+        """Full-text search within one mailbox"""
+        return self.shard_for(recipient).search_emails(recipient, query, limit, offset)
+    
+    def query_emails(self, recipient, query, limit=50, offset=0):
+        """Structured search within one mailbox"""
+        return self.shard_for(recipient).query_emails(recipient, query, limit, offset)
+    
+    def delete_older_than(self, recipient, cutoff, batch_size=500):
+        """Delete up to batch_size expired emails of a mailbox"""
+        return self.shard_for(recipient).delete_older_than(recipient, cutoff, batch_size)
+    
+    def export_mailbox(self, recipient, batch_size=500, include_content=True):
+        """Yield a mailbox's rows in batches from its shard"""
+        return self.shard_for(recipient).export_mailbox(recipient, batch_size, include_content)
+    
+    def get_modseq(self, recipient):
+        """Highest modseq of a mailbox"""
+        return self.shard_for(recipient).get_modseq(recipient)
+    
+    def changes_since(self, recipient, modseq):
+        """Rows changed and ids deleted in a mailbox after modseq"""
+        return self.shard_for(recipient).changes_since(recipient, modseq)
+    
+    def get_sync_state(self, recipient):
+        """Directory mtime and modseq recorded by the last sync of a mailbox"""
+        return self.shard_for(recipient).get_sync_state(recipient)
+    
+    def set_sync_state(self, recipient, dir_mtime_ns, modseq):
+        """Record how far a mailbox has been synced"""
+        return self.shard_for(recipient).set_sync_state(recipient, dir_mtime_ns, modseq)
+    
+    def get_file_manifest(self, recipient):
+        """Manifest rows of a mailbox keyed by filename"""
+        return self.shard_for(recipient).get_file_manifest(recipient)
+    
+    def update_file_manifest(self, recipient, entries):
+        """Insert or replace manifest rows of a mailbox"""
+        return self.shard_for(recipient).update_file_manifest(recipient, entries)
+    
+    def set_manifest_status(self, recipient, filenames, status):
+        """Flag manifest rows of a mailbox"""
+        return self.shard_for(recipient).set_manifest_status(recipient, filenames, status)
+    
+    def flag_deleted_emails(self, recipient, email_ids=None):
+        """Flag the manifest rows of deleted emails"""
+        return self.shard_for(recipient).flag_deleted_emails(recipient, email_ids)
+    
+    def get_flagged_files(self, recipient):
+        """Manifest rows of a mailbox whose file or email has gone"""
+        return self.shard_for(recipient).get_flagged_files(recipient)
+    
+    def remove_file_manifest(self, recipient, filenames):
+        """Forget manifest rows of a mailbox"""
+        return self.shard_for(recipient).remove_file_manifest(recipient, filenames)
+    
+    def get_usage(self, recipient):
+        """Get message count, bytes and unread count for a mailbox"""
+        return self.shard_for(recipient).get_usage(recipient)
+    
+    def set_quota(self, recipient, max_messages=None, max_bytes=None):
+        """Set a mailbox's quota on its shard"""
+        return self.shard_for(recipient).set_quota(recipient, max_messages, max_bytes)
+    
+    def get_quota(self, recipient):
+        """Get the effective quota for a mailbox as (max_messages, max_bytes)"""
+        return self.shard_for(recipient).get_quota(recipient)
+    
+    def is_over_quota(self, recipient, incoming_bytes=0):
+        """Check whether accepting another message would exceed the mailbox quota"""
+        return self.shard_for(recipient).is_over_quota(recipient, incoming_bytes)
+    
+    # Lookups by id find the shard that holds the row
+    
+    def get_email(self, email_id, include_raw=False):
+        """Get a specific email by ID from whichever shard holds it"""
+        shard = self._shard_for_id(email_id)
+        return shard.get_email(email_id, include_raw) if shard else None
+    
+    def get_raw_email(self, email_id):
+        """Get the original message bytes of an email"""
+        shard = self._shard_for_id(email_id)
+        return shard.get_raw_email(email_id) if shard else None
+    
+    def get_headers(self, email_id):
+        """Get the indexed header fields of an email"""
+        shard = self._shard_for_id(email_id)
+        return shard.get_headers(email_id) if shard else None
+    
+    def open_raw_email(self, email_id):
+        """Open the original message as a read-only file object, or return None"""
+        shard = self._shard_for_id(email_id)
+        return shard.open_raw_email(email_id) if shard else None
+    
+    def get_attachments(self, email_id):
+        """List an email's attachments from the catalog"""
+        shard = self._shard_for_id(email_id)
+        return shard.get_attachments(email_id) if shard else []
+    
+    def stream_attachment(self, email_id, part_index, chunk_size=RAW_CHUNK_SIZE):
+        """Get an iterator over one attachment's decoded bytes, or None"""
+        shard = self._shard_for_id(email_id)
+        return shard.stream_attachment(email_id, part_index, chunk_size) if shard else None
+    
+    def get_attachment(self, email_id, part_index):
+        """Get one attachment's decoded bytes, or None"""
+        shard = self._shard_for_id(email_id)
+        return shard.get_attachment(email_id, part_index) if shard else None
+    
+    def mark_as_read(self, email_id):
+        """Mark an email as read"""
+        shard = self._shard_for_id(email_id)
+        return shard.mark_as_read(email_id) if shard else True
+    
+    def delete_email(self, email_id):
+        """Delete an email from the database"""
+        shard = self._shard_for_id(email_id)
+        return shard.delete_email(email_id) if shard else True
+    
+    def mark_read_many(self, email_ids):
+        """Mark several emails as read, one transaction per shard"""
+        email_ids = list(email_ids)
+        done = set()
+        for shard, found in self._group_ids(email_ids):
+            found = list(found)
+            done.update(email_id for email_id, ok in zip(found, shard.mark_read_many(found)) if ok)
+        return [email_id in done for email_id in email_ids]
+    
+    def delete_many(self, email_ids):
+        """Delete several emails, one transaction per shard"""
+        email_ids = list(email_ids)
+        done = set()
+        for shard, found in self._group_ids(email_ids):
+            found = list(found)
+            done.update(email_id for email_id, ok in zip(found, shard.delete_many(found)) if ok)
+        return [email_id in done for email_id in email_ids]
+    
+    def existing_ids(self, email_ids):
+        """Return the subset of email_ids stored on any shard"""
+        email_ids = set(email_ids)
+        found = set()
+        for shard in self.shards:
+            found |= shard.existing_ids(email_ids - found)
+        return found
+    
+    def deleted_ids(self, recipient, email_ids):
+        """Return the subset of email_ids deleted on any shard and stored on none"""
+        # A rebalance interrupted before it moved a mailbox's tombstones leaves them on its old shard
+        deleted = set()
+        for shard in self.shards:
+            deleted |= shard.deleted_ids(recipient, email_ids)
+        return deleted - self.existing_ids(deleted)
+    
+    # Admin queries combine the results of every shard
+    
+    def get_recipients(self):
+        """Get every recipient that has at least one stored email"""
+        recipients = []
+        for shard in self.shards:
+            recipients.extend(shard.get_recipients())
+        return recipients
+    
+    def get_mailbox_summary(self, recipient=None):
+        """Get one mailbox's summary, or the summaries of every mailbox on every shard"""
+        if recipient is not None:
+            return self.shard_for(recipient).get_mailbox_summary(recipient)
+        
+        summaries = []
+        for shard in self.shards:
+            summaries.extend(shard.get_mailbox_summary())
+        return sorted(summaries, key=lambda summary: summary["recipient"])
+    
+    def get_all_usage(self, limit=50):
+        """Get usage for the largest mailboxes across all shards, biggest first"""
+        usage = []
+        for shard in self.shards:
+            usage.extend(shard.get_all_usage(limit))
+        usage.sort(key=lambda row: row["total_bytes"], reverse=True)
+        return usage[:limit]
+    
+    def get_shard_stats(self):
+        """Messages, bytes and mailboxes held by each shard"""
+        stats = []
+        for index, shard in enumerate(self.shards):
+            summaries = shard.get_mailbox_summary()
+            stats.append({
+                "shard": index,
+                "path": shard.db_path,
+                "mailboxes": len(summaries),
+                "messages": sum(summary["total"] for summary in summaries),
+                "bytes": sum(summary["bytes"] for summary in summaries),
+            })
+        return stats
+    
+    def get_cache_stats(self):
+        """Message cache counters summed over every shard"""
+        totals = {}
+        for shard in self.shards:
+            for name, value in shard.get_cache_stats().items():
+                totals[name] = totals.get(name, 0) + value
+        return totals
+    
+    def prune_tombstones(self, cutoff, batch_size=500):
+        """Delete up to batch_size old tombstones per shard and return how many were removed"""
+        return sum(shard.prune_tombstones(cutoff, batch_size) for shard in self.shards)
+    
+    def rebuild_search_index(self):
+        """Rebuild the full-text index of every shard"""
+        return all([shard.rebuild_search_index() for shard in self.shards])
+    
+    def checkpoint(self, mode="PASSIVE"):
+        """Checkpoint every shard and return the combined (busy, wal_pages, checkpointed_pages)"""
+        results = [shard.checkpoint(mode) for shard in self.shards]
+        if None in results:
+            return None
+        return (
+            max(result[0] for result in results),
+            sum(result[1] for result in results),
+            sum(result[2] for result in results),
+        )
+    
+    def get_wal_size(self):
+        """Size of the largest write-ahead log among the shards"""
+        return max(shard.get_wal_size() for shard in self.shards)
+    
+    def get_auto_vacuum_mode(self):
+        """The auto_vacuum mode shared by every shard (the lowest if they differ)"""
+        return min(shard.get_auto_vacuum_mode() for shard in self.shards)
+    
+    def enable_incremental_vacuum(self):
+        """Switch every shard to incremental auto_vacuum"""
+        return all([shard.enable_incremental_vacuum() for shard in self.shards])
+    
+    def incremental_vacuum(self, pages=256):
+        """Release up to `pages` free pages per shard and return how many remain free in total"""
+        return sum(shard.incremental_vacuum(pages) for shard in self.shards)
+    
+    def close(self):
+        """Close every shard"""
+        for shard in self.shards:
+            shard.close() 
\ No newline at end of file
@@ -10,7 +10,8 @@ from email.policy import default
 import logging
 import json
 from dotenv import load_dotenv
-from email_db import EmailDatabase  # Import the EmailDatabase class
+from sharded_db import open_email_database  # Single database or shards, per .env
+from db_maintenance import MaintenanceJob
 
 # Load environment variables
 load_dotenv()
@@ -29,8 +30,13 @@ class MailboxManager:
     def __init__(self, mailbox_dir='mailboxes'):
         self.mailbox_dir = mailbox_dir
         os.makedirs(self.mailbox_dir, exist_ok=True)
-        # Initialize the email database
-        self.email_db = EmailDatabase()
+        # Initialize the email database with the server-wide default quotas
+        quota_messages = os.getenv('MAILBOX_QUOTA_MESSAGES')
+        quota_bytes = os.getenv('MAILBOX_QUOTA_BYTES')
+        self.email_db = open_email_database(
+            default_quota_messages=int(quota_messages) if quota_messages else None,
+            default_quota_bytes=int(quota_bytes) if quota_bytes else None
+        )
     
     def get_user_mailbox_path(self, user_email):
         """Get path to a user's mailbox directory"""
@@ -43,7 +49,12 @@ class MailboxManager:
     def store_email(self, recipient, message_data):
         """Store an email in a recipient's mailbox and database"""
         # Store in the database
-        message_id = self.email_db.store_email(recipient, message_data)
+        message_id, created = self.email_db.deliver_email(recipient, message_data)
+        
+        # A repeated delivery is already in the database and on disk
+        if message_id and not created:
+            logger.info(f"Skipped duplicate email for {recipient} with ID {message_id}")
+            return message_id
         
         # Also keep the file-based storage for backward compatibility
         mailbox_path = self.get_user_mailbox_path(recipient)
@@ -62,8 +73,28 @@ class MailboxManager:
         logger.info(f"Stored email for {recipient} with ID {message_id}")
         return message_id
 
+    def is_over_quota(self, recipient):
+        """Check whether a recipient's mailbox is full"""
+        return self.email_db.is_over_quota(recipient)
+
+class QuotaSMTPChannel(smtpd.SMTPChannel):
+    """SMTP channel that refuses recipients whose mailbox is over quota"""
+    def smtp_RCPT(self, arg):
+        """Reject full mailboxes with 452 before the client sends any data"""
+        if self.seen_greeting and self.mailfrom and arg:
+            address, _ = self._getaddr(self._strip_command_keyword('TO:', arg))
+            if address and self.smtp_server.mailbox_manager.is_over_quota(address):
+                logger.info(f"Rejected recipient {address}: mailbox over quota")
+                self.push('452 4.2.2 Mailbox over quota')
+                return
+        
+        # Everything else, including syntax errors, is handled by smtpd
+        super().smtp_RCPT(arg)
+
 class CustomSMTPServer(smtpd.SMTPServer):
     """Custom SMTP Server that handles email receiving and processing"""
+    channel_class = QuotaSMTPChannel
+    
     def __init__(self, localaddr, remoteaddr):
         super().__init__(localaddr, remoteaddr)
         self.mailbox_manager = MailboxManager()
@@ -117,6 +148,16 @@ def main():
     logger.info(f"Starting SMTP server on {host}:{port}")
     server = CustomSMTPServer((host, port), None)
     
+    # Optionally run retention and compaction in the background
+    maintenance_interval = int(os.getenv('MAINTENANCE_INTERVAL', 0))
+    if maintenance_interval > 0:
+        job = MaintenanceJob(email_db=server.mailbox_manager.email_db)
+        job.start_background(
+            maintenance_interval,
+            on_complete=lambda stats: logger.info(f"Maintenance run completed: {stats}")
+        )
+        logger.info(f"Database maintenance scheduled every {maintenance_interval} seconds")
+    
     try:
         print(f"SMTP Server running on {host}:{port}")
         print("Press Ctrl+C to stop")
@@ -0,0 +1,58 @@
+#!/usr/bin/env python3
+import os
+from mail_archive import export_maildir, export_mbox, import_maildir, import_mbox
+from mail_fixtures import build_message, temp_database, temp_dir
+
+RECIPIENT = "archive@example.com"
+
+def mailbox_state(db, recipient, precision=1):
+    """Sorted (subject, received_date, is_read) of a mailbox, dates cut to precision microseconds"""
+    return sorted((mail["subject"], mail["received_date"] // precision * precision, mail["is_read"])
+                  for mail in db.get_mailbox(recipient))
+
+def check_round_trips(db, copy, work_dir):
+    """Exports to mbox and Maildir import back to the same bytes, dates and read flags"""
+    # Body lines starting with "From " need quoting inside an mbox file;
+    # the last message is above PARSE_LIMIT and is streamed in on its own
+    bodies = ["Plain body\n", "From the start\n>From quoted\n>>From twice\n", "x" * (2 * 1024 * 1024) + "\n"]
+    messages = [build_message(RECIPIENT, i, body=body, sender="Sender <sender@example.com>")
+                for i, body in enumerate(bodies)]
+    ids = [db.store_email(RECIPIENT, message) for message in messages]
+    db.mark_as_read(ids[1])
+    db.mark_as_read(ids[2])
+    raw = sorted(db.get_raw_email(email_id) for email_id in ids)
+
+    # mbox From_ lines carry whole seconds, Maildir mtimes keep every microsecond
+    for label, export, restore, path, precision in (
+            ("mbox", export_mbox, import_mbox, os.path.join(work_dir, "archive.mbox"), 1000000),
+            ("Maildir", export_maildir, import_maildir, os.path.join(work_dir, "Maildir"), 1)):
+        target = f"{label.lower()}@example.com"
+        count, _ = export(db, RECIPIENT, path)
+        archive = restore(copy, target, path)
+        assert (count, archive.imported, archive.failed) == (3, 3, 0), \
+            f"{label} exported {count} and imported {archive.imported} emails ({archive.failed} failed)"
+
+        # The Status header the mbox export adds for read state is taken out again on import
+        copied = sorted(copy.get_raw_email(mail["id"]) for mail in copy.get_mailbox(target))
+        assert copied == raw, f"{label} round trip changed the message bytes"
+
+        found = mailbox_state(copy, target)
+        expected = mailbox_state(db, RECIPIENT, precision)
+        assert found == expected, f"{label} round trip changed dates or read flags: {found} != {expected}"
+
+        # A duplicate of a stored message, large or small, leaves the stored copy's read state alone
+        duplicate_target = f"duplicate-{label.lower()}@example.com"
+        stored = [copy.store_email(duplicate_target, message) for message in messages]
+        archive = restore(copy, duplicate_target, path)
+        states = [copy.get_email(email_id)["is_read"] for email_id in stored]
+        assert len(copy.get_mailbox(duplicate_target)) == 3, f"{label} import stored duplicates"
+        assert not any(states), f"{label} import of duplicates changed read flags: {states}"
+
+def test_mail_archive():
+    """Test that mbox and Maildir exports import back to the same messages, dates and read flags"""
+    with temp_dir() as work_dir, temp_database() as db, temp_database() as copy:
+        check_round_trips(db, copy, work_dir)
+
+if __name__ == "__main__":
+    test_mail_archive()
+    print("Archive tests passed")
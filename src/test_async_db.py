@@ -0,0 +1,37 @@
+#!/usr/bin/env python3
+import asyncio
+from async_email_db import AsyncEmailDatabase
+from mail_fixtures import build_message, temp_database
+
+RECIPIENT = "async@example.com"
+
+async def run_async_database(email_db):
+    """Store, read, mark and delete through the asyncio facade"""
+    async with AsyncEmailDatabase(email_db) as db:
+        # Concurrent deliveries are committed by the writer in batches
+        ids = await asyncio.gather(*[db.store_email(RECIPIENT, build_message(RECIPIENT, i)) for i in range(20)])
+        assert None not in ids, "Failed to store emails"
+        assert len(set(ids)) == 20, "Concurrent deliveries share ids"
+        assert db.batches < 20, "Concurrent deliveries were not batched"
+
+        # Reads run concurrently on reader connections
+        mails = await asyncio.gather(*[db.get_email(email_id) for email_id in ids])
+        assert all(mail is not None for mail in mails), "Failed to read emails back"
+
+        await asyncio.gather(*[db.mark_as_read(email_id) for email_id in ids[:5]])
+        summary = await db.get_mailbox_summary(RECIPIENT)
+        assert (summary["total"], summary["unread"]) == (20, 15), f"Unexpected summary {summary}"
+
+        results = await db.delete_many(ids)
+        assert all(results), "Failed to delete emails"
+        summary = await db.get_mailbox_summary(RECIPIENT)
+        assert summary is None or summary["total"] == 0, f"Emails left after deleting: {summary}"
+
+def test_async_database():
+    """Test the asyncio facade over the email database"""
+    with temp_database() as db:
+        asyncio.run(run_async_database(db))
+
+if __name__ == "__main__":
+    test_async_database()
+    print("Async database tests passed")
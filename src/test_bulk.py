@@ -0,0 +1,45 @@
+#!/usr/bin/env python3
+from mail_fixtures import build_message, temp_database
+
+RECIPIENT = "bulk@example.com"
+UNKNOWN_ID = "no-such-email"
+
+def test_bulk_operations():
+    """Test batch store, mark-read and delete with their per-item results"""
+    with temp_database() as db:
+        # An unparsable item reports None without failing the rest of the batch
+        items = [(RECIPIENT, build_message(RECIPIENT, i)) for i in range(10)]
+        items += [(RECIPIENT, None), ("other@example.com", build_message("other@example.com", 0))]
+        ids = db.store_many(items)
+        assert len(ids) == len(items) and all(ids[:10]) and len(set(ids[:10])) == 10, f"Batch store returned {ids}"
+        assert ids[10] is None and ids[11]
+        assert len(db.get_mailbox(RECIPIENT)) == 10 and len(db.get_mailbox("other@example.com")) == 1
+
+        # Already-read ids are True, unknown ones False
+        db.mark_as_read(ids[0])
+        results = db.mark_read_many([ids[0], ids[1], UNKNOWN_ID, ids[2]])
+        assert results == [True, True, False, True], f"mark_read_many returned {results}"
+        assert db.get_usage(RECIPIENT)["unread_count"] == 7
+
+        # mark_all_read counts only the emails it changed and leaves other mailboxes alone
+        assert db.mark_all_read(RECIPIENT) == 7
+        assert db.mark_all_read(RECIPIENT) == 0
+        assert not any(mail["is_read"] for mail in db.get_mailbox("other@example.com"))
+        assert all(db.get_email(email_id)["is_read"] for email_id in ids[:10])
+
+        results = db.delete_many([ids[4], UNKNOWN_ID, ids[5], ids[4]])
+        assert results == [True, False, True, True], f"delete_many returned {results}"
+        assert len(db.get_mailbox(RECIPIENT)) == 8
+        assert db.get_email(ids[4]) is None and db.get_email(ids[5]) is None
+        assert db.get_usage(RECIPIENT)["message_count"] == 8
+        assert db.delete_many([]) == [] and db.mark_read_many([]) == [] and db.store_many([]) == []
+
+        # A duplicate inside the batch, or of a stored email, reports the stored copy's id
+        repeated = build_message(RECIPIENT, 20)
+        again = db.store_many([(RECIPIENT, repeated), (RECIPIENT, repeated), (RECIPIENT, build_message(RECIPIENT, 0))])
+        assert again[0] and again[1] == again[0] and again[2] == ids[0], f"Duplicates stored again: {again}"
+        assert len(db.get_mailbox(RECIPIENT)) == 9
+
+if __name__ == "__main__":
+    test_bulk_operations()
+    print("Bulk operation tests passed")
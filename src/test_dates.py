@@ -0,0 +1,54 @@
+#!/usr/bin/env python3
+import datetime
+from email_db import from_epoch_us, to_epoch_us
+from mail_fixtures import build_message, temp_database
+
+RECIPIENT = "dates@example.com"
+START = datetime.datetime(2024, 3, 1, 12, 0, 0, tzinfo=datetime.timezone.utc)
+HOUR = datetime.timedelta(hours=1)
+
+def store_hourly(db, count):
+    """Store count emails and date them one hour apart from START"""
+    ids = [db.store_email(RECIPIENT, build_message(RECIPIENT, i)) for i in range(count)]
+    conn = db.pool.acquire()
+    try:
+        conn.executemany("UPDATE emails SET received_date = ? WHERE id = ?",
+                         [(to_epoch_us(START + i * HOUR), email_id) for i, email_id in enumerate(ids)])
+        conn.commit()
+    finally:
+        db.pool.release(conn)
+
+def subjects(emails):
+    """Subjects of a listing in its order"""
+    return [mail["subject"] for mail in emails]
+
+def test_received_dates():
+    """Test epoch microsecond conversions and the date range queries"""
+    # Aware datetimes convert exactly; naive ones are local time; integers pass through
+    moment = START + datetime.timedelta(microseconds=123457)
+    assert to_epoch_us(moment) == 1709294400123457
+    assert from_epoch_us(to_epoch_us(moment)) == moment
+    assert to_epoch_us(moment.astimezone().replace(tzinfo=None)) == to_epoch_us(moment)
+    assert to_epoch_us(1709294400123457) == 1709294400123457
+
+    with temp_database() as db:
+        store_hourly(db, 6)
+        assert all(isinstance(mail["received_date"], int) for mail in db.get_mailbox(RECIPIENT))
+
+        # [start, end) with either side open, newest first, datetimes or epoch integers
+        assert subjects(db.get_emails_between(RECIPIENT, START + HOUR, START + 3 * HOUR)) == ["Test message 2", "Test message 1"]
+        assert subjects(db.get_emails_between(RECIPIENT, to_epoch_us(START + HOUR), to_epoch_us(START + 3 * HOUR))) \
+            == ["Test message 2", "Test message 1"]
+        assert subjects(db.get_emails_since(RECIPIENT, START + 4 * HOUR)) == ["Test message 5", "Test message 4"]
+        assert subjects(db.get_emails_before(RECIPIENT, START + HOUR)) == ["Test message 0"]
+        assert len(db.get_emails_between(RECIPIENT)) == 6
+        assert subjects(db.get_emails_since(RECIPIENT, START, limit=2)) == ["Test message 5", "Test message 4"]
+        assert db.get_emails_between(RECIPIENT, START + 3 * HOUR, START + 3 * HOUR) == []
+
+        # A local-time bound means the same moment as its UTC equivalent
+        local = (START + 5 * HOUR).astimezone().replace(tzinfo=None)
+        assert subjects(db.get_emails_since(RECIPIENT, local)) == ["Test message 5"]
+
+if __name__ == "__main__":
+    test_received_dates()
+    print("Received date tests passed")
@@ -1,21 +1,17 @@
 #!/usr/bin/env python3
 import os
+import io
 from email_db import EmailDatabase
+from mail_fixtures import temp_database, temp_dir
+from db_backup import WalArchiver, restore_database, verify_database
 import email
 from email.mime.text import MIMEText
 from email.mime.multipart import MIMEMultipart
+from email.mime.application import MIMEApplication
 import datetime
 
-def test_database():
-    """Test the email database functionality"""
-    print("Testing email database...")
-    
-    # Initialize the database
-    db = EmailDatabase()
-    
-    # Create test directory
-    os.makedirs("database", exist_ok=True)
-    
+def check_database(db):
+    """Store, read, search, stream, back up and delete emails in an open database"""
     # Create a test email
     msg = MIMEMultipart()
     msg["From"] = "sender@example.com"
@@ -31,72 +27,129 @@ def test_database():
     message_data = msg.as_bytes()
     email_id = db.store_email("test@example.com", message_data)
     
-    if not email_id:
-        print("Error: Failed to store email in database")
-        return False
-    
+    assert email_id, "Failed to store email in database"
     print(f"Email stored with ID: {email_id}")
     
     # Test getting mailbox
     print("\nTesting mailbox retrieval...")
     emails = db.get_mailbox("test@example.com")
     
-    if not emails:
-        print("Error: No emails found in mailbox")
-        return False
-    
+    assert [mail["id"] for mail in emails] == [email_id], "Stored email missing from mailbox"
     print(f"Found {len(emails)} emails in mailbox")
     
     # Test getting specific email
     print("\nTesting email retrieval...")
     mail_data = db.get_email(email_id)
     
-    if not mail_data:
-        print("Error: Failed to retrieve email")
-        return False
-    
+    assert mail_data and mail_data["subject"] == "Test Email for Database", "Failed to retrieve email"
     print(f"Retrieved email with subject: {mail_data['subject']}")
     
     # Test marking as read
     print("\nTesting marking email as read...")
-    if not db.mark_as_read(email_id):
-        print("Error: Failed to mark email as read")
-        return False
+    assert db.mark_as_read(email_id), "Failed to mark email as read"
     
     # Verify read status
-    mail_data = db.get_email(email_id)
-    if not mail_data['is_read']:
-        print("Error: Email not marked as read")
-        return False
-    
+    assert db.get_email(email_id)['is_read'], "Email not marked as read"
     print("Email marked as read successfully")
     
     # Test search
     print("\nTesting email search...")
     search_results = db.search_emails("test@example.com", "test")
     
-    if not search_results:
-        print("Error: No search results found")
-        return False
-    
+    assert [mail["id"] for mail in search_results] == [email_id], "Search did not find the email"
     print(f"Found {len(search_results)} emails matching 'test'")
     
+    # Test streaming the raw message in and out
+    print("\nTesting raw message streaming...")
+    streamed_id = db.store_email_stream("stream@example.com", io.BytesIO(message_data))
+    reader = db.open_raw_email(streamed_id) if streamed_id else None
+    
+    assert reader is not None, "Failed to stream email"
+    
+    with reader:
+        assert b"".join(reader.iter_chunks(1024)) == message_data, "Streamed message does not match the original"
+    
+    db.delete_email(streamed_id)
+    print("Raw message streamed successfully")
+    
+    # Test the attachment catalog and streaming one attachment back
+    print("\nTesting attachment catalog...")
+    payload = os.urandom(100000)
+    attachment = MIMEApplication(payload)
+    attachment.add_header("Content-Disposition", "attachment", filename="data.bin")
+    with_attachment = MIMEMultipart()
+    with_attachment.attach(MIMEText("See attached", "plain"))
+    with_attachment.attach(attachment)
+    attachment_id = db.store_email_stream("attach@example.com", io.BytesIO(with_attachment.as_bytes()))
+    attachments = db.get_attachments(attachment_id)
+    
+    assert [(item["filename"], item["size"]) for item in attachments] == [("data.bin", len(payload))], \
+        f"Attachment catalog does not match the message: {attachments}"
+    assert b"".join(db.stream_attachment(attachment_id, attachments[0]["part_index"], 1000)) == payload, \
+        "Streamed attachment does not match the original"
+    
+    db.delete_email(attachment_id)
+    print("Attachment cataloged and streamed successfully")
+    
+    # Test that a repeated delivery is not stored twice
+    print("\nTesting duplicate detection...")
+    assert db.store_email("test@example.com", message_data) == email_id, "Duplicate delivery was stored as a new email"
+    assert db.deliver_email("test@example.com", message_data) == (email_id, False), "Duplicate reported as created"
+    assert len(db.get_mailbox("test@example.com")) == 1, "Duplicate delivery added a row"
+    print("Duplicate delivery returned the stored email")
+    
+    # Test the header index
+    print("\nTesting header filters...")
+    found = db.find_emails("test@example.com", sender_domain="Example.com", since=datetime.datetime.now() - datetime.timedelta(days=7))
+    headers = db.get_headers(email_id)
+    
+    assert [mail["id"] for mail in found] == [email_id], "Header filters did not find the email"
+    assert headers["addresses"]["to"] == ["test@example.com"], f"Unexpected indexed headers {headers}"
+    print(f"Found {len(found)} emails from example.com")
+    
     # Test deletion
     print("\nTesting email deletion...")
-    if not db.delete_email(email_id):
-        print("Error: Failed to delete email")
-        return False
+    modseq = db.get_modseq("test@example.com")
+    assert db.delete_email(email_id), "Failed to delete email"
     
     # Verify deletion
-    mail_data = db.get_email(email_id)
-    if mail_data:
-        print("Error: Email not deleted")
-        return False
-    
+    assert db.get_email(email_id) is None, "Email not deleted"
     print("Email deleted successfully")
     
+    # Test that the deletion is reported to incremental sync
+    print("\nTesting changes since the last sync...")
+    changes = db.changes_since("test@example.com", modseq)
+    
+    assert changes["deleted"] == [email_id], f"Deletion missing from changes_since: {changes}"
+    assert changes["modseq"] > modseq and not changes["full_resync"], f"Unexpected modseq state {changes}"
+    print(f"Mailbox is at modseq {changes['modseq']}")
+    
+    # Test that an online backup plus its archived WAL restores new mail
+    print("\nTesting online backup and restore...")
+    with temp_dir() as backup_dir:
+        archiver = WalArchiver(db.db_path, os.path.join(backup_dir, "emails.db"), pages=8, pause=0)
+        archiver.run_once()
+        backup_id = db.store_email("backup@example.com", message_data)
+        archiver.run_once()
+        archiver.close()
+        
+        restored_path = os.path.join(backup_dir, "restored.db")
+        restore_database(os.path.join(backup_dir, "emails.db"), restored_path)
+        problems = verify_database(restored_path)
+        restored = EmailDatabase(restored_path)
+        restored_mail = restored.get_email(backup_id)
+        restored.close()
+    
+    assert not problems, f"Restored backup failed verification: {problems}"
+    assert restored_mail and restored_mail["recipient"] == "backup@example.com", "Restored backup misses mail stored after the snapshot"
+    print("Backup restored and verified")
+
+def test_database():
+    """Test the email database functionality"""
+    print("Testing email database...")
+    with temp_database() as db:
+        check_database(db)
     print("\nAll tests passed successfully!")
-    return True
 
 if __name__ == "__main__":
     test_database() 
\ No newline at end of file
@@ -0,0 +1,56 @@
+#!/usr/bin/env python3
+import os
+import email
+from email.policy import default
+from header_index import INDEX_FILE, HeaderIndex, read_header_block
+from mail_fixtures import build_message, temp_dir
+
+def indexed_message(i):
+    """A test message with an encoded subject and a Date header"""
+    return build_message("reader@example.com", i, subject=f"Héllo {i}", body=f"Body of message {i}\n",
+                         sender="Sender <sender@example.com>", headers={"Date": f"Mon, 01 Jan 2024 10:00:0{i} +0000"})
+
+def test_header_index():
+    """Test that listings match a full parse, reuse the index and notice changed and removed files"""
+    with temp_dir() as mailbox_path:
+        for i in range(3):
+            with open(os.path.join(mailbox_path, f"2024010110000{i}.eml"), 'wb') as f:
+                f.write(indexed_message(i))
+
+        # Only the header block is read, so the body is still ahead of the stream
+        with open(os.path.join(mailbox_path, "20240101100000.eml"), 'rb') as f:
+            read_header_block(f)
+            assert f.read() == indexed_message(0).split(b"\n\n", 1)[1], "read_header_block read past the blank line"
+
+        index = HeaderIndex(mailbox_path)
+        emails = index.list_emails()
+        for entry in emails:
+            with open(entry["path"], 'rb') as f:
+                msg = email.message_from_binary_file(f, policy=default)
+            assert (entry["from"], entry["subject"], entry["date"]) == (msg["From"], msg["Subject"], msg["Date"]), \
+                f"Index entry {entry} differs from the full parse"
+        assert index.parsed == 3, f"First listing parsed {index.parsed} files"
+        assert os.path.exists(os.path.join(mailbox_path, INDEX_FILE)), "First listing wrote no index"
+
+        # A second listing opens no message file
+        index = HeaderIndex(mailbox_path)
+        assert index.list_emails() == emails, "Second listing differs from the first"
+        assert (index.parsed, index.reused) == (0, 3), f"Second listing parsed {index.parsed} files"
+
+        # A rewritten file is parsed again and a removed one leaves the listing
+        changed = os.path.join(mailbox_path, "20240101100001.eml")
+        with open(changed, 'wb') as f:
+            f.write(indexed_message(7))
+        stat = os.stat(changed)
+        os.utime(changed, ns=(stat.st_atime_ns, stat.st_mtime_ns + 1000000000))
+        os.remove(os.path.join(mailbox_path, "20240101100002.eml"))
+
+        index = HeaderIndex(mailbox_path)
+        emails = index.list_emails()
+        assert index.parsed == 1, f"Listing after changes parsed {index.parsed} files"
+        assert [entry["subject"] for entry in emails] == ["Héllo 0", "Héllo 7"], f"Unexpected listing {emails}"
+        assert len(HeaderIndex(mailbox_path).load()) == 2, "The removed file is still in the index"
+
+if __name__ == "__main__":
+    test_header_index()
+    print("Header index tests passed")
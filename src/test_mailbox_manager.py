@@ -0,0 +1,35 @@
+#!/usr/bin/env python3
+import os
+from mail_fixtures import build_message, temp_dir
+
+def test_duplicate_delivery():
+    """A message delivered twice through MailboxManager leaves one row and one .eml file"""
+    # MailboxManager logs to logs/ and stores under mailboxes/ and database/ relative to the working directory
+    cwd = os.getcwd()
+    with temp_dir() as work_dir:
+        os.chdir(work_dir)
+        os.makedirs("logs", exist_ok=True)
+        from smtp_server import MailboxManager
+        manager = MailboxManager()
+
+        try:
+            recipient = "twice@example.com"
+            message = build_message(recipient)
+            first = manager.store_email(recipient, message)
+            second = manager.store_email(recipient, message)
+
+            assert first == second, f"Duplicate delivery got a new id: {first} then {second}"
+            assert [mail["id"] for mail in manager.email_db.get_mailbox(recipient)] == [first]
+            files = os.listdir(manager.get_user_mailbox_path(recipient))
+            assert len(files) == 1 and first in files[0], f"Duplicate delivery wrote {files}"
+
+            # A different message to the same mailbox still gets its own file
+            manager.store_email(recipient, build_message(recipient, 1))
+            assert len(os.listdir(manager.get_user_mailbox_path(recipient))) == 2
+        finally:
+            manager.email_db.close()
+            os.chdir(cwd)
+
+if __name__ == "__main__":
+    test_duplicate_delivery()
+    print("Mailbox manager tests passed")
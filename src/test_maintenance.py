@@ -0,0 +1,94 @@
+#!/usr/bin/env python3
+import os
+import shutil
+import datetime
+from db_maintenance import MaintenanceJob, RetentionPolicy
+from mail_fixtures import build_message, temp_database, temp_dir
+
+# A ULID that was never stored in any database
+UNKNOWN_ID = "01ARZ3NDEKTSV4RRFFQ69G5FAV"
+
+def store_with_files(db, mailbox_dir, recipient, count):
+    """Store emails and write their .eml copies the way MailboxManager names them; returns {id: path}"""
+    mailbox_path = os.path.join(mailbox_dir, recipient.replace('@', '_at_').replace('.', '_dot_'))
+    os.makedirs(mailbox_path, exist_ok=True)
+    files = {}
+    for i in range(count):
+        message = build_message(recipient, i)
+        email_id = db.store_email(recipient, message)
+        files[email_id] = os.path.join(mailbox_path, f"20240101000000_{email_id}.eml")
+        with open(files[email_id], 'wb') as f:
+            f.write(message)
+    return files
+
+def check_files(db, fresh, mailbox_dir):
+    """Retention, and removal of only the files of emails recorded as deleted"""
+    kept = store_with_files(db, mailbox_dir, "keep@example.com", 3)
+    expiring = store_with_files(db, mailbox_dir, "old@example.com", 2)
+    unknown_file = os.path.join(mailbox_dir, "keep_at_example_dot_com", f"20240101000000_{UNKNOWN_ID}.eml")
+    shutil.copy(next(iter(kept.values())), unknown_file)
+    policy = RetentionPolicy(mailboxes={"old@example.com": 5})
+    job = MaintenanceJob(email_db=db, policy=policy, mailbox_dir=mailbox_dir, pause=0)
+
+    # A database that never had these emails has no evidence that any was deleted
+    fresh_job = MaintenanceJob(email_db=fresh, policy=policy, mailbox_dir=mailbox_dir, pause=0)
+    assert fresh_job.run_once()["orphans_removed"] == 0, "A fresh database removed files"
+    assert all(os.path.exists(path) for path in list(kept.values()) + list(expiring.values()))
+
+    # Retention only expires mail of mailboxes with a policy, and only once it is old enough
+    assert job.apply_retention() == 0, "Retention deleted mail that has not expired"
+    deleted = job.apply_retention(now=datetime.datetime.now() + datetime.timedelta(days=10))
+    assert deleted == 2, f"Retention deleted {deleted} emails, expected 2"
+    assert len(db.get_mailbox("keep@example.com")) == 3 and not db.get_mailbox("old@example.com")
+
+    # A delete by hand is recorded the same way as a retention delete
+    deleted_id = next(iter(kept))
+    db.delete_email(deleted_id)
+    orphans = sorted(list(expiring.values()) + [kept[deleted_id]])
+
+    # A dry run reports the files of deleted emails and leaves them
+    found = job.reconcile_files(dry_run=True)
+    assert sorted(found) == orphans, f"Dry run found {found}, expected {orphans}"
+    assert all(os.path.exists(path) for path in orphans), "Dry run removed files"
+
+    removed = job.reconcile_files()
+    assert sorted(removed) == orphans, f"Removed {removed}, expected {orphans}"
+    remaining = sorted(os.listdir(os.path.join(mailbox_dir, "keep_at_example_dot_com")))
+    expected = sorted(os.path.basename(path) for email_id, path in kept.items() if email_id != deleted_id)
+    assert remaining == sorted(expected + [os.path.basename(unknown_file)]), \
+        f"Left {remaining}; live emails and the unknown id must keep their files"
+
+def free_pages(db):
+    """The database's freelist length"""
+    conn = db.pool.acquire()
+    try:
+        return conn.execute("PRAGMA freelist_count").fetchone()[0]
+    finally:
+        db.pool.release(conn)
+
+def check_compact(db):
+    """One compaction takes at most max_vacuum_steps steps; later runs release the rest"""
+    ids = [db.store_email("big@example.com", build_message("big@example.com", i, body="x" * 20000)) for i in range(50)]
+    db.delete_many(ids)
+    free = free_pages(db)
+    assert free > 10, f"Deleting mail left only {free} free pages"
+
+    job = MaintenanceJob(email_db=db, policy=RetentionPolicy(), pause=0, vacuum_pages=1, max_vacuum_steps=3)
+    assert job.compact() == 3, "Compaction ignored max_vacuum_steps"
+    assert free_pages(db) == free - 3, "Each step should release vacuum_pages pages"
+
+    job.max_vacuum_steps = 1000
+    job.vacuum_pages = 256
+    assert job.compact() >= 1 and free_pages(db) == 0, "Compaction left free pages"
+    assert job.compact() == 1, "Compacting an empty freelist took more than one step"
+
+def test_maintenance():
+    """Test retention, bounded compaction and that only files of emails recorded as deleted are removed"""
+    with temp_dir() as work_dir, temp_database() as db, temp_database() as fresh:
+        check_files(db, fresh, os.path.join(work_dir, "mailboxes"))
+    with temp_database() as db:
+        check_compact(db)
+
+if __name__ == "__main__":
+    test_maintenance()
+    print("Maintenance tests passed")
@@ -0,0 +1,68 @@
+#!/usr/bin/env python3
+from email_db import MessageCache
+from mail_fixtures import build_message, temp_database
+
+RECIPIENT = "cache@example.com"
+
+def check_lru():
+    """Least recently used views are evicted to stay within max_bytes"""
+    view = {"body": "x" * 100}
+    size = MessageCache._size_of(view)
+    cache = MessageCache(max_bytes=3 * size)
+    for key in "abc":
+        cache.put(key, view)
+    assert cache.get("a") is not None  # a is now the most recent
+    cache.put("d", view)
+    assert "b" not in cache and all(key in cache for key in "acd"), "Evicted the wrong view"
+
+    # Views too large for the cache are not kept; copies never leak changes
+    cache.put("huge", {"body": "x" * 4 * size})
+    assert "huge" not in cache
+    copy = cache.get("a")
+    copy["body"] = "changed"
+    assert cache.get("a")["body"] == "x" * 100, "Changing a returned view changed the cache"
+
+    stats = cache.stats()
+    assert (stats["hits"], stats["misses"], stats["evictions"], stats["entries"]) == (3, 0, 1, 3), f"Unexpected stats {stats}"
+    assert stats["bytes"] == 3 * size <= stats["max_bytes"]
+
+def check_database_cache(db):
+    """Opened messages are cached, and read flags and deletes keep the views current"""
+    ids = [db.store_email(RECIPIENT, build_message(RECIPIENT, i)) for i in range(3)]
+
+    # The second open of a message comes from the cache
+    first = db.get_email(ids[0])
+    assert db.get_email(ids[0]) == first
+    stats = db.get_cache_stats()
+    assert (stats["hits"], stats["misses"]) == (1, 1), f"Unexpected stats {stats}"
+    assert "raw_email" in db.get_email(ids[0], include_raw=True) and "raw_email" not in db.get_email(ids[0])
+
+    # Read flags are updated in place, bulk changes drop the mailbox's views
+    db.mark_as_read(ids[0])
+    assert db.get_email(ids[0])["is_read"], "Cached view kept the old read flag"
+    db.get_email(ids[1])
+    db.mark_all_read(RECIPIENT)
+    assert db.get_email(ids[1])["is_read"], "mark_all_read left a stale view"
+
+    # Deleted messages are never served from the cache
+    db.delete_email(ids[0])
+    db.delete_many([ids[1]])
+    assert db.get_email(ids[0]) is None and db.get_email(ids[1]) is None, "Deleted email served from the cache"
+
+def test_message_cache():
+    """Test the LRU of decoded messages and its invalidation by the database"""
+    check_lru()
+    with temp_database() as db:
+        check_database_cache(db)
+
+    # message_cache_bytes=0 turns the cache off
+    with temp_database(message_cache_bytes=0) as db:
+        email_id = db.store_email(RECIPIENT, build_message(RECIPIENT))
+        db.get_email(email_id)
+        db.get_email(email_id)
+        stats = db.get_cache_stats()
+        assert (stats["entries"], stats["hits"]) == (0, 0), f"Disabled cache was used: {stats}"
+
+if __name__ == "__main__":
+    test_message_cache()
+    print("Message cache tests passed")
@@ -0,0 +1,49 @@
+#!/usr/bin/env python3
+import os
+from migrate_to_db import Migration
+from mail_fixtures import build_message, temp_database, temp_dir
+
+MAILBOX = "migrate_at_example_dot_com"
+RECIPIENT = "migrate@example.com"
+
+def write_message(mailbox_path, name, i):
+    """Write a test message file into a mailbox directory"""
+    with open(os.path.join(mailbox_path, name), 'wb') as f:
+        f.write(build_message(RECIPIENT, i))
+
+def migrate(db, mailboxes_dir, **kwargs):
+    """Run a migration in this process and return its counters"""
+    return Migration(db, mailboxes_dir, workers=1, batch_size=3, **kwargs).run()
+
+def check_resume(db, mailboxes_dir, mailbox_path):
+    """A later run migrates every file the manifest lacks, including ones that sort before migrated files"""
+    for i in range(5):
+        write_message(mailbox_path, f"20240102000000_{i}.eml", i)
+    result = migrate(db, mailboxes_dir)
+    assert (result["total"], result["migrated"]) == (5, 5), f"First run: {result}"
+
+    # Files that sort before everything migrated so far, and one after
+    write_message(mailbox_path, "20240101000000_early.eml", 10)
+    write_message(mailbox_path, "20240103000000_late.eml", 11)
+    result = migrate(db, mailboxes_dir)
+    assert result["migrated"] == 2, f"Second run migrated {result['migrated']} files, expected 2"
+    assert len(db.get_mailbox(RECIPIENT, limit=100)) == 7
+    assert {"20240101000000_early.eml", "20240103000000_late.eml"} <= set(db.get_file_manifest(RECIPIENT))
+
+    # Nothing is left; a restart reads every file again without storing any twice
+    assert migrate(db, mailboxes_dir)["total"] == 0, "A file was migrated twice"
+    result = migrate(db, mailboxes_dir, restart=True)
+    assert result["total"] == 7, f"Restart went through {result['total']} files"
+    assert len(db.get_mailbox(RECIPIENT, limit=100)) == 7, "Restart stored emails twice"
+
+def test_migration_resume():
+    """Test that the file manifest, not file name order, decides which files a migration run reads"""
+    with temp_dir() as work_dir, temp_database() as db:
+        mailboxes_dir = os.path.join(work_dir, "mailboxes")
+        mailbox_path = os.path.join(mailboxes_dir, MAILBOX)
+        os.makedirs(mailbox_path)
+        check_resume(db, mailboxes_dir, mailbox_path)
+
+if __name__ == "__main__":
+    test_migration_resume()
+    print("Migration tests passed")
@@ -0,0 +1,69 @@
+#!/usr/bin/env python3
+from mail_fixtures import build_message, temp_database
+
+RECIPIENT = "pages@example.com"
+
+def make_ties(db, ids, group_size):
+    """Give each group of group_size emails the delivery time of its first email"""
+    conn = db.pool.acquire()
+    try:
+        for start in range(0, len(ids), group_size):
+            group = ids[start:start + group_size]
+            conn.execute(f'''
+            UPDATE emails SET received_date = (SELECT received_date FROM emails WHERE id = ?)
+            WHERE id IN ({", ".join("?" for _ in group)})
+            ''', [group[0]] + group)
+        conn.commit()
+    finally:
+        db.pool.release(conn)
+
+def walk_pages(db, limit):
+    """Follow page tokens from the first page to the last; returns the pages' ids"""
+    pages = []
+    token = None
+    while True:
+        emails, token = db.get_mailbox_page(RECIPIENT, limit=limit, page_token=token)
+        pages.append([mail["id"] for mail in emails])
+        if token is None:
+            return pages
+        assert len(pages) <= 100, "Page tokens never ran out"
+
+def test_mailbox_pagination():
+    """Test keyset pages: every email exactly once, in order, across ties on received_date"""
+    with temp_database() as db:
+        # Five emails share each delivery time, so pages must break ties by id
+        ids = [db.store_email(RECIPIENT, build_message(RECIPIENT, i)) for i in range(25)]
+        assert None not in ids, "Failed to store emails"
+        make_ties(db, ids, 5)
+        db.store_email("other@example.com", build_message("other@example.com", 99))
+        expected = [mail["id"] for mail in db.get_mailbox(RECIPIENT, limit=100)]
+        assert len(expected) == 25
+
+        # Page sizes that split tie groups, match them and divide the mailbox exactly
+        for limit in (1, 3, 5, 7, 25, 50):
+            pages = walk_pages(db, limit)
+            found = [email_id for page in pages for email_id in page]
+            assert found == expected, f"Pages of {limit} returned {len(found)} emails out of order or twice"
+            assert all(len(page) == limit for page in pages[:-1]) and 0 < len(pages[-1]) <= limit, \
+                f"Pages of {limit} have sizes {[len(page) for page in pages]}"
+
+        # Mail delivered while paging shows up on the first page, not in the middle of the walk
+        emails, token = db.get_mailbox_page(RECIPIENT, limit=10)
+        db.store_email(RECIPIENT, build_message(RECIPIENT, 100))
+        rest = []
+        while token:
+            page, token = db.get_mailbox_page(RECIPIENT, limit=10, page_token=token)
+            rest.extend(mail["id"] for mail in page)
+        assert [mail["id"] for mail in emails] + rest == expected, "A new delivery shifted the pages"
+
+        # Bad tokens are an error, not an empty mailbox
+        for token in ("not-a-token", "e30", ""):
+            try:
+                db.get_mailbox_page(RECIPIENT, limit=10, page_token=token)
+            except ValueError:
+                continue
+            raise AssertionError(f"Page token {token!r} was accepted")
+
+if __name__ == "__main__":
+    test_mailbox_pagination()
+    print("Pagination tests passed")
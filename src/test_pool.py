@@ -0,0 +1,90 @@
+#!/usr/bin/env python3
+import os
+import threading
+from email_db import ConnectionPool, EmailDatabase
+from mail_fixtures import build_message, temp_dir
+
+def run_threads(target, count):
+    """Run target(n) on count threads and wait for all of them"""
+    threads = [threading.Thread(target=target, args=(n,)) for n in range(count)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+def check_pool(db_path):
+    """One connection per thread, reused, rolled back on release and replaced when broken"""
+    pool = ConnectionPool(db_path)
+    try:
+        conn = pool.acquire()
+        conn.execute("CREATE TABLE items (value INTEGER)")
+        conn.commit()
+
+        # A transaction the caller left open is rolled back, and the connection is kept
+        conn.execute("INSERT INTO items VALUES (1)")
+        pool.release(conn)
+        assert pool.acquire() is conn, "Connection was not reused"
+        assert conn.execute("SELECT COUNT(*) FROM items").fetchone()[0] == 0, "Open transaction survived release"
+        pool.release(conn)
+
+        # Each thread gets a connection of its own
+        others = []
+        def use_pool(n):
+            other = pool.acquire()
+            others.append(other)
+            pool.release(other)
+        run_threads(use_pool, 3)
+        assert len({id(other) for other in others} | {id(conn)}) == 4, "Threads shared a connection"
+
+        # A broken connection is replaced at the next health check
+        pool.health_check_interval = 0
+        conn.close()
+        replacement = pool.acquire()
+        assert replacement is not conn, "Broken connection was handed out again"
+        assert replacement.execute("SELECT 1").fetchone()[0] == 1
+        pool.release(replacement)
+    finally:
+        pool.close_all()
+
+    # Without persistence every call gets a new connection that is closed on release
+    pool = ConnectionPool(db_path, persistent=False)
+    first = pool.acquire()
+    pool.release(first)
+    second = pool.acquire()
+    pool.release(second)
+    assert first is not second, "Unpooled connections were reused"
+
+def check_concurrent_use(db_path, pooled):
+    """Several threads store, read and mark mail through one EmailDatabase"""
+    db = EmailDatabase(db_path, pooled=pooled)
+    errors = []
+    def deliver(worker):
+        try:
+            recipient = f"worker{worker}@example.com"
+            for i in range(10):
+                email_id = db.store_email(recipient, build_message(recipient, i))
+                assert db.get_email(email_id)["recipient"] == recipient
+                assert db.mark_as_read(email_id)
+            assert len(db.get_mailbox(recipient)) == 10
+        except Exception as e:
+            errors.append(e)
+
+    try:
+        run_threads(deliver, 4)
+        assert not errors, f"Concurrent use failed: {errors}"
+        for worker in range(4):
+            usage = db.get_usage(f"worker{worker}@example.com")
+            assert (usage["message_count"], usage["unread_count"]) == (10, 0), f"Unexpected usage {usage}"
+    finally:
+        db.close()
+
+def test_connection_pool():
+    """Test the connection pool and concurrent use of one EmailDatabase from several threads"""
+    with temp_dir() as path:
+        check_pool(os.path.join(path, "pool.db"))
+        check_concurrent_use(os.path.join(path, "pooled.db"), pooled=True)
+        check_concurrent_use(os.path.join(path, "unpooled.db"), pooled=False)
+
+if __name__ == "__main__":
+    test_connection_pool()
+    print("Connection pool tests passed")
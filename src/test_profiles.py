@@ -0,0 +1,81 @@
+#!/usr/bin/env python3
+import os
+import sqlite3
+from email_db import PROFILES, EmailDatabase
+from mail_fixtures import build_message, temp_database, temp_dir
+
+# What PRAGMA reads back for the names the profiles use
+PRAGMA_VALUES = {"OFF": 0, "NORMAL": 1, "FULL": 2, "DEFAULT": 0, "MEMORY": 2}
+
+def applied_pragmas(db, names):
+    """The values a pooled connection reports for the given PRAGMAs"""
+    conn = db.pool.acquire()
+    try:
+        return {name: conn.execute(f"PRAGMA {name}").fetchone()[0] for name in names}
+    finally:
+        db.pool.release(conn)
+
+def check_profiles(path):
+    """Every named profile and a custom dict reach the pooled connections in WAL mode"""
+    for name, profile in list(PROFILES.items()) + [("custom", {"synchronous": "FULL", "cache_size": -1000})]:
+        db = EmailDatabase(os.path.join(path, f"{name}.db"), profile=profile)
+        try:
+            applied = applied_pragmas(db, list(profile) + ["journal_mode"])
+            expected = {key: PRAGMA_VALUES.get(value, value) for key, value in profile.items()}
+            expected.setdefault("journal_mode", "wal")
+            assert applied == expected, f"Profile {name} applied {applied}, expected {expected}"
+        finally:
+            db.close()
+
+    # .env picks the default profile; unknown names are refused
+    saved_profile = os.environ.pop("EMAIL_DB_PROFILE", None)
+    try:
+        os.environ["EMAIL_DB_PROFILE"] = "durable"
+        db = EmailDatabase(os.path.join(path, "env.db"))
+        assert db.profile is PROFILES["durable"], "EMAIL_DB_PROFILE was ignored"
+        db.close()
+    finally:
+        os.environ.pop("EMAIL_DB_PROFILE", None)
+        if saved_profile is not None:
+            os.environ["EMAIL_DB_PROFILE"] = saved_profile
+    try:
+        EmailDatabase(os.path.join(path, "unknown.db"), profile="fastest")
+    except ValueError:
+        pass
+    else:
+        raise AssertionError("Unknown profile was accepted")
+
+def check_wal(db):
+    """Readers are not blocked by an open write, and TRUNCATE empties the WAL"""
+    ids = [db.store_email("profiles@example.com", build_message("profiles@example.com", i)) for i in range(20)]
+    writer = sqlite3.connect(db.db_path, timeout=0)
+    try:
+        writer.execute("BEGIN IMMEDIATE")
+        writer.execute("UPDATE emails SET is_read = 1")
+        assert len(db.get_mailbox("profiles@example.com")) == 20, "Reader blocked by an open write"
+        assert not db.get_email(ids[0])["is_read"], "Reader saw an uncommitted write"
+        writer.rollback()
+    finally:
+        writer.close()
+
+    assert db.get_wal_size() > 0, "Writes left no WAL"
+    busy, _, _ = db.checkpoint("TRUNCATE")
+    assert busy == 0 and db.get_wal_size() == 0, f"Checkpoint left {db.get_wal_size()} bytes of WAL"
+    assert len(db.get_mailbox("profiles@example.com")) == 20
+    try:
+        db.checkpoint("EVERYTHING")
+    except ValueError:
+        pass
+    else:
+        raise AssertionError("Unknown checkpoint mode was accepted")
+
+def test_profiles():
+    """Test WAL mode, the PRAGMA profiles and WAL checkpoints"""
+    with temp_dir() as path:
+        check_profiles(path)
+    with temp_database() as db:
+        check_wal(db)
+
+if __name__ == "__main__":
+    test_profiles()
+    print("Profile tests passed")
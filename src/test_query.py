@@ -0,0 +1,106 @@
+#!/usr/bin/env python3
+from email.mime.text import MIMEText
+from email.mime.multipart import MIMEMultipart
+from email.mime.application import MIMEApplication
+from mail_fixtures import build_message, temp_database
+from mail_query import compile_query
+
+RECIPIENT = "query@example.com"
+
+def attachment_message(i, sender, subject, body):
+    """A test message with a PDF attachment"""
+    msg = MIMEMultipart()
+    msg.attach(MIMEText(body, "plain"))
+    part = MIMEApplication(b"%PDF" + b"x" * 8000)
+    part.add_header("Content-Disposition", "attachment", filename="report.pdf")
+    msg.attach(part)
+    msg["From"] = sender
+    msg["To"] = RECIPIENT
+    msg["Subject"] = subject
+    msg["Message-ID"] = f"<query-test-{i}@example.com>"
+    return msg.as_bytes()
+
+def query_plan(db, query):
+    """EXPLAIN QUERY PLAN lines of the SQL a query compiles to"""
+    condition, params = compile_query(query)
+    conn = db.pool.acquire()
+    try:
+        rows = conn.execute(f'''
+        EXPLAIN QUERY PLAN
+        SELECT e.id FROM emails e
+        WHERE e.recipient = ? AND {condition}
+        ORDER BY e.received_date DESC, e.id DESC
+        LIMIT ? OFFSET ?
+        ''', [RECIPIENT] + params + [50, 0]).fetchall()
+        return [row[3] for row in rows]
+    finally:
+        db.pool.release(conn)
+
+def seed(db):
+    """Store a small mailbox plus mail for someone else; the read one is Lunch"""
+    db.store_email(RECIPIENT, attachment_message(1, "alice@foo.com", "Quarterly report", "Numbers inside"))
+    db.store_email(RECIPIENT, build_message(RECIPIENT, 2, "Lunch", "Pizza today?", "bob@bar.org",
+                                            headers={"Cc": "carol@foo.com"}))
+    db.store_email(RECIPIENT, build_message(RECIPIENT, 3, "Re: Lunch", "Sure, pizza", "alice@foo.com"))
+    db.store_email("other@example.com", build_message("other@example.com", 4, "Lunch", "Pizza for you too", "alice@foo.com"))
+    ids = {mail["subject"]: mail["id"] for mail in db.get_mailbox(RECIPIENT)}
+    db.mark_as_read(ids["Lunch"])
+
+# Each query and the subjects it must return, newest first
+EXPECTED = {
+    "from:alice@foo.com": ["Re: Lunch", "Quarterly report"],
+    "from:alice": ["Re: Lunch", "Quarterly report"],
+    "from:@bar.org": ["Lunch"],
+    "cc:carol@foo.com": ["Lunch"],
+    "to:query@example.com subject:lunch": ["Re: Lunch", "Lunch"],
+    "pizza -from:bob": ["Re: Lunch"],
+    "is:unread": ["Re: Lunch", "Quarterly report"],
+    "has:attachment": ["Quarterly report"],
+    "-has:attachment": ["Re: Lunch", "Lunch"],
+    "larger:4K": ["Quarterly report"],
+    "(from:bob OR has:attachment) AND is:unread": ["Quarterly report"],
+    "after:2000-01-01 before:2100-01-01 NOT subject:lunch": ["Quarterly report"],
+    'subject:"quarterly report"': ["Quarterly report"],
+}
+
+# Operators between plain words are applied, not searched for as words
+PLAIN = {
+    "pizza sure": {"Re: Lunch"},
+    "pizza AND sure": {"Re: Lunch"},
+    "pizza OR numbers": {"Quarterly report", "Lunch", "Re: Lunch"},
+    "pizza -sure": {"Lunch"},
+    "pizza NOT sure": {"Lunch"},
+    "-pizza": {"Quarterly report"},
+    "(pizza)": {"Lunch", "Re: Lunch"},
+}
+
+def test_query_language():
+    """Test the search query language against stored mail and its query plans"""
+    with temp_database() as db:
+        seed(db)
+
+        for query, subjects in EXPECTED.items():
+            found = [mail["subject"] for mail in db.search_emails(RECIPIENT, query)]
+            assert found == subjects, f"{query!r} returned {found}, expected {subjects}"
+        for query, subjects in PLAIN.items():
+            found = {mail["subject"] for mail in db.search_emails(RECIPIENT, query)}
+            assert found == subjects, f"{query!r} returned {found}, expected {subjects}"
+
+        # Every table is reached through an index: only FTS5 MATCH lookups may show as SCAN
+        for query in list(EXPECTED) + ["lunch OR from:bob", "NOT (is:read OR smaller:1K)"]:
+            for line in query_plan(db, query):
+                scans = line.startswith("SCAN") and "VIRTUAL TABLE INDEX 0:M" not in line
+                assert not scans, f"{query!r} scans a table: {line}"
+
+        # has:attachment probes the attachment catalog by its primary key
+        plan = query_plan(db, "has:attachment")
+        assert "SEARCH a USING PRIMARY KEY (email_seq=?)" in plan, \
+            f"has:attachment does not use the attachment catalog's key: {plan}"
+
+        # Bad values are reported instead of matching everything
+        assert not db.search_emails(RECIPIENT, "is:starred"), "is:starred returned results"
+        assert not db.search_emails(RECIPIENT, "larger:huge"), "larger:huge returned results"
+
+if __name__ == "__main__":
+    test_query_language()
+    print("Query language tests passed")
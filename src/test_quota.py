@@ -0,0 +1,85 @@
+#!/usr/bin/env python3
+import os
+import smtplib
+import threading
+from mail_fixtures import build_message, temp_database, temp_dir
+
+def check_database_quotas():
+    """Message and byte limits, per mailbox and by default"""
+    with temp_database(default_quota_messages=3) as db:
+        # max_messages: full once the count reaches the limit
+        db.set_quota("count@example.com", max_messages=2)
+        for i in range(2):
+            assert not db.is_over_quota("count@example.com"), f"Over quota with {i} of 2 messages"
+            db.store_email("count@example.com", build_message("count@example.com", i))
+        assert db.is_over_quota("count@example.com"), "Not over quota at 2 of 2 messages"
+        assert db.get_usage("count@example.com")["message_count"] == 2
+
+        # max_bytes: a message that does not fit is refused, a full mailbox refuses anything
+        message = build_message("bytes@example.com")
+        db.set_quota("bytes@example.com", max_bytes=len(message) + 100)
+        assert not db.is_over_quota("bytes@example.com", len(message)), "A fitting message is over quota"
+        db.store_email("bytes@example.com", message)
+        assert db.get_usage("bytes@example.com")["total_bytes"] == len(message)
+        assert not db.is_over_quota("bytes@example.com"), "Mailbox with 100 bytes free is over quota at RCPT"
+        assert db.is_over_quota("bytes@example.com", 101), "A message past max_bytes is not over quota"
+        db.set_quota("bytes@example.com", max_bytes=len(message))
+        assert db.is_over_quota("bytes@example.com"), "A completely full mailbox is not over quota"
+
+        # Mailboxes without their own limits fall back to the default
+        for i in range(3):
+            db.store_email("default@example.com", build_message("default@example.com", i))
+        assert db.is_over_quota("default@example.com"), "Default max_messages not applied"
+        db.set_quota("default@example.com", max_messages=10)
+        assert not db.is_over_quota("default@example.com"), "Per-mailbox quota did not override the default"
+
+def check_rcpt_rejection():
+    """A running server answers RCPT for a full mailbox with 452 and still accepts other recipients"""
+    # The server logs to logs/ and stores under mailboxes/ and database/ relative to the working directory
+    cwd = os.getcwd()
+    with temp_dir() as work_dir:
+        os.chdir(work_dir)
+        os.makedirs("logs", exist_ok=True)
+        import asyncore
+        from smtp_server import CustomSMTPServer
+        server = CustomSMTPServer(("127.0.0.1", 0), None)
+
+        stop = threading.Event()
+        def serve():
+            while not stop.is_set():
+                asyncore.loop(timeout=0.05, count=1)
+        thread = threading.Thread(target=serve, daemon=True)
+        thread.start()
+
+        try:
+            db = server.mailbox_manager.email_db
+            db.set_quota("full@example.com", max_messages=1)
+            host, port = server.socket.getsockname()
+
+            with smtplib.SMTP(host, port, timeout=10) as client:
+                # The first message fits; after it the mailbox is full
+                refused = client.sendmail("sender@example.com", ["full@example.com"], build_message("full@example.com"))
+                assert not refused, f"First delivery refused: {refused}"
+                assert db.get_usage("full@example.com")["message_count"] == 1
+
+                client.mail("sender@example.com")
+                code, reply = client.rcpt("full@example.com")
+                assert code == 452, f"RCPT to a full mailbox got {code} {reply!r}"
+                code, reply = client.rcpt("free@example.com")
+                assert code == 250, f"RCPT to a mailbox with room got {code} {reply!r}"
+                client.rset()
+        finally:
+            stop.set()
+            thread.join()
+            server.close()
+            server.mailbox_manager.email_db.close()
+            os.chdir(cwd)
+
+def test_quotas():
+    """Test quota limits in the database and their enforcement at RCPT time"""
+    check_database_quotas()
+    check_rcpt_rejection()
+
+if __name__ == "__main__":
+    test_quotas()
+    print("Quota tests passed")
@@ -1,29 +1,73 @@
 #!/usr/bin/env python3
-from email_db import EmailDatabase
+import datetime
+from email_db import from_epoch_us
+from mail_fixtures import build_message, temp_database
+
+RECIPIENT = "search@example.com"
+
+MESSAGES = [
+    ("alice@example.com", "Quarterly report", "Numbers are attached."),
+    ("bob@example.com", "Lunch", "The quarterly report is late again."),
+    ("carol@example.com", "Report card", "A quarterly meeting, then the report."),
+    ("dave@example.com", "Café opening", "Coffee on the house."),
+    ("erin@example.com", "Reporting lines", "Nothing about numbers here."),
+]
+
+def seed(db):
+    """Store MESSAGES for RECIPIENT plus one look-alike in another mailbox; returns ids by subject"""
+    ids = {subject: db.store_email(RECIPIENT, build_message(RECIPIENT, i, subject, body, sender))
+           for i, (sender, subject, body) in enumerate(MESSAGES)}
+    db.store_email("other@example.com", build_message("other@example.com", 0, "Quarterly report", "Not yours."))
+    return ids
+
+def subjects(results):
+    """Subjects of search results in their order"""
+    return [mail["subject"] for mail in results]
 
 def test_search():
-    """Test the email search functionality"""
-    print("Testing email search functionality...")
-    
-    # Initialize the database
-    db = EmailDatabase()
-    
-    # Search for the test email sent from GUI in Bob's mailbox
-    search_term = "verify database"
-    recipient = "bob@example.com"
-    
-    results = db.search_emails(recipient, search_term)
-    
-    print(f'Found {len(results)} emails matching "{search_term}" in {recipient}\'s mailbox')
-    
-    if results:
-        for i, mail in enumerate(results, 1):
-            print(f"\nSearch result {i}:")
-            print(f"  From: {mail['sender']}")
-            print(f"  Subject: {mail['subject']}")
-            print(f"  Date: {mail['received_date']}")
-            print(f"  ID: {mail['id']}")
-            print(f"  Read: {'Yes' if mail['is_read'] else 'No'}")
+    """Test ranked full-text search, phrases, prefixes, snippets and index maintenance"""
+    with temp_database() as db:
+        started = datetime.datetime.now().astimezone()
+        ids = seed(db)
+        finished = datetime.datetime.now().astimezone()
+
+        # Every word must match; subject hits rank above body hits
+        found = subjects(db.search_emails(RECIPIENT, "quarterly report"))
+        assert found[0] == "Quarterly report" and sorted(found) == ["Lunch", "Quarterly report", "Report card"], \
+            f"Unexpected ranking {found}"
+
+        # Results carry the epoch microsecond date they were stored with
+        for mail in db.search_emails(RECIPIENT, "quarterly report"):
+            assert isinstance(mail["received_date"], int)
+            assert started <= from_epoch_us(mail["received_date"]) <= finished, f"Bad date on {mail['subject']}"
+
+        # Quoted text is a phrase, a trailing * a prefix, OR either term
+        assert sorted(subjects(db.search_emails(RECIPIENT, '"quarterly report"'))) == ["Lunch", "Quarterly report"]
+        assert "Reporting lines" in subjects(db.search_emails(RECIPIENT, "report*"))
+        assert "Reporting lines" not in subjects(db.search_emails(RECIPIENT, "report"))
+        assert sorted(subjects(db.search_emails(RECIPIENT, "coffee OR lunch"))) == ["Café opening", "Lunch"]
+
+        # Senders are indexed, accents are folded and snippets mark the match
+        assert subjects(db.search_emails(RECIPIENT, "dave")) == ["Café opening"]
+        assert subjects(db.search_emails(RECIPIENT, "cafe")) == ["Café opening"]
+        snippet = db.search_emails(RECIPIENT, "late")[0]["snippet"]
+        assert "[late]" in snippet, f"Snippet does not mark the match: {snippet!r}"
+
+        # Punctuation never reaches FTS5 as syntax
+        for query in ('"', "*", "report)", "NEAR(", "-"):
+            assert isinstance(db.search_emails(RECIPIENT, query), list)
+
+        # Deleted mail leaves the index, and a rebuilt index finds the rest
+        db.delete_email(ids["Lunch"])
+        assert subjects(db.search_emails(RECIPIENT, '"quarterly report"')) == ["Quarterly report"]
+        conn = db.pool.acquire()
+        conn.execute("INSERT INTO emails_fts (emails_fts) VALUES ('delete-all')")
+        conn.commit()
+        db.pool.release(conn)
+        assert not db.search_emails(RECIPIENT, "numbers"), "Emptied index still matched"
+        assert db.rebuild_search_index()
+        assert sorted(subjects(db.search_emails(RECIPIENT, "numbers"))) == ["Quarterly report", "Reporting lines"]
 
 if __name__ == "__main__":
-    test_search() 
\ No newline at end of file
+    test_search()
+    print("Search tests passed")
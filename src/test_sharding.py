@@ -0,0 +1,122 @@
+#!/usr/bin/env python3
+import os
+from email_db import EmailDatabase
+from sharded_db import ShardedEmailDatabase, open_email_database, shard_index, shard_path
+from shard_rebalance import ShardRebalancer, source_paths
+from mail_fixtures import build_message, temp_dir
+
+RECIPIENTS = [f"user{i}@example{i % 3}.com" for i in range(12)]
+
+def fill_database(db):
+    """Store mail, a read flag, a delete, manifest rows, sync state and a quota per mailbox; returns what to expect"""
+    expected = {}
+    for n, recipient in enumerate(RECIPIENTS):
+        ids = [db.store_email(recipient, build_message(recipient, i)) for i in range(n % 3 + 3)]
+        db.mark_as_read(ids[0])
+        db.delete_email(ids[-1])
+        db.update_file_manifest(recipient, [
+            {"filename": f"20240101000000_{email_id}.eml", "size": 100, "mtime_ns": 1, "content_hash": email_id,
+             "email_id": email_id} for email_id in ids])
+        db.set_sync_state(recipient, 1000 + n, db.get_modseq(recipient))
+        db.set_quota(recipient, max_messages=100 + n)
+        expected[recipient] = {
+            "emails": sorted((mail["id"], mail["is_read"]) for mail in db.get_mailbox(recipient)),
+            "deleted": ids[-1],
+            "manifest": db.get_file_manifest(recipient),
+            "sync_state": db.get_sync_state(recipient),
+        }
+    return expected
+
+def check_layout(shard_dir, count, expected):
+    """Every mailbox, with its state, is on the shard the layout routes it to and nowhere else"""
+    db = ShardedEmailDatabase(shard_dir)
+    try:
+        assert db.shard_count == count, f"Layout has {db.shard_count} shards, expected {count}"
+        for recipient, state in expected.items():
+            home = db.shard_for(recipient)
+            assert home.db_path == shard_path(shard_dir, shard_index(recipient, count)), \
+                f"{recipient} routed to {home.db_path}"
+            for shard in db.shards:
+                if shard is not home:
+                    assert not shard.get_mailbox(recipient), f"{recipient} left mail on {shard.db_path}"
+                    assert shard.export_mailbox_state(recipient) == {"tombstones": [], "manifest": [], "sync_state": None}, \
+                        f"{recipient} left sync state on {shard.db_path}"
+
+            emails = sorted((mail["id"], mail["is_read"]) for mail in home.get_mailbox(recipient))
+            assert emails == state["emails"], f"{recipient} has {emails}, expected {state['emails']}"
+            assert home.get_file_manifest(recipient) == state["manifest"], f"{recipient} lost manifest rows"
+            assert home.get_sync_state(recipient) == state["sync_state"], f"{recipient} lost its sync state"
+            assert home.get_quota(recipient)[0] is not None, f"{recipient} lost its quota"
+
+            # The move deletes every copied email from the source; only the real delete is evidence
+            live = [email_id for email_id, _ in emails]
+            assert home.deleted_ids(recipient, live + [state["deleted"]]) == {state["deleted"]}, \
+                f"{recipient} tombstones are wrong after the move"
+            assert db.deleted_ids(recipient, live + [state["deleted"]]) == {state["deleted"]}
+
+            # Id lookups find the shard; new mail goes to the recipient's shard
+            assert db.get_email(live[0])["recipient"] == recipient
+            new_id = db.store_email(recipient, build_message(recipient, 99))
+            assert new_id in home.existing_ids([new_id]), f"New mail for {recipient} stored on the wrong shard"
+            assert db.delete_email(new_id)
+    finally:
+        db.close()
+
+def rebalance(sources, shard_dir, shard_count):
+    """Run a rebalance to shard_count shards and return its moves, which must be the planned ones"""
+    rebalancer = ShardRebalancer(sources, shard_dir=shard_dir, shard_count=shard_count, pause=0)
+    try:
+        planned = len(rebalancer.plan())
+        moves = rebalancer.run()
+        assert len(moves) == planned, f"Planned {planned} moves, made {len(moves)}"
+        return moves
+    finally:
+        rebalancer.close()
+
+def check_rebalancing(db_path, shard_dir):
+    """1 -> 3 -> 2 shards keep every mailbox, with its sync state, routable"""
+    db = EmailDatabase(db_path)
+    expected = fill_database(db)
+    db.close()
+
+    # Without a layout the single database is opened
+    db = open_email_database(shard_dir=shard_dir, db_path=db_path)
+    assert isinstance(db, EmailDatabase), "Opened shards before any layout exists"
+    db.close()
+
+    # 1 -> 3: every mailbox leaves the single file with its mail and sync state
+    moves = rebalance([db_path], shard_dir, 3)
+    assert len(moves) == len(RECIPIENTS), f"Moved {len(moves)} mailboxes"
+
+    db = EmailDatabase(db_path)
+    try:
+        assert not db.get_recipients(), "Mail left in the single database"
+        for recipient in RECIPIENTS:
+            assert db.export_mailbox_state(recipient) == {"tombstones": [], "manifest": [], "sync_state": None}, \
+                f"{recipient} left sync state in the single database"
+    finally:
+        db.close()
+
+    db = open_email_database(shard_dir=shard_dir, db_path=db_path)
+    assert isinstance(db, ShardedEmailDatabase) and db.shard_count == 3, "open_email_database ignored the layout"
+    db.close()
+    check_layout(shard_dir, 3, expected)
+
+    # 3 -> 2: moves between shards and removes the shard that is no longer used
+    rebalance(source_paths(shard_dir), shard_dir, 2)
+    assert not os.path.exists(shard_path(shard_dir, 2)), "Unused shard was not removed"
+    check_layout(shard_dir, 2, expected)
+
+def test_sharding():
+    """Test splitting one database into shards, routing to them and shrinking the layout"""
+    saved_env = os.environ.pop("EMAIL_DB_SHARDS", None)
+    try:
+        with temp_dir() as work_dir:
+            check_rebalancing(os.path.join(work_dir, "emails.db"), os.path.join(work_dir, "shards"))
+    finally:
+        if saved_env is not None:
+            os.environ["EMAIL_DB_SHARDS"] = saved_env
+
+if __name__ == "__main__":
+    test_sharding()
+    print("Sharding tests passed")
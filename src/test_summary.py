@@ -0,0 +1,71 @@
+#!/usr/bin/env python3
+import random
+from mail_fixtures import build_message, temp_database
+
+RECIPIENTS = ["ann@example.com", "ben@example.com", "cat@example.com"]
+
+def sized_message(recipient, i):
+    """A test message whose size varies with i"""
+    return build_message(recipient, i, body=f"Summary test body {i} " + "x" * (i * 37 % 500))
+
+def recount(db):
+    """The summary rows a COUNT(*) over emails gives"""
+    conn = db.pool.acquire()
+    try:
+        rows = conn.execute('''
+        SELECT recipient, COUNT(*) AS total, SUM(is_read = 0) AS unread, SUM(size) AS bytes, MAX(received_date) AS newest
+        FROM emails GROUP BY recipient ORDER BY recipient
+        ''').fetchall()
+        return [dict(row) for row in rows]
+    finally:
+        db.pool.release(conn)
+
+def random_writes(db, steps, seed=7):
+    """Apply random stores, reads and deletes, checking the summary against a recount after each"""
+    rng = random.Random(seed)
+    counter = 0
+    for step in range(steps):
+        ids = [mail["id"] for recipient in RECIPIENTS for mail in db.get_mailbox(recipient, limit=1000)]
+        action = rng.choice(["store", "store", "store_many", "read", "read_many", "read_all", "delete", "delete_many"])
+        recipient = rng.choice(RECIPIENTS)
+
+        if action == "store" or not ids:
+            counter += 1
+            db.store_email(recipient, sized_message(recipient, counter))
+        elif action == "store_many":
+            items = [(rng.choice(RECIPIENTS), sized_message(recipient, counter + n)) for n in range(1, 4)]
+            counter += 3
+            db.store_many(items + items[:1])
+        elif action == "read":
+            db.mark_as_read(rng.choice(ids))
+        elif action == "read_many":
+            db.mark_read_many(rng.sample(ids, min(3, len(ids))))
+        elif action == "read_all":
+            db.mark_all_read(recipient)
+        elif action == "delete":
+            db.delete_email(rng.choice(ids))
+        else:
+            db.delete_many(rng.sample(ids, min(4, len(ids))))
+
+        assert db.get_mailbox_summary() == recount(db), f"Summary drifted after {action} at step {step}"
+
+def test_mailbox_summary():
+    """Test that the trigger-maintained summary matches a recount after every kind of write"""
+    with temp_database() as db:
+        random_writes(db, 200)
+
+        # Deleting the newest email moves newest back; an emptied mailbox loses its row
+        recipient = "solo@example.com"
+        first = db.store_email(recipient, sized_message(recipient, 1))
+        second = db.store_email(recipient, sized_message(recipient, 2))
+        first_date = db.get_email(first)["received_date"]
+        db.delete_email(second)
+        summary = db.get_mailbox_summary(recipient)
+        assert (summary["total"], summary["newest"]) == (1, first_date), f"Unexpected summary {summary}"
+        db.delete_email(first)
+        assert db.get_mailbox_summary(recipient) == {"recipient": recipient, "total": 0, "unread": 0, "bytes": 0, "newest": None}
+        assert recipient not in [row["recipient"] for row in db.get_mailbox_summary()], "Empty mailbox kept its row"
+
+if __name__ == "__main__":
+    test_mailbox_summary()
+    print("Mailbox summary tests passed")
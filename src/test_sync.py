@@ -0,0 +1,74 @@
+#!/usr/bin/env python3
+import os
+import time
+from mailbox_sync import MailboxSync
+from mail_fixtures import build_message, temp_database, temp_dir
+
+MAILBOX = "sync_at_example_dot_com"
+RECIPIENT = "sync@example.com"
+
+def settle(path):
+    """Date a file or directory a minute back, so the sync treats it as settled"""
+    past = time.time() - 60
+    os.utime(path, (past, past))
+
+def write_message(mailbox_path, name, i):
+    """Write a test message with an mtime old enough to count as settled"""
+    path = os.path.join(mailbox_path, name)
+    with open(path, 'wb') as f:
+        f.write(build_message(RECIPIENT, i))
+    settle(path)
+
+def check_sync(db, mailbox_dir, mailbox_path):
+    """Only changed directories are listed; new, rewritten and deleted files reach the database"""
+    for i in range(20):
+        write_message(mailbox_path, f"20240101000{i:03d}_test.eml", i)
+    settle(mailbox_path)
+
+    # The first run imports everything, the second does not even list the directory
+    stats = MailboxSync(db, mailbox_dir).run_once()
+    assert stats["imported"] == 20, f"First sync imported {stats['imported']} files, expected 20"
+    stats = MailboxSync(db, mailbox_dir).run_once()
+    assert (stats["skipped"], stats["scanned"], stats["imported"]) == (1, 0, 0), f"Unchanged mailbox was listed: {stats}"
+
+    # A file rewritten in place leaves the directory mtime as it was, so only --full finds it
+    dir_stat = os.stat(mailbox_path)
+    write_message(mailbox_path, "20240101000005_test.eml", 200)
+    os.utime(mailbox_path, ns=(dir_stat.st_atime_ns, dir_stat.st_mtime_ns))
+    stats = MailboxSync(db, mailbox_dir, apply_deletions=True).run_once()
+    assert stats["skipped"] == 1 and not stats["imported"], f"Rewrite found without --full: {stats}"
+    stats = MailboxSync(db, mailbox_dir, apply_deletions=True, full=True).run_once()
+    assert (stats["imported"], stats["changed"], stats["removed_emails"]) == (1, 1, 1), \
+        f"Rewritten file: imported {stats['imported']}, changed {stats['changed']}, removed {stats['removed_emails']}"
+    subjects = {mail["subject"] for mail in db.get_mailbox(RECIPIENT, limit=100)}
+    assert "Test message 200" in subjects and "Test message 5" not in subjects, "Rewritten file's email was not replaced"
+
+    # One new file, one deleted file and one email deleted in the database
+    write_message(mailbox_path, "20240102000000_test.eml", 100)
+    os.remove(os.path.join(mailbox_path, "20240101000000_test.eml"))
+    db.delete_email(db.get_file_manifest(RECIPIENT)["20240101000001_test.eml"]["email_id"])
+
+    stats = MailboxSync(db, mailbox_dir).run_once()
+    flagged = sorted((entry["filename"], entry["status"]) for _, entry in stats["flagged"])
+    assert stats["imported"] == 1, f"Sync imported {stats['imported']} new files, expected 1"
+    assert flagged == [("20240101000000_test.eml", "file_missing"),
+                       ("20240101000001_test.eml", "email_deleted")], f"Sync flagged {flagged}"
+
+    # Applying the deletions brings both stores to the same 19 emails
+    stats = MailboxSync(db, mailbox_dir, apply_deletions=True).run_once()
+    files = len(os.listdir(mailbox_path))
+    emails = db.get_usage(RECIPIENT)["message_count"]
+    assert not stats["flagged"] and files == 19 and emails == 19, \
+        f"After applying deletions there are {files} files and {emails} emails"
+
+def test_mailbox_sync():
+    """Test that the sync imports only new or changed files and flags deletions on both sides"""
+    with temp_dir() as work_dir, temp_database() as db:
+        mailbox_dir = os.path.join(work_dir, "mailboxes")
+        mailbox_path = os.path.join(mailbox_dir, MAILBOX)
+        os.makedirs(mailbox_path)
+        check_sync(db, mailbox_dir, mailbox_path)
+
+if __name__ == "__main__":
+    test_mailbox_sync()
+    print("Mailbox sync tests passed")
@@ -0,0 +1,79 @@
+#!/usr/bin/env python3
+from mail_fixtures import build_message, temp_database
+
+RECIPIENT = "threads@example.com"
+
+def message(message_id, subject, in_reply_to=None, references=()):
+    """A test message with the given Message-ID and reply headers"""
+    headers = {}
+    if in_reply_to:
+        headers["In-Reply-To"] = f"<{in_reply_to}@example.com>"
+    if references:
+        headers["References"] = " ".join(f"<{ref}@example.com>" for ref in references)
+    return build_message(RECIPIENT, subject=subject, body=f"Body of {message_id}", message_id=message_id,
+                         headers=headers)
+
+def deliver(db, message_data, recipient=RECIPIENT):
+    """Store a message and return its id"""
+    email_id = db.store_email(recipient, message_data)
+    assert email_id is not None, "Failed to store email"
+    return email_id
+
+def thread_of(db, email_id):
+    """The thread row of the conversation an email belongs to"""
+    thread_id = db.get_email(email_id)["thread_id"]
+    threads, _ = db.get_threads(RECIPIENT, limit=100)
+    return next(thread for thread in threads if thread["thread_id"] == thread_id)
+
+def test_threads():
+    """Test conversation threading when replies arrive before the messages they answer"""
+    with temp_database() as db:
+        # A reply that arrives first starts a thread its parent joins later
+        reply = deliver(db, message("late-reply", "Re: Lunch", in_reply_to="late-parent"))
+        parent = deliver(db, message("late-parent", "Lunch"))
+        thread = thread_of(db, reply)
+        assert db.get_email(parent)["thread_id"] == thread["thread_id"], "Late parent started its own thread"
+        assert (thread["message_count"], thread["unread_count"]) == (2, 2), f"Unexpected counters {thread}"
+        assert thread["subject"] == "Lunch", f"Thread subject kept the reply prefix: {thread['subject']!r}"
+
+        # root <- middle <- leaf: the leaf, which only names the middle message,
+        # and the root arrive first and start two separate threads
+        leaf = deliver(db, message("leaf", "Re: Re: Plans", in_reply_to="middle"))
+        root = deliver(db, message("root", "Plans"))
+        db.mark_as_read(root)
+        assert db.get_email(leaf)["thread_id"] != db.get_email(root)["thread_id"]
+        threads, _ = db.get_threads(RECIPIENT, limit=100)
+        assert len(threads) == 3, f"Expected 3 threads before the merge, found {len(threads)}"
+
+        # The middle message names both, so the two threads merge into the older one
+        leaf_thread = db.get_email(leaf)["thread_id"]
+        middle = deliver(db, message("middle", "Re: Plans", in_reply_to="root", references=["root"]))
+        merged = {db.get_email(email_id)["thread_id"] for email_id in (leaf, root, middle)}
+        assert merged == {leaf_thread}, f"Messages ended up in threads {merged}"
+
+        threads, _ = db.get_threads(RECIPIENT, limit=100)
+        assert len(threads) == 2, f"Merged thread left {len(threads)} threads"
+        thread = thread_of(db, middle)
+        assert (thread["message_count"], thread["unread_count"]) == (3, 2), f"Unexpected counters after merge {thread}"
+        assert thread["last_activity"] == db.get_email(middle)["received_date"]
+        messages = [mail["id"] for mail in db.get_thread_messages(RECIPIENT, thread["thread_id"])]
+        assert messages == [leaf, root, middle], "Thread messages are not in delivery order"
+        assert [t["thread_id"] for t in threads] == [thread["thread_id"], db.get_email(reply)["thread_id"]], \
+            "Threads are not ordered by last activity"
+
+        # Counters follow deletes; the thread goes with its last message
+        db.delete_email(middle)
+        thread = thread_of(db, leaf)
+        assert (thread["message_count"], thread["unread_count"]) == (2, 1), f"Unexpected counters after delete {thread}"
+        assert thread["last_activity"] == db.get_email(root)["received_date"]
+        db.delete_many([leaf, root])
+        threads, _ = db.get_threads(RECIPIENT, limit=100)
+        assert len(threads) == 1, "Thread without messages was not removed"
+
+        # The same Message-IDs in another mailbox form a thread of their own
+        other = deliver(db, message("late-reply", "Re: Lunch", in_reply_to="late-parent"), "other@example.com")
+        assert db.get_email(other)["thread_id"] != db.get_email(reply)["thread_id"], "Mailboxes share a thread"
+
+if __name__ == "__main__":
+    test_threads()
+    print("Thread tests passed")
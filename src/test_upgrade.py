@@ -0,0 +1,107 @@
+#!/usr/bin/env python3
+import os
+import sqlite3
+import datetime
+from email_db import EmailDatabase, to_epoch_us
+from mail_fixtures import build_message, temp_dir
+
+RECIPIENT = "legacy@example.com"
+
+def legacy_message(i):
+    """A test message whose body grows with i"""
+    return build_message(RECIPIENT, i, body=f"Legacy body {i} " + "padding " * (i * 2000))
+
+def create_legacy_database(db_path, count):
+    """Write a database the way the first release did: bodies and raw messages inline, ISO dates"""
+    conn = sqlite3.connect(db_path)
+    conn.execute('''
+    CREATE TABLE emails (
+        id TEXT PRIMARY KEY,
+        sender TEXT NOT NULL,
+        recipient TEXT NOT NULL,
+        subject TEXT,
+        body TEXT,
+        received_date TIMESTAMP NOT NULL,
+        is_read BOOLEAN DEFAULT 0,
+        raw_email BLOB,
+        attachments TEXT
+    )
+    ''')
+    conn.execute("CREATE INDEX idx_recipient ON emails (recipient)")
+
+    start = datetime.datetime(2024, 1, 1, 12, 0, 0)
+    rows = []
+    for i in range(count):
+        message = legacy_message(i)
+        rows.append({
+            "id": f"20240101120000_<test-{i}-{RECIPIENT.replace('@', '.')}@example.com>",
+            "subject": f"Test message {i}",
+            "body": message.split(b"\n\n", 1)[1].decode(),
+            "received_date": (start + datetime.timedelta(minutes=i, microseconds=i)).isoformat(),
+            "is_read": i % 2,
+            "raw_email": message,
+        })
+    conn.executemany('''
+    INSERT INTO emails (id, sender, recipient, subject, body, received_date, is_read, raw_email, attachments)
+    VALUES (:id, 'sender@example.com', 'legacy@example.com', :subject, :body, :received_date, :is_read, :raw_email, '[]')
+    ''', rows)
+    conn.commit()
+    conn.close()
+    return rows
+
+def check_upgrade(db, legacy):
+    """The old rows lost their inline content to email_bodies and email_raw and read back unchanged"""
+    # The listing table keeps metadata only; content moved to its own tables
+    conn = db.pool.acquire()
+    try:
+        columns = {row[1] for row in conn.execute("PRAGMA table_info(emails)").fetchall()}
+        counts = [conn.execute(f"SELECT COUNT(*) FROM {table}").fetchone()[0] for table in ("email_bodies", "email_raw")]
+    finally:
+        db.pool.release(conn)
+    assert not columns & {"body", "raw_email"}, f"Listing table still holds content: {columns}"
+    assert counts == [len(legacy)] * 2, f"Content tables hold {counts} rows"
+
+    # Listings carry no content; get_email loads the body, and the raw message only when asked
+    listed = db.get_mailbox(RECIPIENT)
+    assert [mail["subject"] for mail in listed] == [row["subject"] for row in reversed(legacy)]
+    assert not any({"body", "raw_email"} & set(mail) for mail in listed)
+    for row in legacy:
+        mail = db.get_email(row["id"])
+        assert mail["body"] == row["body"] and "raw_email" not in mail, f"Wrong content for {row['id']}"
+        assert db.get_email(row["id"], include_raw=True)["raw_email"] == row["raw_email"]
+        assert db.get_raw_email(row["id"]) == row["raw_email"]
+        assert mail["size"] == len(row["raw_email"]) and bool(mail["is_read"]) == bool(row["is_read"])
+        # Local ISO strings became UTC epoch microseconds
+        assert mail["received_date"] == to_epoch_us(datetime.datetime.fromisoformat(row["received_date"])), \
+            f"received_date of {row['id']} converted to {mail['received_date']}"
+
+    # The summary, search index and threads were built from the copied rows
+    summary = db.get_mailbox_summary(RECIPIENT)
+    assert (summary["total"], summary["unread"]) == (len(legacy), sum(1 - row["is_read"] for row in legacy))
+    assert summary["bytes"] == sum(len(row["raw_email"]) for row in legacy)
+    assert len(db.search_emails(RECIPIENT, "legacy body")) == len(legacy), "Copied rows are not searchable"
+    assert db.get_threads(RECIPIENT)[0], "Copied rows were not threaded"
+
+def test_schema_upgrade():
+    """Test that opening a first-release database moves content out of the listing table"""
+    with temp_dir() as path:
+        db_path = os.path.join(path, "emails.db")
+        legacy = create_legacy_database(db_path, 6)
+        db = EmailDatabase(db_path)
+        try:
+            check_upgrade(db, legacy)
+            new_id = db.store_email(RECIPIENT, legacy_message(10))
+        finally:
+            db.close()
+
+        # New mail is stored the same way, and a second open changes nothing
+        db = EmailDatabase(db_path)
+        try:
+            assert len(db.get_mailbox(RECIPIENT)) == 7 and db.get_email(new_id)["subject"] == "Test message 10"
+            assert all(db.get_email(row["id"])["body"] == row["body"] for row in legacy)
+        finally:
+            db.close()
+
+if __name__ == "__main__":
+    test_schema_upgrade()
+    print("Upgrade tests passed")
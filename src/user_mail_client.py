@@ -1,8 +1,9 @@
 #!/usr/bin/env python3
 import tkinter as tk
-from tkinter import ttk, scrolledtext, messagebox
+from tkinter import ttk, scrolledtext, messagebox, filedialog
 import os
 import re
+import shutil
 import smtplib
 from email.mime.text import MIMEText
 from email.mime.multipart import MIMEMultipart
@@ -12,11 +13,17 @@ from email.utils import formatdate, parsedate_to_datetime
 import datetime
 import json
 import uuid
-from email_db import EmailDatabase  # Import the EmailDatabase class
+from email_db import from_epoch_us, MessageCache
+from header_index import HeaderIndex
+from mail_query import QuerySyntaxError, compile_query
+from sharded_db import open_email_database, database_available
 
 # Load environment variables
 load_dotenv()
 
+# How often the inbox asks the database for changes
+POLL_INTERVAL_MS = 5000
+
 class LoginRegisterFrame(ttk.Frame):
     """Login and registration frame"""
     def __init__(self, master, auth_callback, parent_app):
@@ -286,7 +293,24 @@ class MailClientApp(tk.Tk):
         self.status_var.set("Ready")
         
         # Initialize the email database
-        self.email_db = EmailDatabase()
+        self.email_db = open_email_database()
+        
+        # Parsed .eml files, so reopening one skips the disk and the MIME parser
+        self.file_cache = MessageCache()
+        
+        # Inbox paging state: tokens of the pages before the current one
+        self.page_size = 50
+        self.page_tokens = []
+        self.current_page_token = None
+        self.next_page_token = None
+        
+        # The list shows single emails ("inbox"), conversations ("threads") or search results ("search")
+        self.view_mode = "inbox"
+        
+        # Modseq the inbox page is current with, and the newest date on the first page
+        self.inbox_modseq = None
+        self.inbox_newest = None
+        self.poll_job = None
         
         # Show login/register view
         self.show_login_view()
@@ -462,6 +486,14 @@ class MailClientApp(tk.Tk):
         )
         refresh_button.pack(side=tk.LEFT, padx=(0, 10))
         
+        # Conversations view, built from the database thread index
+        threads_button = ttk.Button(
+            top_frame,
+            text="Conversations",
+            command=self.view_threads
+        )
+        threads_button.pack(side=tk.LEFT)
+        
         # Add search functionality
         search_label = ttk.Label(top_frame, text="Search:")
         search_label.pack(side=tk.LEFT, padx=(10, 5))
@@ -520,16 +552,57 @@ class MailClientApp(tk.Tk):
         
         self.email_tree.pack(fill=tk.BOTH, expand=True)
         
+        # Unread database emails are shown in bold
+        self.email_tree.tag_configure('unread', font=("Arial", 10, "bold"))
+        
         # Bind double-click event to view email
         self.email_tree.bind("<Double-1>", self.view_selected_email)
         
-        # Add delete button below the treeview
+        # Paging and delete buttons below the treeview
+        actions_frame = ttk.Frame(mailbox_frame)
+        actions_frame.pack(fill=tk.X, pady=(0, 10))
+        
+        previous_button = ttk.Button(
+            actions_frame,
+            text="< Previous",
+            command=self.previous_page
+        )
+        previous_button.pack(side=tk.LEFT)
+        
+        next_button = ttk.Button(
+            actions_frame,
+            text="Next >",
+            command=self.next_page
+        )
+        next_button.pack(side=tk.LEFT, padx=(5, 0))
+        
         delete_button = ttk.Button(
-            mailbox_frame,
-            text="Delete Selected Email",
+            actions_frame,
+            text="Delete Selected",
             command=self.delete_selected_email
         )
-        delete_button.pack(anchor=tk.E, pady=(0, 10))
+        delete_button.pack(side=tk.RIGHT)
+        
+        mark_all_read_button = ttk.Button(
+            actions_frame,
+            text="Mark All Read",
+            command=self.mark_all_read
+        )
+        mark_all_read_button.pack(side=tk.RIGHT, padx=(0, 5))
+        
+        mark_read_button = ttk.Button(
+            actions_frame,
+            text="Mark Selected Read",
+            command=self.mark_selected_read
+        )
+        mark_read_button.pack(side=tk.RIGHT, padx=(0, 5))
+        
+        save_button = ttk.Button(
+            actions_frame,
+            text="Save Original...",
+            command=self.save_selected_email
+        )
+        save_button.pack(side=tk.RIGHT, padx=(0, 5))
         
         # Email view frame
         email_view_frame = ttk.LabelFrame(mailbox_frame, text="Email Content")
@@ -545,12 +618,119 @@ class MailClientApp(tk.Tk):
         
         # Automatically load user's inbox
         self.view_user_inbox()
+        self.schedule_poll()
     
     def view_user_inbox(self):
-        """View emails in the user's inbox"""
+        """View the first page of the user's inbox"""
+        self.view_mode = "inbox"
+        self.page_tokens = []
+        self.load_inbox_page(None)
+    
+    def view_threads(self):
+        """View the first page of the user's conversations"""
+        if not database_available():
+            messagebox.showinfo("Conversations unavailable",
+                "Conversations require database storage. Please run the migrate_to_db.py script first.")
+            return
+        
+        self.view_mode = "threads"
+        self.page_tokens = []
+        self.load_threads_page(None)
+    
+    def load_page(self, page_token):
+        """Load a page of whichever list is showing"""
+        if self.view_mode == "threads":
+            self.load_threads_page(page_token)
+        else:
+            self.load_inbox_page(page_token)
+    
+    def next_page(self):
+        """Show the next page of the inbox"""
+        if not self.next_page_token:
+            self.status_var.set("No more emails")
+            return
+        
+        self.page_tokens.append(self.current_page_token)
+        self.load_page(self.next_page_token)
+    
+    def previous_page(self):
+        """Show the previous page of the inbox"""
+        if not self.page_tokens:
+            self.status_var.set("Already on the first page")
+            return
+        
+        self.load_page(self.page_tokens.pop())
+    
+    def load_threads_page(self, page_token):
+        """Load one page of the user's conversations into the treeview"""
         if not self.current_user:
             return
-            
+        
+        self.current_page_token = page_token
+        email = self.current_user['email']
+        
+        for item in self.email_tree.get_children():
+            self.email_tree.delete(item)
+        
+        self.email_content.config(state="normal")
+        self.email_content.delete(1.0, tk.END)
+        self.email_content.config(state="disabled")
+        
+        # Counts and last activity come precomputed from the thread index
+        threads, self.next_page_token = self.email_db.get_threads(
+            email, limit=self.page_size, page_token=page_token
+        )
+        
+        if not threads:
+            self.status_var.set(f"No conversations found for {email}")
+            return
+        
+        first_number = len(self.page_tokens) * self.page_size + 1
+        for i, thread in enumerate(threads, first_number):
+            count = f"{thread['message_count']} message{'s' if thread['message_count'] != 1 else ''}"
+            date_str = from_epoch_us(thread['last_activity']).strftime("%Y-%m-%d %H:%M:%S")
+            self.email_tree.insert("", "end", values=(i, count, thread['subject'], date_str),
+                                  tags=(str(thread['thread_id']), 'thread') + (('unread',) if thread['unread_count'] else ()))
+        
+        more = " (more available)" if self.next_page_token else ""
+        self.status_var.set(f"Loaded conversations {first_number}-{first_number + len(threads) - 1} for {email}{more}")
+    
+    def show_thread(self, thread_id):
+        """Show every message of a conversation, replies indented under their parents"""
+        messages = self.email_db.get_thread_messages(self.current_user['email'], thread_id)
+        
+        # Depth from the parent links stored at delivery
+        depths = {}
+        for mail in messages:
+            depths[mail['message_id']] = depths.get(mail['parent_message_id'], -1) + 1
+        
+        self.email_content.config(state="normal")
+        self.email_content.delete(1.0, tk.END)
+        
+        for mail in messages:
+            indent = "    " * depths.get(mail['message_id'], 0)
+            mail_data = self.email_db.get_email(mail['id']) or {}
+            date_str = from_epoch_us(mail['received_date']).strftime("%Y-%m-%d %H:%M:%S")
+            self.email_content.insert(tk.END, f"{indent}From: {mail['sender']}  ({date_str})\n")
+            self.email_content.insert(tk.END, f"{indent}Subject: {mail['subject']}\n")
+            for line in (mail_data.get('body') or "").splitlines():
+                self.email_content.insert(tk.END, f"{indent}{line}\n")
+            self.email_content.insert(tk.END, "-" * 60 + "\n")
+        
+        self.email_content.config(state="disabled")
+        self.status_var.set(f"Showing conversation with {len(messages)} messages")
+    
+    def load_inbox_page(self, page_token):
+        """Load one page of the user's inbox into the treeview"""
+        if not self.current_user:
+            return
+        
+        self.view_mode = "inbox"
+        self.current_page_token = page_token
+        self.next_page_token = None
+        self.inbox_modseq = None
+        self.inbox_newest = None
+        
         self.status_var.set(f"Loading emails for {self.current_user['email']}...")
         
         # Clear the treeview
@@ -566,36 +746,44 @@ class MailClientApp(tk.Tk):
         email = self.current_user['email']
         
         # Try to use database first, fall back to file system if needed
-        use_db = os.path.exists("database/emails.db")
+        use_db = database_available()
         
         if use_db:
-            # Get emails from database
-            emails = self.email_db.get_mailbox(email)
+            # Changes after this modseq are picked up by poll_changes
+            modseq = self.email_db.get_modseq(email)
+            
+            # Get one page of emails from database; each page is an index seek
+            emails, self.next_page_token = self.email_db.get_mailbox_page(
+                email, limit=self.page_size, page_token=page_token
+            )
+            self.inbox_modseq = modseq
+            if not self.page_tokens:
+                self.inbox_newest = emails[0]['received_date'] if emails else 0
             
             if not emails:
                 self.status_var.set(f"No emails found in mailbox for {email}")
                 return
             
+            # Number rows continuously across pages
+            first_number = len(self.page_tokens) * self.page_size + 1
+            
             # Add emails to the treeview
-            for i, mail in enumerate(emails, 1):
+            for i, mail in enumerate(emails, first_number):
                 sender = mail['sender']
                 subject = mail['subject']
-                date_str = mail['received_date']
-                
-                try:
-                    # Try to format the date nicely
-                    date_obj = datetime.fromisoformat(date_str)
-                    date_str = date_obj.strftime("%Y-%m-%d %H:%M:%S")
-                except:
-                    # If parsing fails, use the original date string
-                    pass
+                # Stored as epoch microseconds, so no string parsing per row
+                date_str = from_epoch_us(mail['received_date']).strftime("%Y-%m-%d %H:%M:%S")
                 
                 # Insert with database ID as tag
                 self.email_tree.insert("", "end", values=(i, sender, subject, date_str), 
-                                      tags=(mail['id'], 'db'))
-            
-            self.status_var.set(f"Loaded {len(emails)} emails for {self.current_user['email']}")
+                                      tags=(mail['id'], 'db') + (() if mail['is_read'] else ('unread',)))
             
+            # Mailbox totals come from the summary row, not a COUNT(*) over the inbox
+            summary = self.email_db.get_mailbox_summary(email) or {"total": 0, "unread": 0}
+            more = " (more available)" if self.next_page_token else ""
+            self.status_var.set(f"Loaded emails {first_number}-{first_number + len(emails) - 1} of {summary['total']} "
+                                f"({summary['unread']} unread) for {self.current_user['email']}{more}")
+        
         else:
             # Fall back to file system
             user_dir = email.replace('@', '_at_').replace('.', '_dot_')
@@ -605,41 +793,89 @@ class MailClientApp(tk.Tk):
                 self.status_var.set(f"No mailbox found for {email}")
                 return
             
-            # Get all .eml files
-            import glob
-            import email
-            from email.policy import default
-            
-            email_files = sorted(glob.glob(os.path.join(mailbox_path, "*.eml")))
+            # Listing headers come from the mailbox's header index, which
+            # reads only the header block of files added or changed since
+            email_files = HeaderIndex(mailbox_path).list_emails()
             
             if not email_files:
                 self.status_var.set(f"No emails found in mailbox for {email}")
                 return
             
             # Add emails to the treeview
-            for i, email_file in enumerate(email_files, 1):
-                with open(email_file, 'rb') as f:
-                    msg = email.message_from_binary_file(f, policy=default)
-                    sender = msg.get("From", "Unknown")
-                    subject = msg.get("Subject", "No Subject")
-                    
-                    # Get date and format it nicely
-                    date_str = msg.get("Date", "Unknown Date")
-                    try:
-                        if date_str != 'Unknown Date':
-                            # Try to parse and format the date
-                            date_obj = parsedate_to_datetime(date_str)
-                            date_str = date_obj.strftime("%Y-%m-%d %H:%M:%S")
-                    except:
-                        # If parsing fails, use the original date string
-                        pass
-                    
-                    # Tag with file path and 'file' tag
-                    self.email_tree.insert("", "end", values=(i, sender, subject, date_str), 
-                                          tags=(email_file, 'file'))
+            for i, entry in enumerate(email_files, 1):
+                date_str = entry["date"]
+                try:
+                    if date_str != 'Unknown':
+                        # Try to parse and format the date
+                        date_obj = parsedate_to_datetime(date_str)
+                        date_str = date_obj.strftime("%Y-%m-%d %H:%M:%S")
+                except:
+                    # If parsing fails, use the original date string
+                    pass
+                
+                # Tag with file path and 'file' tag
+                self.email_tree.insert("", "end", values=(i, entry["from"], entry["subject"], date_str), 
+                                      tags=(entry["path"], 'file'))
             
             self.status_var.set(f"Loaded {len(email_files)} emails for {self.current_user['email']}")
     
+    def schedule_poll(self):
+        """Check for mailbox changes again after POLL_INTERVAL_MS"""
+        if self.poll_job:
+            self.after_cancel(self.poll_job)
+        self.poll_job = self.after(POLL_INTERVAL_MS, self.poll_changes)
+    
+    def poll_changes(self):
+        """Bring the inbox page up to date with the changes since it was listed"""
+        self.poll_job = None
+        if not self.current_user:
+            return
+        
+        if self.view_mode == "inbox" and self.inbox_modseq is not None:
+            # Costs one index range per change, however large the mailbox is
+            changes = self.email_db.changes_since(self.current_user['email'], self.inbox_modseq)
+            if changes and changes['full_resync']:
+                self.load_inbox_page(self.current_page_token)
+            elif changes and changes['modseq'] != self.inbox_modseq:
+                self.apply_changes(changes)
+        
+        self.schedule_poll()
+    
+    def apply_changes(self, changes):
+        """Apply new, changed and deleted emails from changes_since to the inbox page"""
+        items = {self.email_tree.item(item, "tags")[0]: item for item in self.email_tree.get_children()}
+        
+        # Deleted emails leave the list
+        for email_id in changes['deleted']:
+            if email_id in items:
+                self.email_tree.delete(items.pop(email_id))
+        
+        for mail in changes['changed']:
+            tags = (mail['id'], 'db') + (() if mail['is_read'] else ('unread',))
+            
+            # Read flags change in place
+            if mail['id'] in items:
+                self.email_tree.item(items[mail['id']], tags=tags)
+            
+            # Mail newer than anything listed goes on top of the first page
+            elif self.inbox_newest is not None and mail['received_date'] > self.inbox_newest:
+                date_str = from_epoch_us(mail['received_date']).strftime("%Y-%m-%d %H:%M:%S")
+                items[mail['id']] = self.email_tree.insert("", 0, values=(0, mail['sender'], mail['subject'], date_str),
+                                                           tags=tags)
+                self.inbox_newest = mail['received_date']
+        
+        # Renumber the rows after insertions and removals
+        first_number = len(self.page_tokens) * self.page_size + 1
+        for i, item in enumerate(self.email_tree.get_children(), first_number):
+            values = list(self.email_tree.item(item, "values"))
+            values[0] = i
+            self.email_tree.item(item, values=values)
+        
+        self.inbox_modseq = changes['modseq']
+        summary = self.email_db.get_mailbox_summary(self.current_user['email']) or {"total": 0, "unread": 0}
+        self.status_var.set(f"{summary['total']} emails ({summary['unread']} unread) for {self.current_user['email']}, "
+                            f"updated {datetime.datetime.now().strftime('%H:%M:%S')}")
+    
     def view_selected_email(self, event):
         """View the selected email"""
         selection = self.email_tree.selection()
@@ -653,32 +889,33 @@ class MailClientApp(tk.Tk):
         email_id = tags[0]
         source_type = tags[1] if len(tags) > 1 else 'file'  # Default to file if not specified
         
-        if source_type == 'db':
+        if source_type == 'thread':
+            self.show_thread(int(email_id))
+        
+        elif source_type == 'db':
             # Read from database
             mail_data = self.email_db.get_email(email_id)
             
             if not mail_data:
                 self.status_var.set(f"Error: Email not found in database")
                 return
-                
-            # Mark as read
-            self.email_db.mark_as_read(email_id)
+            
+            # Mark as read; an email that already is needs no write
+            if not mail_data['is_read']:
+                self.email_db.mark_as_read(email_id)
+            self.email_tree.item(item, tags=(email_id, 'db'))
             
             # Clear content and add email details
             self.email_content.config(state="normal")
             self.email_content.delete(1.0, tk.END)
             
-            # Format date if possible
-            date_str = mail_data['received_date']
-            try:
-                date_obj = datetime.fromisoformat(date_str)
-                date_str = date_obj.strftime("%Y-%m-%d %H:%M:%S")
-            except:
-                pass
-                
+            date_str = from_epoch_us(mail_data['received_date']).strftime("%Y-%m-%d %H:%M:%S")
+            
             # Add headers
             self.email_content.insert(tk.END, f"From: {mail_data['sender']}\n")
-            self.email_content.insert(tk.END, f"To: {mail_data['recipient']}\n")
+            self.email_content.insert(tk.END, f"To: {mail_data['to_header'] or mail_data['recipient']}\n")
+            if mail_data['cc_header']:
+                self.email_content.insert(tk.END, f"Cc: {mail_data['cc_header']}\n")
             self.email_content.insert(tk.END, f"Subject: {mail_data['subject']}\n")
             self.email_content.insert(tk.END, f"Date: {date_str}\n")
             
@@ -691,58 +928,81 @@ class MailClientApp(tk.Tk):
                         self.email_content.insert(tk.END, ", ".join(attachments) + "\n")
                 except:
                     pass
-                    
+            
             self.email_content.insert(tk.END, "-" * 60 + "\n")
             
             # Add body
             self.email_content.insert(tk.END, mail_data['body'])
-            
+        
         else:
-            # Read from file (existing implementation)
-            email_file = email_id
-            import email
-            from email.policy import default
+            # Read from file, parsing it only on the first open
+            mail_view = self.load_file_view(email_id)
             
-            with open(email_file, 'rb') as f:
-                msg = email.message_from_binary_file(f, policy=default)
-                
-                # Clear the content area
-                self.email_content.config(state="normal")
-                self.email_content.delete(1.0, tk.END)
-                
-                # Get date and format it nicely if possible
-                date_str = msg.get('Date', 'Unknown Date')
-                try:
-                    if date_str != 'Unknown Date':
-                        # Try to parse and format the date nicely
-                        date_obj = parsedate_to_datetime(date_str)
-                        date_str = date_obj.strftime("%Y-%m-%d %H:%M:%S")
-                except:
-                    # If parsing fails, use the original date string
-                    pass
-                
-                # Add email headers
-                self.email_content.insert(tk.END, f"From: {msg.get('From', 'Unknown')}\n")
-                self.email_content.insert(tk.END, f"To: {msg.get('To', 'Unknown')}\n")
-                self.email_content.insert(tk.END, f"Subject: {msg.get('Subject', 'No Subject')}\n")
-                self.email_content.insert(tk.END, f"Date: {date_str}\n")
-                self.email_content.insert(tk.END, "-" * 60 + "\n")
-                
-                # Add email body
-                for part in msg.walk():
-                    content_type = part.get_content_type()
-                    content_disposition = str(part.get("Content-Disposition"))
-                    
-                    # Skip attachments
-                    if "attachment" in content_disposition:
-                        self.email_content.insert(tk.END, f"[Attachment: {part.get_filename()}]\n")
-                        continue
-                    
-                    if content_type == "text/plain":
-                        self.email_content.insert(tk.END, part.get_content())
+            # Clear the content area
+            self.email_content.config(state="normal")
+            self.email_content.delete(1.0, tk.END)
+            
+            # Add email headers
+            self.email_content.insert(tk.END, f"From: {mail_view['from']}\n")
+            self.email_content.insert(tk.END, f"To: {mail_view['to']}\n")
+            self.email_content.insert(tk.END, f"Subject: {mail_view['subject']}\n")
+            self.email_content.insert(tk.END, f"Date: {mail_view['date']}\n")
+            self.email_content.insert(tk.END, "-" * 60 + "\n")
+            
+            # Add email body
+            self.email_content.insert(tk.END, mail_view['body'])
         
         self.email_content.config(state="disabled")
     
+    def load_file_view(self, email_file):
+        """Headers and text of an email file, from the cache while the file is unchanged"""
+        key = (email_file, os.path.getmtime(email_file))
+        mail_view = self.file_cache.get(key)
+        if mail_view is not None:
+            return mail_view
+        
+        import email
+        from email.policy import default
+        
+        with open(email_file, 'rb') as f:
+            msg = email.message_from_binary_file(f, policy=default)
+        
+        # Get date and format it nicely if possible
+        date_str = msg.get('Date', 'Unknown Date')
+        try:
+            if date_str != 'Unknown Date':
+                # Try to parse and format the date nicely
+                date_obj = parsedate_to_datetime(date_str)
+                date_str = date_obj.strftime("%Y-%m-%d %H:%M:%S")
+        except:
+            # If parsing fails, use the original date string
+            pass
+        
+        # Text parts make up the body; attachments are only named
+        body = []
+        for part in msg.walk():
+            content_type = part.get_content_type()
+            content_disposition = str(part.get("Content-Disposition"))
+            
+            # Skip attachments
+            if "attachment" in content_disposition:
+                body.append(f"[Attachment: {part.get_filename()}]\n")
+                continue
+            
+            if content_type == "text/plain":
+                body.append(part.get_content())
+        
+        mail_view = {
+            'from': str(msg.get('From', 'Unknown')),
+            'to': str(msg.get('To', 'Unknown')),
+            'subject': str(msg.get('Subject', 'No Subject')),
+            'date': date_str,
+            'body': "".join(body),
+            'path': email_file,
+        }
+        self.file_cache.put(key, mail_view)
+        return mail_view
+    
     def check_recipient(self, *args):
         """Check if recipient email is valid and has a mailbox"""
         email = self.recipient_var.get()
@@ -771,10 +1031,10 @@ class MailClientApp(tk.Tk):
             return False
         
         # Check in database if available
-        if os.path.exists("database/emails.db"):
+        if database_available():
             # Just verify email format, can't check if recipient exists in DB beforehand
             return True
-            
+        
         # Fallback to file system check
         user = email.replace('@', '_at_').replace('.', '_dot_')
         mailbox_path = os.path.join(self.mailbox_dir, user)
@@ -857,8 +1117,11 @@ class MailClientApp(tk.Tk):
         """Handle user logout"""
         self.auth.logout()
         self.current_user = None
+        if self.poll_job:
+            self.after_cancel(self.poll_job)
+            self.poll_job = None
         self.show_login_view()
-        
+    
     def search_emails(self):
         """Search emails in the user's mailbox"""
         if not self.current_user:
@@ -870,11 +1133,18 @@ class MailClientApp(tk.Tk):
             self.status_var.set("Please enter a search term")
             return
         
+        # Report a bad field term (is:, larger:, dates) instead of showing no results
+        try:
+            compile_query(query)
+        except QuerySyntaxError as e:
+            messagebox.showerror("Invalid search", str(e))
+            return
+        
         email_address = self.current_user['email']
         self.status_var.set(f"Searching for '{query}' in {email_address}'s mailbox...")
         
         # Only database supports search
-        if not os.path.exists("database/emails.db"):
+        if not database_available():
             messagebox.showinfo("Search unavailable", 
                 "Search functionality requires database storage. Please run the migrate_to_db.py script first.")
             return
@@ -882,82 +1152,167 @@ class MailClientApp(tk.Tk):
         # Clear the treeview
         for item in self.email_tree.get_children():
             self.email_tree.delete(item)
+        self.view_mode = "search"
         
-        # Search emails in database
+        # Plain words use the ranked full-text index, field terms and
+        # operators such as from: or is:unread the compiled query
         emails = self.email_db.search_emails(email_address, query)
         
+        # Clear the email content
+        self.email_content.config(state="normal")
+        self.email_content.delete(1.0, tk.END)
+        
         if not emails:
+            self.email_content.config(state="disabled")
             self.status_var.set(f"No emails found matching '{query}'")
             return
         
+        # Show the highlighted matches until an email is opened
+        for i, mail in enumerate(emails, 1):
+            snippet = " ".join((mail.get('snippet') or "").split())
+            self.email_content.insert(tk.END, f"{i}. {mail['subject']}\n   {snippet}\n\n")
+        self.email_content.config(state="disabled")
+        
         # Add search results to the treeview
         for i, mail in enumerate(emails, 1):
             sender = mail['sender']
             subject = mail['subject']
-            date_str = mail['received_date']
-            
-            try:
-                # Try to format the date nicely
-                date_obj = datetime.fromisoformat(date_str)
-                date_str = date_obj.strftime("%Y-%m-%d %H:%M:%S")
-            except:
-                # If parsing fails, use the original date string
-                pass
+            date_str = from_epoch_us(mail['received_date']).strftime("%Y-%m-%d %H:%M:%S")
             
             # Insert with database ID as tag
             self.email_tree.insert("", "end", values=(i, sender, subject, date_str), 
-                                  tags=(mail['id'], 'db'))
+                                  tags=(mail['id'], 'db') + (() if mail['is_read'] else ('unread',)))
         
         self.status_var.set(f"Found {len(emails)} emails matching '{query}'")
-
+    
     def clear_search(self):
         """Clear search and reload inbox"""
         self.search_var.set("")
         self.view_user_inbox()
-
+    
+    def get_selected_emails(self):
+        """Split the selected rows into database emails and email files"""
+        db_items = []
+        file_items = []
+        
+        for item in self.email_tree.selection():
+            tags = self.email_tree.item(item, "tags")
+            source_type = tags[1] if len(tags) > 1 else 'file'  # Default to file if not specified
+            if source_type == 'db':
+                db_items.append((item, tags[0]))
+            elif source_type == 'file':
+                file_items.append((item, tags[0]))
+        
+        return db_items, file_items
+    
+    def save_selected_email(self):
+        """Save the original message of the selected email to a .eml file"""
+        db_items, file_items = self.get_selected_emails()
+        
+        if not db_items and not file_items:
+            messagebox.showinfo("No selection", "Please select an email to save.")
+            return
+        
+        output_path = filedialog.asksaveasfilename(defaultextension=".eml",
+                                                   filetypes=[("Email messages", "*.eml")])
+        if not output_path:
+            return
+        
+        # Stream the message in chunks, whatever its size
+        if db_items:
+            reader = self.email_db.open_raw_email(db_items[0][1])
+            if reader is None:
+                self.status_var.set("Error: Email not found in database")
+                return
+            with reader, open(output_path, 'wb') as f:
+                shutil.copyfileobj(reader, f)
+        else:
+            shutil.copyfile(file_items[0][1], output_path)
+        
+        self.status_var.set(f"Saved email to {output_path}")
+    
     def delete_selected_email(self):
-        """Delete the selected email"""
-        selection = self.email_tree.selection()
+        """Delete the selected emails"""
+        db_items, file_items = self.get_selected_emails()
+        count = len(db_items) + len(file_items)
         
-        if not selection:
+        if not count:
             messagebox.showinfo("No Selection", "Please select an email to delete")
             return
         
-        # Get the item and its tags
-        item = selection[0]
-        tags = self.email_tree.item(item, "tags")
-        email_id = tags[0]
-        source_type = tags[1] if len(tags) > 1 else 'file'  # Default to file if not specified
-        
         # Confirm deletion
-        if not messagebox.askyesno("Confirm Delete", "Are you sure you want to delete this email?"):
+        prompt = "Are you sure you want to delete this email?" if count == 1 else f"Are you sure you want to delete these {count} emails?"
+        if not messagebox.askyesno("Confirm Delete", prompt):
             return
         
+        deleted = []
+        failed = 0
+        
         try:
-            if source_type == 'db':
-                # Delete from database
-                if self.email_db.delete_email(email_id):
-                    self.status_var.set("Email deleted successfully from database")
-                else:
-                    messagebox.showerror("Error", "Failed to delete email from database")
-                    return
-            else:
-                # Delete from file system
-                email_file = email_id
-                os.remove(email_file)
-                self.status_var.set("Email deleted successfully from file system")
+            if db_items:
+                # Delete from database in a single transaction
+                results = self.email_db.delete_many([email_id for _, email_id in db_items])
+                for (item, _), ok in zip(db_items, results):
+                    if ok:
+                        deleted.append(item)
+                    else:
+                        failed += 1
+            
+            # Delete from file system
+            for item, email_file in file_items:
+                try:
+                    os.remove(email_file)
+                    self.file_cache.invalidate_where(lambda view, path=email_file: view['path'] == path)
+                    deleted.append(item)
+                except OSError:
+                    failed += 1
             
             # Remove from UI
-            self.email_tree.delete(item)
+            for item in deleted:
+                self.email_tree.delete(item)
             
             # Clear the content area
             self.email_content.config(state="normal")
             self.email_content.delete(1.0, tk.END)
             self.email_content.config(state="disabled")
             
+            if failed:
+                messagebox.showerror("Error", f"Failed to delete {failed} of {count} emails")
+            self.status_var.set(f"Deleted {len(deleted)} email(s)")
+        
         except Exception as e:
             messagebox.showerror("Error", f"Failed to delete email: {e}")
             self.status_var.set(f"Error deleting email: {e}")
+    
+    def mark_selected_read(self):
+        """Mark the selected database emails as read"""
+        db_items, _ = self.get_selected_emails()
+        
+        if not db_items:
+            messagebox.showinfo("No Selection", "Please select emails stored in the database to mark as read")
+            return
+        
+        results = self.email_db.mark_read_many([email_id for _, email_id in db_items])
+        for (item, email_id), ok in zip(db_items, results):
+            if ok:
+                self.email_tree.item(item, tags=(email_id, 'db'))
+        
+        self.status_var.set(f"Marked {sum(results)} email(s) as read")
+    
+    def mark_all_read(self):
+        """Mark every email in the user's mailbox as read"""
+        if not self.current_user:
+            return
+        
+        changed = self.email_db.mark_all_read(self.current_user['email'])
+        
+        # Drop the unread styling from the rows on screen
+        for item in self.email_tree.get_children():
+            tags = self.email_tree.item(item, "tags")
+            if 'unread' in tags:
+                self.email_tree.item(item, tags=tuple(tag for tag in tags if tag != 'unread'))
+        
+        self.status_var.set(f"Marked {changed} email(s) as read")
 
 def main():
     app = MailClientApp()